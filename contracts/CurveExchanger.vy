@@ -14,9 +14,12 @@ interface ChainlinkAggregatorV3Interface:
 
 interface CurvePool:
     def exchange(i: int128, j: int128, dx: uint256, min_dy: uint256) -> uint256: payable
+    def get_dy(i: int128, j: int128, dx: uint256) -> uint256: view
 
 interface Lido:
     def submit(ref: address) -> uint256: payable
+    def getSharesByPooledEth(_ethAmount: uint256) -> uint256: view
+    def getPooledEthByShares(_sharesAmount: uint256) -> uint256: view
 
 
 event SoldStETHToETH:
@@ -137,3 +140,124 @@ def stakeETH4StETH() -> uint256:
     )
 
     return steth_amount
+
+
+@internal
+def _swap_steth_to_eth(steth_amount: uint256, min_eth_amount: uint256) -> uint256:
+    assert steth_amount > 0, "zero stETH amount"
+    assert steth_amount <= ERC20(STETH_TOKEN).balanceOf(self), "insufficient stETH balance"
+
+    ERC20(STETH_TOKEN).approve(CURVE_STETH_POOL, steth_amount)
+
+    eth_amount: uint256 = CurvePool(CURVE_STETH_POOL).exchange(
+        CURVE_STETH_INDEX,
+        CURVE_ETH_INDEX,
+        steth_amount,
+        min_eth_amount
+    )
+
+    log SoldStETHToETH(
+        steth_amount,
+        eth_amount
+    )
+
+    return eth_amount
+
+
+@internal
+def _swap_eth_to_steth(eth_amount: uint256, min_steth_amount: uint256) -> uint256:
+    assert eth_amount > 0, "zero ETH amount"
+    assert eth_amount <= self.balance, "insufficient ETH balance"
+
+    steth_before: uint256 = ERC20(STETH_TOKEN).balanceOf(self)
+    CurvePool(CURVE_STETH_POOL).exchange(
+        CURVE_ETH_INDEX,
+        CURVE_STETH_INDEX,
+        eth_amount,
+        min_steth_amount, value=eth_amount
+    )
+    # stETH transfers may round down by a wei, count what actually arrived
+    steth_amount: uint256 = ERC20(STETH_TOKEN).balanceOf(self) - steth_before
+
+    log SoldETHToStETH(
+        eth_amount,
+        steth_amount
+    )
+
+    return steth_amount
+
+
+@internal
+def _stake_eth_for_steth(eth_amount: uint256) -> uint256:
+    assert eth_amount > 0, "zero ETH amount"
+    assert eth_amount <= self.balance, "insufficient ETH balance"
+
+    steth_before: uint256 = ERC20(STETH_TOKEN).balanceOf(self)
+    Lido(STETH_TOKEN).submit(ZERO_ADDRESS, value=eth_amount)
+    steth_amount: uint256 = ERC20(STETH_TOKEN).balanceOf(self) - steth_before
+
+    log StakedETHToStETH(
+        eth_amount,
+        steth_amount
+    )
+
+    return steth_amount
+
+
+# Explicit-amount entry points: ETH sent along with the call is added to the balance first,
+# so funding and trading take a single transaction.
+
+# stETH -> ETH (Curve)
+@external
+@payable
+def swapStETH2ETHAmount(steth_amount: uint256, min_eth_amount: uint256) -> uint256:
+    return self._swap_steth_to_eth(steth_amount, min_eth_amount)
+
+
+# ETH -> stETH (Curve)
+@external
+@payable
+def swapETH2StETHAmount(eth_amount: uint256, min_steth_amount: uint256) -> uint256:
+    return self._swap_eth_to_steth(eth_amount, min_steth_amount)
+
+
+# ETH -> stETH (Lido)
+@external
+@payable
+def stakeETH4StETHAmount(eth_amount: uint256) -> uint256:
+    return self._stake_eth_for_steth(eth_amount)
+
+
+# ETH -> stETH (Curve or Lido) -> ETH (Curve) in one transaction
+@external
+@payable
+def roundTripETH(eth_amount: uint256, stake: bool, min_eth_amount: uint256) -> uint256:
+    steth_amount: uint256 = 0
+    if stake:
+        steth_amount = self._stake_eth_for_steth(eth_amount)
+    else:
+        steth_amount = self._swap_eth_to_steth(eth_amount, 0)
+
+    return self._swap_steth_to_eth(steth_amount, min_eth_amount)
+
+
+# Quotes at the current state
+
+@external
+@view
+def quoteETH2StETH(eth_amount: uint256) -> uint256:
+    return CurvePool(CURVE_STETH_POOL).get_dy(CURVE_ETH_INDEX, CURVE_STETH_INDEX, eth_amount)
+
+
+@external
+@view
+def quoteStETH2ETH(steth_amount: uint256) -> uint256:
+    return CurvePool(CURVE_STETH_POOL).get_dy(CURVE_STETH_INDEX, CURVE_ETH_INDEX, steth_amount)
+
+
+@external
+@view
+def quoteStakeETH4StETH(eth_amount: uint256) -> uint256:
+    # minted shares are rounded down, ignores the (negligible) share price change of the submit itself
+    shares: uint256 = Lido(STETH_TOKEN).getSharesByPooledEth(eth_amount)
+    return Lido(STETH_TOKEN).getPooledEthByShares(shares)
@@ -1,2 +1,18 @@
 #!/usr/bin/env sh
+# FORK_RPC_URL replaces the upstream passed with --fork/--fork.url (e.g. the caching proxy of utils/rpc_cache.py),
+# FORK_BLOCK pins the fork block unless --fork.blockNumber is already given.
+pinned=""
+prev=""
+for arg do
+  shift
+  case "$prev" in
+    --fork|--fork.url) [ -n "$FORK_RPC_URL" ] && arg="$FORK_RPC_URL" ;;
+  esac
+  [ "$arg" = "--fork.blockNumber" ] && pinned=1
+  set -- "$@" "$arg"
+  prev="$arg"
+done
+if [ -n "$FORK_BLOCK" ] && [ -z "$pinned" ]; then
+  set -- "$@" --fork.blockNumber "$FORK_BLOCK"
+fi
 npx ganache-cli "$@"
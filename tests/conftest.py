@@ -1,47 +1,134 @@
+import inspect
 import pytest
 import os
 
 from typing import Optional
 
-from brownie import chain, ZERO_ADDRESS
+from brownie import chain, web3, ZERO_ADDRESS
 
-from utils.config import *
+import utils.config as config
+from utils.scenarios import prepare_oracle
+from utils.snapshot_tree import ScenarioTree
+from utils.result_cache import ResultCache
+from utils.rpc_profile import RpcProfiler
+import utils.batch_reads as batch_reads
+import utils.fork_daemon as fork_daemon
+import utils.results as results
+import utils.trace_profile as trace_profile
+
+_rpc_profiler: Optional[RpcProfiler] = None
+
+@pytest.fixture(scope="session", autouse=True)
+def fork_daemon_baseline():
+    """Attached to `python -m utils.fork_daemon`: start from its pinned baseline, not from the last session's state."""
+    if fork_daemon.attached():
+        fork_daemon.adopt_baseline()
+
+@pytest.fixture(scope="session", autouse=True)
+def rpc_profile(fork_daemon_baseline):
+    """RPC_PROFILE=<trace.json> profiles every JSON-RPC call of the session (see utils/rpc_profile.py)."""
+    global _rpc_profiler
+    path = os.environ.get('RPC_PROFILE')
+    if not path:
+        yield None
+        return
+    _rpc_profiler = RpcProfiler().install(web3.provider)
+    yield _rpc_profiler
+    _rpc_profiler.uninstall()
+    _rpc_profiler.dump(path)
+
+@pytest.fixture(scope="session", autouse=True)
+def read_cache(rpc_profile):
+    """Serves repeated reads of unchanged state from memory; READ_CACHE=0 turns it off (see utils/batch_reads.py)."""
+    if os.environ.get('READ_CACHE', '1') == '0':
+        yield None
+        return
+    batch_reads.cache.install(web3.provider)
+    yield batch_reads.cache
+    batch_reads.cache.uninstall()
+
+@pytest.fixture(scope="session")
+def result_cache():
+    """On-disk cell results keyed by FORK_BLOCK and code hashes; RESULT_CACHE=0 turns it off (see utils/result_cache.py)."""
+    cache = ResultCache.from_env()
+    yield cache
+    cache.evict()
+
+@pytest.fixture(scope="session", autouse=True)
+def results_sink():
+    """RESULTS_PATH=<results.csv|results.parquet> writes the scenario result rows (see utils/results.py)."""
+    path = os.environ.get('RESULTS_PATH')
+    if path:
+        results.recorder.open(path)
+    yield results.recorder
+    results.recorder.close()
+
+@pytest.fixture(scope="session", autouse=True)
+def trace_profiler():
+    """TRACE_PROFILE=<profile.json> profiles the gas of the sandwich and report transactions (see utils/trace_profile.py)."""
+    path = os.environ.get('TRACE_PROFILE')
+    if not path:
+        yield None
+        return
+    trace_profile.profiler.enabled = True
+    yield trace_profile.profiler
+    trace_profile.profiler.enabled = False
+    trace_profile.profiler.dump(path)
+
+def pytest_terminal_summary(terminalreporter):
+    if _rpc_profiler is not None:
+        terminalreporter.section('RPC profile')
+        terminalreporter.write_line(_rpc_profiler.report())
+        terminalreporter.write_line(f"trace written to {os.environ['RPC_PROFILE']}")
+    if trace_profile.profiler.transactions:
+        terminalreporter.section('Gas profile')
+        terminalreporter.write_line(trace_profile.profiler.report())
+        terminalreporter.write_line(f"profile written to {os.environ['TRACE_PROFILE']}")
+
+@pytest.fixture(scope="module")
+def scenario_tree(module_isolation):
+    return ScenarioTree()
 
 @pytest.fixture(scope="function", autouse=True)
-def shared_setup(fn_isolation):
-    pass
+def shared_setup(request, rpc_profile):
+    if rpc_profile is not None:
+        rpc_profile.start_test(request.node.name)
+    tree = request.getfixturevalue('scenario_tree')
+    if 'scenario_tree' in inspect.signature(request.function).parameters:
+        # the test enters the tree, which reverts to a cached setup prefix (see utils/snapshot_tree.py)
+        yield
+    else:
+        tree.reset()
+        request.getfixturevalue('fn_isolation')
+        yield
 
 @pytest.fixture(scope='module')
-def dao_voting(interface):
-    return interface.Voting(lido_dao_voting_address)
+def dao_voting():
+    return config.contracts.voting
 
 @pytest.fixture(scope='module')
-def lido(interface):
-    return interface.Lido(lido_dao_steth_address)
+def lido():
+    return config.contracts.lido
 
 @pytest.fixture(scope="module")
-def acl(interface):
-    return interface.ACL(lido_dao_acl_address)
+def acl():
+    return config.contracts.acl
 
 @pytest.fixture(scope="module")
-def oracle(interface, dao_voting):
-    oracle = interface.LidoOracle(lido_dao_oracle)
-
-    oracle.setAllowedBeaconBalanceAnnualRelativeIncrease(2800, {'from': dao_voting.address}) # TODO: remove this temporary hack
-    oracle.reportBeacon(159300, 4700878413390971, 141433, {'from': p2p_oracle_address}) # TODO: remove this temporary hack
+def oracle(accounts, dao_voting):
+    return prepare_oracle(
+        accounts, config.contracts.oracle, dao_voting,
+        config.p2p_oracle_address, config.lido_dao_execution_layer_rewards_vault
+    )
 
-    vault = accounts.at(lido_dao_execution_layer_rewards_vault, force=True)
-    vault.transfer(ZERO_ADDRESS, vault.balance(), gas_price=0)
-    return oracle
+@pytest.fixture(scope="module")
+def composite_post_rebase_beacon_receiver():
+    return config.contracts.composite_post_rebase_beacon_receiver
 
 @pytest.fixture(scope="module")
-def composite_post_rebase_beacon_receiver(interface):
-    return interface.CompositePostRebaseBeaconReceiver(
-        lido_dao_composite_post_rebase_beacon_receiver
-    )
+def self_owned_steth_burner():
+    return config.contracts.self_owned_steth_burner
 
 @pytest.fixture(scope="module")
-def self_owned_steth_burner(interface):
-    return interface.SelfOwnedStETHBurner(
-        lido_dao_self_owned_steth_burner
-    )
+def curve_pool():
+    return config.contracts.curve_pool
@@ -0,0 +1,132 @@
+"""
+Tests for the read cache on a fake provider: what is cached, what invalidates, and batched reads
+
+"""
+
+import pytest
+
+from utils.batch_reads import ReadCache, Read, balance, read
+from utils.rpc_profile import RpcProfiler
+import utils.batch_reads as batch_reads
+import utils.rpc as rpc
+
+
+HOLDER = '0x' + '55' * 20
+
+
+class Provider:
+    """Answers every request with its sequence number, so a cached answer is told apart from a new one."""
+    def __init__(self):
+        self.requests = []
+
+    def make_request(self, method, params):
+        self.requests.append(method)
+        return {'jsonrpc': '2.0', 'result': hex(len(self.requests))}
+
+    def encode_rpc_request(self, method, params):
+        return b'{}'
+
+    def decode_rpc_response(self, raw):
+        return raw
+
+
+@pytest.fixture
+def provider():
+    provider = Provider()
+    batch_reads.cache.install(provider)
+    yield provider
+    batch_reads.cache.uninstall()
+
+
+def test_reads_are_cached_until_a_transaction(provider):
+    params = [HOLDER, 'latest']
+    first = provider.make_request('eth_getBalance', params)
+    assert provider.make_request('eth_getBalance', params) == first
+    assert provider.make_request('eth_getBalance', [HOLDER, '0x1']) != first
+    assert provider.requests == ['eth_getBalance'] * 2
+
+    provider.make_request('eth_sendTransaction', [{'from': HOLDER}])
+    assert provider.make_request('eth_getBalance', params) != first
+
+
+@pytest.mark.parametrize('method', ['eth_sendRawTransaction', 'evm_revert', 'evm_mine', 'evm_increaseTime', 'evm_setAccountStorageAt'])
+def test_state_changes_invalidate(provider, method):
+    first = provider.make_request('eth_call', [{'to': HOLDER}, 'latest'])
+    provider.make_request(method, [])
+    assert provider.make_request('eth_call', [{'to': HOLDER}, 'latest']) != first
+
+
+@pytest.mark.parametrize('method', sorted(batch_reads.passthrough_methods))
+def test_passthrough_methods_keep_the_cache(provider, method):
+    first = provider.make_request('eth_call', [{'to': HOLDER}, 'latest'])
+    provider.make_request(method, [])
+    provider.make_request(method, [])
+    assert provider.make_request('eth_call', [{'to': HOLDER}, 'latest']) == first
+    # passthrough answers are never cached themselves
+    assert provider.requests == ['eth_call', method, method]
+
+
+def test_errors_are_not_cached():
+    class Failing(Provider):
+        def make_request(self, method, params):
+            self.requests.append(method)
+            return {'jsonrpc': '2.0', 'error': {'code': -32000, 'message': 'header not found'}}
+
+    provider = Failing()
+    cache = ReadCache().install(provider)
+    provider.make_request('eth_call', [{}, 'latest'])
+    provider.make_request('eth_call', [{}, 'latest'])
+    assert provider.requests == ['eth_call'] * 2
+
+    cache.uninstall()
+    assert 'make_request' not in provider.__dict__
+    assert cache.get('eth_call', [{}, 'latest']) is None
+
+
+def test_read_batches_the_misses(monkeypatch, provider):
+    batches = []
+
+    def batch(url, calls):
+        batches.append(calls)
+        return [hex(100 + ind) for ind, _ in enumerate(calls)]
+
+    monkeypatch.setattr(rpc, 'provider_url', lambda: 'http://node')
+    monkeypatch.setattr(rpc, 'batch', batch)
+
+    # one read answered by the provider hook before, two missing
+    cached = provider.make_request('eth_getBalance', [HOLDER, 'latest'])
+    other = Read('eth_getBalance', ['0x' + '66' * 20, 'latest'], lambda result: int(result, 16))
+    code = Read('eth_getCode', [HOLDER, 'latest'], str)
+    assert read(balance(HOLDER), other, code) == [int(cached['result'], 16), 100, '0x65']
+    assert batches == [[other[:2], code[:2]]]
+
+    # the batched results are now served by the provider hook too
+    assert provider.make_request('eth_getCode', [HOLDER, 'latest'])['result'] == '0x65'
+    assert read(other, code) == [100, '0x65']
+    assert len(batches) == 1
+
+
+def test_profiler_sees_reads_sent_around_the_provider(monkeypatch):
+    class Response:
+        def __init__(self, request, timeout):
+            self.body = b'[{"jsonrpc": "2.0", "id": 0, "result": "0x1"}, {"jsonrpc": "2.0", "id": 1, "result": "0x2"}]'
+
+        def __enter__(self):
+            return self
+
+        def __exit__(self, *exc):
+            return False
+
+        def read(self):
+            return self.body
+
+    monkeypatch.setattr(rpc.urllib.request, 'urlopen', Response)
+    profiler = RpcProfiler().install(Provider())
+    profiler.mark('quorum')
+    assert rpc.batch('http://node', [('eth_call', []), ('eth_getBalance', [])]) == ['0x1', '0x2']
+    profiler.uninstall()
+    rpc.batch('http://node', [('eth_call', []), ('eth_getBalance', [])])
+
+    row, = profiler.summary()
+    assert (row['step'], row['method'], row['count']) == ('quorum', 'batch[eth_call,eth_getBalance]', 1)
+    assert row['received'] == len(Response(None, None).body)
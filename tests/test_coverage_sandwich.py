@@ -7,9 +7,14 @@ import math
 
 import pytest
 
-from brownie import ZERO_ADDRESS, CurveExchanger
+from brownie import CurveExchanger
 from utils.config import network_name
+from utils.lido_model import LidoModel, SANDWICHER, VICTIM, VOTING, WHALE, coverage_grid, coverage_pnl
+from utils.optimize import ForkEvaluator, break_even_quota, coverage_quota_scenario
+from utils.stableswap import StableSwapPool
 import utils.log as log
+import utils.results as results
+import utils.scenarios as scenarios
 
 
 ########################################################################################################
@@ -27,152 +32,102 @@ import utils.log as log
 ########################################################################################################
 
 
-initial_victim_stETH_balance = 100 * 10**18
-initial_sandwicher_ETH_balance = 10000 * 10**18
-burn_quota_bp = 8
+burn_quota_bp = scenarios.burn_quota_bp
 
+model_quotas = [1, 2, 4, 8, 16, 32, 64, 100]
+model_slashings = [-25, -50, -100, -200, -400]
 
-# Large ETH holder
-eth_holder: str = '0x00000000219ab540356cBB839Cbe05303d7705Fa'
 
 @pytest.fixture(scope="module")
 def sandwicher(accounts):
-    exchanger = CurveExchanger.deploy({'from': accounts[0]})
-    # burn extra funds
-    exchanger_acc = accounts.at(exchanger, force=True)
-    exchanger_acc.transfer(ZERO_ADDRESS, exchanger_acc.balance(), gas_price=0)
-    return exchanger
-
-def _round10(val: int) -> int:
-    return ((val + 9) // 10) * 10
-
-def before_sandwicher_step_in(
-    accounts, dao_voting, lido, oracle, acl,
-    composite_post_rebase_beacon_receiver,
-    self_owned_steth_burner, sandwicher
-):
-    netname = network_name().split('-')[0]
-    assert netname in ("goerli", "mainnet"), "Incorrect network name"
-
-    self_owned_steth_burner.setBurnAmountPerRunQuota(burn_quota_bp, {'from': dao_voting})
-
-    whale = accounts.at(eth_holder, force=True)
-    whale.transfer(sandwicher, initial_sandwicher_ETH_balance, gas_price=0)
-    assert initial_sandwicher_ETH_balance == sandwicher.balance(), "wrong balance"
-
-    lido.submit(ZERO_ADDRESS, {'from': accounts[0], 'value': 100*10**18})
-    lido.submit(ZERO_ADDRESS, {'from': whale, 'value': 50000*10**18})
-
-    total_ether_before = lido.getTotalPooledEther()
-
-    log.h(log.highlight('--- 0. Forked state', log.color_yellow))
-    assert _round10(initial_victim_stETH_balance) == _round10(lido.balanceOf(accounts[0].address)), "wrong balance"
-    log.ok('Victim initial stETH balance', initial_victim_stETH_balance / 10**18)
+    return scenarios.deploy_sandwicher(CurveExchanger, accounts)
 
-    # 1% slashing (-100 basis points totalPooledEther change)
-    oracle_report(lido, oracle, -100)
 
-    log.h(log.highlight('--- 1. Slashing just happenned (1% loss)', log.color_yellow))
-    log.ok('Victim after-slashing stETH balance', lido.balanceOf(accounts[0].address) / 10**18)
-    total_ether_after = lido.getTotalPooledEther()
-    ether_loss = total_ether_before - total_ether_after
-    log.ok('Lido total ether loss', ether_loss // 10**18)
-    steth_amount_to_recover = lido.getPooledEthByShares(0.01 * lido.getTotalShares())
-
-    log.h(log.highlight('--- 2. Coverage application decided', log.color_yellow))
-    assert initial_sandwicher_ETH_balance == sandwicher.balance(), "wrong balance"
-    log.ok('Sandwicher initial ETH balance', initial_sandwicher_ETH_balance / 10**18)
-
-    return steth_amount_to_recover
-
-def after_sandwicher_step_in(
-    accounts, dao_voting, lido, oracle,
-    self_owned_steth_burner, sandwicher,
-    steth_amount_to_recover
+def _coverage_sandwiching(
+    strategy, scenario_tree, sandwicher, accounts, dao_voting, lido, oracle, self_owned_steth_burner
 ):
-    log.ok('Sandwicher initial stETH balance', lido.balanceOf(sandwicher.address) / 10**18)
-
-    whale = accounts.at(eth_holder, force=True)
-    lido.transfer(dao_voting.address, steth_amount_to_recover, { 'from': whale })
-    apply_coverage(self_owned_steth_burner, dao_voting, oracle, lido, steth_amount_to_recover)
-
-    log.h(log.highlight(f'--- 3. First round of coverage applied with quota {burn_quota_bp} BP', log.color_yellow))
-    log.ok('Sandwicher stETH balance (after first round of coverage)', lido.balanceOf(sandwicher.address) / 10**18)
-
-    sandwicher.swapStETH2ETH({'from': accounts[0]})
-    log.ok('Sandwicher ETH balance (after swap)', sandwicher.balance() / 10**18)
-
-    assert sandwicher.balance() < initial_sandwicher_ETH_balance, \
-        f"Sandwicher wins {(sandwicher.balance() - initial_sandwicher_ETH_balance) / 10**18} ETH"
-
-    log.nb('Sandwicher loss (ETH)', (initial_sandwicher_ETH_balance - sandwicher.balance()) / 10**18)
-
-    while lido.balanceOf(self_owned_steth_burner) > 0:
-        oracle_report(lido, oracle, 0)
+    netname = network_name().split('-')[0]
+    assert netname in ("goerli", "mainnet"), "Incorrect network name"
 
-    log.h(log.highlight('--- 4. Coverage applied completely', log.color_yellow))
+    *_, steth_amount_to_recover = scenario_tree.enter(scenarios.coverage_steps(
+        accounts, dao_voting, lido, oracle, self_owned_steth_burner, sandwicher, burn_quota_bp
+    ))
+    entry = scenarios.step_in(sandwicher, strategy, accounts[0])
+    with results.context(strategy=strategy):
+        sandwicher_pnl, _ = scenarios.after_sandwicher_step_in(
+            accounts, dao_voting, lido, oracle,
+            self_owned_steth_burner, sandwicher, entry, steth_amount_to_recover, burn_quota_bp
+        )
 
-    log.ok('Victim stETH balance (recovered)', lido.balanceOf(accounts[0].address) / 10**18)
-    log.nb('Victim loss (stETH)', (initial_victim_stETH_balance - lido.balanceOf(accounts[0].address)) / 10**18)
+    assert sandwicher_pnl < 0, f"Sandwicher wins {sandwicher_pnl / 10**18} ETH"
 
 
 def test_coverage_sandwiching_trading_only(
-    sandwicher, accounts, dao_voting, lido, oracle, acl,
+    scenario_tree, sandwicher, accounts, dao_voting, lido, oracle, acl,
     composite_post_rebase_beacon_receiver, self_owned_steth_burner
 ):
-    steth_amount_to_recover = before_sandwicher_step_in(
-        accounts, dao_voting, lido, oracle, acl,
-        composite_post_rebase_beacon_receiver, self_owned_steth_burner, sandwicher
-    )
-    sandwicher.swapETH2StETH({'from': accounts[0]})
-    after_sandwicher_step_in(
-        accounts, dao_voting, lido, oracle,
-        self_owned_steth_burner, sandwicher, steth_amount_to_recover
+    _coverage_sandwiching(
+        'trade', scenario_tree, sandwicher, accounts, dao_voting, lido, oracle, self_owned_steth_burner
     )
 
 def test_coverage_sandwiching_staking_trading(
-    sandwicher, accounts, dao_voting, lido, oracle, acl,
+    scenario_tree, sandwicher, accounts, dao_voting, lido, oracle, acl,
     composite_post_rebase_beacon_receiver, self_owned_steth_burner
 ):
-    steth_amount_to_recover = before_sandwicher_step_in(
-        accounts, dao_voting, lido, oracle, acl,
-        composite_post_rebase_beacon_receiver, self_owned_steth_burner, sandwicher
-    )
-    sandwicher.stakeETH4StETH({'from': accounts[0]})
-    after_sandwicher_step_in(
-        accounts, dao_voting, lido, oracle,
-        self_owned_steth_burner, sandwicher, steth_amount_to_recover
+    _coverage_sandwiching(
+        'stake', scenario_tree, sandwicher, accounts, dao_voting, lido, oracle, self_owned_steth_burner
     )
 
 
-def oracle_report(lido, oracle, change):
-    _, validators, beaconBalance = lido.getBeaconStat()
-
-    expectedEpoch = oracle.getExpectedEpochId()
-    reporters = oracle.getOracleMembers()
-    quorum = oracle.getQuorum()
-
-    before_share_price = lido.getPooledEthByShares(10 ** 27)
-    buffered = lido.getTotalPooledEther() - beaconBalance
-
-    if change > 0:
-        change = change / 0.9 # protocol fee
-
-    new_total_pooled_ether = lido.getTotalPooledEther() * (1. + change / 10000.)
-    new_balance = new_total_pooled_ether - buffered
-
-    for reporter in reporters[:quorum]:
-        oracle.reportBeacon(expectedEpoch, int(new_balance / 10**9 + 0.5), validators, { 'from': reporter })
+@pytest.mark.parametrize('strategy', ['trade', 'stake'])
+def test_coverage_break_even_quota(
+    strategy, sandwicher, accounts, dao_voting, lido, oracle, self_owned_steth_burner
+):
+    evaluate = ForkEvaluator(coverage_quota_scenario(
+        accounts, dao_voting, lido, oracle, self_owned_steth_burner, sandwicher, strategy
+    ))
+    result = break_even_quota(evaluate, 1, 100)
 
-    after_share_price = lido.getPooledEthByShares(10 ** 27)
-    real_change = (after_share_price / before_share_price - 1.) * 10000.
+    log.h(f'Break-even burn quota ({strategy})')
+    for quota_bp, pnl in result.trace:
+        log.ok(f'Sandwicher PnL with quota {quota_bp} BP (ETH)', pnl / 10**18)
+    log.nb('Highest unprofitable quota (BP)', result.x)
 
-    #assert math.isclose(change, real_change, rel_tol=1e-2, abs_tol=0.0), "unexpected change"
+    assert result.x >= burn_quota_bp, f"Sandwicher wins with quota {result.x + 1} BP"
 
 
-def apply_coverage(steth_burner, dao_voting, oracle, lido, steth_amount):
-    lido.approve(steth_burner.address, steth_amount, { 'from': dao_voting.address })
+@pytest.mark.parametrize('strategy', ['trade', 'stake'])
+def test_coverage_model_spot_check(
+    strategy, sandwicher, accounts, dao_voting, lido, oracle, self_owned_steth_burner, curve_pool
+):
+    model = LidoModel.from_fork(lido, self_owned_steth_burner, {
+        VICTIM: accounts[0].address,
+        SANDWICHER: sandwicher.address,
+        WHALE: scenarios.eth_holder,
+        VOTING: dao_voting.address,
+    })
+    pool = StableSwapPool.from_contract(curve_pool)
+
+    log.h(f'Model coverage grid ({strategy})')
+    for row in coverage_grid(model, pool, strategy, model_quotas, model_slashings):
+        log.ok(
+            f'Quota {row["quota_bp"]} BP, slashing {row["slashing_bp"]} BP',
+            f'PnL {row["pnl"] / 10**18:.4f} ETH, victim loss {row["victim_loss"] / 10**18:.6f} stETH, '
+            f'{row["rounds"]} reports'
+        )
+
+    expected_pnl, expected_victim_loss, _ = coverage_pnl(model, pool, strategy, burn_quota_bp)
+    actual_pnl, actual_victim_loss = scenarios.coverage_cell(
+        accounts, dao_voting, lido, oracle, self_owned_steth_burner, sandwicher, strategy, burn_quota_bp
+    )
 
-    steth_burner.requestBurnMyStETHForCover(steth_amount, { 'from': dao_voting.address })
+    log.h(f'Spot check quota {burn_quota_bp} BP')
+    log.ok('Model PnL (ETH)', expected_pnl / 10**18)
+    log.ok('Fork PnL (ETH)', actual_pnl / 10**18)
+    log.ok('Model victim loss (stETH)', expected_victim_loss / 10**18)
+    log.ok('Fork victim loss (stETH)', actual_victim_loss / 10**18)
 
-    oracle_report(lido, oracle, 0)
+    assert math.isclose(actual_victim_loss, expected_victim_loss, rel_tol=0, abs_tol=10**6), \
+        "share accounting model diverges from the fork"
+    assert math.isclose(actual_pnl, expected_pnl, rel_tol=0, abs_tol=2e-5 * scenarios.initial_sandwicher_ETH_balance), \
+        "model diverges from the fork"
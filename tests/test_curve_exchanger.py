@@ -0,0 +1,61 @@
+"""
+Tests for the amount-parametrised and round-trip CurveExchanger entry points
+
+"""
+
+import pytest
+
+from brownie import CurveExchanger
+import utils.scenarios as scenarios
+
+
+amounts = [x * 10**18 for x in [1, 100, 10_000]]
+
+
+@pytest.fixture(scope="module")
+def sandwicher(accounts):
+    return scenarios.deploy_sandwicher(CurveExchanger, accounts)
+
+
+@pytest.fixture(scope="module")
+def whale(accounts):
+    return accounts.at(scenarios.eth_holder, force=True)
+
+
+@pytest.mark.parametrize('amount', amounts)
+def test_swap_amounts_match_quotes(sandwicher, whale, lido, amount):
+    expected_steth = sandwicher.quoteETH2StETH(amount)
+    tx = sandwicher.swapETH2StETHAmount(amount, 0, {'from': whale, 'value': amount, 'gas_price': 0})
+
+    steth_amount = tx.return_value
+    assert abs(steth_amount - expected_steth) <= 2, "stETH received differs from the quote"
+    assert tx.events['SoldETHToStETH']['steth_amount'] == steth_amount
+    assert lido.balanceOf(sandwicher) == steth_amount
+
+    expected_eth = sandwicher.quoteStETH2ETH(steth_amount)
+    tx = sandwicher.swapStETH2ETHAmount(steth_amount, expected_eth, {'from': whale})
+    assert tx.return_value == expected_eth
+
+
+@pytest.mark.parametrize('amount', amounts)
+def test_stake_amount_matches_quote(sandwicher, whale, amount):
+    expected_steth = sandwicher.quoteStakeETH4StETH(amount)
+    tx = sandwicher.stakeETH4StETHAmount(amount, {'from': whale, 'value': amount, 'gas_price': 0})
+
+    assert abs(tx.return_value - expected_steth) <= 2, "stETH received differs from the quote"
+
+
+@pytest.mark.parametrize('stake', [False, True])
+def test_round_trip_in_one_transaction(sandwicher, whale, stake):
+    amount = 1_000 * 10**18
+    tx = sandwicher.roundTripETH(amount, stake, 0, {'from': whale, 'value': amount, 'gas_price': 0})
+
+    # no rebase in between: the round trip only pays fees and slippage
+    assert 0 < tx.return_value < amount
+    assert sandwicher.balance() == tx.return_value
+    assert tx.events['SoldStETHToETH']['eth_amount'] == tx.return_value
+
+
+def test_amount_above_balance_reverts(sandwicher, whale):
+    with pytest.reverts("insufficient ETH balance"):
+        sandwicher.swapETH2StETHAmount(10**18, 0, {'from': whale})
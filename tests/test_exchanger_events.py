@@ -0,0 +1,54 @@
+"""
+Tests for decoding CurveExchanger logs into round trips
+
+"""
+
+from utils.exchanger_events import ExchangerEvent, RoundTrip, _decode, fetch, round_trip
+import utils.rpc as rpc
+
+
+EXCHANGER = '0x' + '44' * 20
+
+
+def _log(signature, first, second, block, log_index):
+    return {
+        'address': EXCHANGER,
+        'topics': [rpc.topic(signature)],
+        'data': '0x' + hex(first)[2:].rjust(64, '0') + hex(second)[2:].rjust(64, '0'),
+        'blockNumber': hex(block),
+        'transactionHash': '0x' + f'{block:02x}' * 32,
+        'logIndex': hex(log_index),
+    }
+
+
+def test_decode_orders_amounts_by_leg():
+    # `SoldStETHToETH` logs the stETH amount first
+    assert _decode(_log('SoldStETHToETH(uint256,uint256)', 7, 5, 12, 3)) == ExchangerEvent('exit', 5, 7, 12, '0x' + '0c' * 32, 3)
+    assert _decode(_log('SoldETHToStETH(uint256,uint256)', 5, 7, 10, 0)).eth_amount == 5
+    assert _decode(_log('StakedETHToStETH(uint256,uint256)', 5, 5, 10, 1)).leg == 'stake'
+
+
+def test_round_trip_from_logs(monkeypatch):
+    logs = [
+        _log('SoldStETHToETH(uint256,uint256)', 199 * 10**18, 201 * 10**18, 12, 0),
+        _log('StakedETHToStETH(uint256,uint256)', 40 * 10**18, 40 * 10**18, 10, 2),
+        _log('SoldETHToStETH(uint256,uint256)', 160 * 10**18, 159 * 10**18, 10, 1),
+    ]
+    requests = []
+
+    def request(url, method, params):
+        requests.append((method, params))
+        return logs
+
+    monkeypatch.setattr(rpc, 'request', request)
+    events = fetch(EXCHANGER, 10, url='http://node')
+
+    (method, [query]), = requests
+    assert method == 'eth_getLogs'
+    assert (query['fromBlock'], query['toBlock']) == ('0xa', 'latest')
+    assert [event.leg for event in events] == ['trade', 'stake', 'exit']
+
+    trip = round_trip(events)
+    assert trip == RoundTrip(['trade', 'stake', 'exit'], 200 * 10**18, 199 * 10**18, 201 * 10**18)
+    assert trip.pnl == 10**18
+    assert round_trip([]).pnl == 0
@@ -0,0 +1,152 @@
+"""
+Tests for the block-indexed history: ingest of a synthetic dump, resumption, torn appends and lookups
+
+"""
+
+import gzip
+import json
+import os
+
+import pytest
+
+from utils.history_index import COLUMNS, DTYPE, GWEI, HistoryIndex, ingest
+from utils.lido_model import LidoModel
+from utils.monitor import oracle_topics, pool_topics
+from utils.stableswap import ETH_INDEX, STETH_INDEX
+import utils.rpc as rpc
+
+
+ADDRESSES = {'lido': '0x' + '11' * 20, 'oracle': '0x' + '22' * 20, 'pool': '0x' + '33' * 20}
+TOKEN_EXCHANGE = next(topic for topic, name in pool_topics.items() if name == 'token_exchange')
+COMPLETED = next(topic for topic, name in oracle_topics.items() if name == 'completed')
+POST_TOTAL_SHARES = next(topic for topic, name in oracle_topics.items() if name == 'post_total_shares')
+
+SNAPSHOT = {
+    'block': 9,
+    'buffered_ether': 1_000 * 10**18,
+    'deposited_validators': 100,
+    'beacon_validators': 100,
+    'beacon_balance': 3_200 * 10**18,
+    'total_shares': 4_000 * 10**18,
+    'fee_bp': 1000,
+    'pool_shares': 800 * 10**18,
+    'pool_eth': 1_000 * 10**18,
+    'pool_admin_steth': 0,
+    'A_precise': 5_000,
+    'fee': 4_000_000,
+    # no admin fee: pool balances follow the event amounts exactly
+    'admin_fee': 0,
+    'quorum': 3,
+    'last_completed_epoch': 0,
+}
+
+
+def _exchange(block, sold_id, tokens_sold, bought_id, tokens_bought):
+    return {
+        'address': ADDRESSES['pool'],
+        'blockNumber': hex(block),
+        'logIndex': '0x0',
+        'topics': [TOKEN_EXCHANGE, '0x' + rpc.uint(0xbeef)],
+        'data': '0x' + ''.join(rpc.uint(word) for word in (sold_id, tokens_sold, bought_id, tokens_bought)),
+    }
+
+
+def _oracle_log(block, log_index, topic, *words):
+    return {
+        'address': ADDRESSES['oracle'], 'blockNumber': hex(block), 'logIndex': hex(log_index),
+        'topics': [topic], 'data': '0x' + ''.join(rpc.uint(word) for word in words),
+    }
+
+
+def _write_dump(path, snapshot, logs):
+    with gzip.open(path, 'wt') as f:
+        for entry in [{'addresses': ADDRESSES}, {'state': snapshot}] + logs:
+            f.write(json.dumps(entry) + '\n')
+    return str(path)
+
+
+@pytest.fixture
+def dump(tmp_path):
+    return _write_dump(tmp_path / 'dump.jsonl.gz', SNAPSHOT, [
+        _exchange(10, ETH_INDEX, 10 * 10**18, STETH_INDEX, 9 * 10**18),
+        _exchange(12, STETH_INDEX, 5 * 10**18, ETH_INDEX, 4 * 10**18),
+    ])
+
+
+def test_ingest_and_lookup(tmp_path, dump):
+    directory = str(tmp_path / 'history')
+    assert ingest(dump, directory) == 3
+    assert ingest(dump, directory) == 0
+
+    index = HistoryIndex(directory)
+    assert list(index.blocks) == [9, 10, 12]
+
+    with pytest.raises(KeyError):
+        index.at(8)
+    assert index.at(9)['pool_eth'] == 1_000 * 10**18
+    assert index.at(11)['pool_eth'] == 1_010 * 10**18
+    assert index.at(12)['pool_eth'] == 1_006 * 10**18
+    assert index.at(10**9)['block'] == 12
+    # no rebase in between: the share rate stays put
+    assert index.share_rate(12) == index.share_rate(9) == pytest.approx(4_200 / 4_000)
+
+    # the pool's stETH follows the shares moved by the exchanges, to gwei precision
+    steth = 800 * 10**18 * 4_200 // 4_000
+    assert abs(index.at(10)['pool_steth'] - (steth - 9 * 10**18)) <= GWEI
+    assert abs(index.at(12)['pool_steth'] - (steth - 4 * 10**18)) <= GWEI
+
+    rows = index.range(11, 12)
+    assert list(rows['block']) == [10, 12]
+    assert rows['pool_eth'].base is not None, 'range should return views of the mapped columns'
+
+    pools = index.pools(9, 12)
+    assert pools.balances[ETH_INDEX].shape == (3, 1, 1)
+    assert pools.balances[ETH_INDEX][:, 0, 0].tolist() == [1_000e18, 1_010e18, 1_006e18]
+    assert pools.A[:, 0, 0].tolist() == [50.] * 3
+    assert index.pool(12).balances[ETH_INDEX] == 1_006e18
+
+
+def test_torn_append_is_cut_back(tmp_path, dump):
+    directory = str(tmp_path / 'history')
+    ingest(dump, directory)
+    with open(os.path.join(directory, 'meta.json')) as f:
+        meta = json.load(f)
+
+    # an append that wrote some columns but crashed before meta.json was replaced
+    for name in COLUMNS[:3]:
+        with open(os.path.join(directory, f'{name}.u64'), 'ab') as f:
+            f.write(b'\xff' * DTYPE.itemsize * 2)
+
+    newer = _write_dump(tmp_path / 'newer.jsonl.gz', meta['cursor'], [
+        _exchange(13, ETH_INDEX, 2 * 10**18, STETH_INDEX, 2 * 10**18),
+    ])
+    assert ingest(newer, directory) == 1
+
+    index = HistoryIndex(directory)
+    assert list(index.blocks) == [9, 10, 12, 13]
+    for name in COLUMNS:
+        assert os.path.getsize(os.path.join(directory, f'{name}.u64')) == 4 * DTYPE.itemsize
+    assert index.at(13)['pool_eth'] == 1_008 * 10**18
+
+
+def test_oracle_report_is_followed_from_logs(tmp_path):
+    beacon_balance = 3_210 * 10**18
+    lido = LidoModel(
+        SNAPSHOT['buffered_ether'], SNAPSHOT['deposited_validators'], SNAPSHOT['beacon_validators'],
+        SNAPSHOT['beacon_balance'], SNAPSHOT['total_shares'], SNAPSHOT['fee_bp']
+    )
+    pre_total_pooled_ether = lido.total_pooled_ether
+    lido.handle_oracle_report(100, beacon_balance)
+
+    # the oracle logs the beacon balance in wei
+    path = _write_dump(tmp_path / 'dump.jsonl.gz', SNAPSHOT, [
+        _oracle_log(11, 0, COMPLETED, 1, beacon_balance, 100),
+        _oracle_log(11, 1, POST_TOTAL_SHARES, lido.total_pooled_ether, pre_total_pooled_ether, 384, lido.total_shares),
+    ])
+    directory = str(tmp_path / 'history')
+    assert ingest(path, directory) == 2
+
+    index = HistoryIndex(directory)
+    assert list(index.blocks) == [9, 11]
+    assert index.at(11)['total_pooled_ether'] == lido.total_pooled_ether
+    assert index.at(11)['total_shares'] == lido.total_shares // GWEI * GWEI
@@ -0,0 +1,98 @@
+"""
+Tests for the SQLite sweep queue: submission, shards, leases, attempts and retries
+
+"""
+
+import time
+
+import pytest
+
+from utils.jobqueue import JobQueue
+
+
+CELLS = [{'scenario': 'mev', 'strategy': 'trade', 'dpr': dpr} for dpr in (1, 2, 3, 4)]
+
+
+@pytest.fixture
+def queue(tmp_path):
+    queue = JobQueue(str(tmp_path / 'sweep.db'), lease=60.)
+    queue.submit('grid', CELLS, 'mainnet-fork', 100, shards=2)
+    yield queue
+    queue.close()
+
+
+def _lease_all(queue, worker, shard=None):
+    leased = []
+    while True:
+        cell = queue.lease('grid', worker, shard)
+        if cell is None:
+            return leased
+        leased.append(cell)
+
+
+def test_submit_adds_only_new_cells(queue):
+    assert queue.submit('grid', CELLS + [{'scenario': 'coverage', 'quota': 8}], 'mainnet-fork', 100) == 1
+    assert queue.submit('grid', CELLS, 'mainnet-fork', 100) == 0
+    assert queue.progress('grid')['pending'] == 5
+    assert queue.sweep('grid')['shards'] == 2
+
+    with pytest.raises(ValueError):
+        queue.submit('grid', CELLS, 'mainnet-fork', 101)
+
+
+def test_shards_split_the_cells(queue):
+    even = _lease_all(queue, 'a', shard=0)
+    odd = _lease_all(queue, 'b', shard=1)
+
+    assert [cell_id for cell_id, _ in even] == [0, 2]
+    assert [cell_id for cell_id, _ in odd] == [1, 3]
+    assert sorted(cell['dpr'] for _, cell in even + odd) == [1, 2, 3, 4]
+
+
+def test_expired_lease_goes_to_another_worker(queue):
+    queue.lease_timeout = 0.05
+    cell_id, _ = queue.lease('grid', 'dead', shard=0)
+    assert queue.next_expiry('grid', shard=0) is not None
+
+    queue.lease_timeout = 60.
+    assert [leased_id for leased_id, _ in _lease_all(queue, 'alive', shard=0)] == [2]
+    time.sleep(0.1)
+    assert queue.progress('grid')['expired'] == 1
+    assert queue.lease('grid', 'alive', shard=0)[0] == cell_id
+
+    # the dead worker's late result is refused
+    assert not queue.complete('grid', cell_id, 'dead', {'pnl': 1})
+    assert queue.complete('grid', cell_id, 'alive', {'pnl': 2})
+    assert queue.results('grid') == [{**CELLS[0], 'pnl': 2}]
+
+
+def test_renewed_lease_does_not_expire(queue):
+    queue.lease_timeout = 0.2
+    cell_id, _ = queue.lease('grid', 'slow', shard=0)
+    with queue.heartbeat('grid', cell_id, 'slow'):
+        time.sleep(0.5)
+    assert queue.progress('grid')['expired'] == 0
+    assert queue.complete('grid', cell_id, 'slow', {'pnl': 0})
+
+
+def test_max_attempts_and_retry(queue):
+    for attempt in range(queue.max_attempts):
+        cell_id, _ = queue.lease('grid', 'w', shard=0)
+        assert cell_id == 0
+        queue.fail('grid', cell_id, 'w', f'boom {attempt}')
+
+    assert queue.progress('grid')['failed'] == 1
+    assert queue.errors('grid') == [(CELLS[0], f'boom {queue.max_attempts - 1}')]
+    assert queue.lease('grid', 'w', shard=0)[0] == 2
+
+    # a lease expiring on the last attempt fails the cell too
+    queue.lease_timeout = -1.
+    cell_id, _ = queue.lease('grid', 'w', shard=1)
+    queue.max_attempts = 1
+    assert queue.lease('grid', 'w', shard=1)[0] != cell_id
+    assert queue.errors('grid')[-1] == (CELLS[cell_id], 'lease expired')
+
+    queue.max_attempts = 3
+    assert queue.retry('grid') == 2
+    assert queue.progress('grid')['failed'] == 0
+    assert queue.lease('grid', 'w', shard=0)[0] == 0
@@ -5,10 +5,17 @@ Tests for mev+tx_priority_fee sandwitching (post-merge)
 
 import math
 
+import numpy as np
 import pytest
 
-from brownie import ZERO_ADDRESS, CurveExchanger, chain
+from brownie import CurveExchanger, chain
+from utils.optimize import ForkEvaluator, max_profit_size, mev_size_scenario
+from utils.oracle_report import oracle_report
+from utils.quote import Quoter, shares_by_pooled_eth
+from utils.result_cache import cell_key
+from utils.stableswap import StableSwapPool, sandwich_pnl
 import utils.log as log
+import utils.scenarios as scenarios
 
 
 ########################################################################################################
@@ -34,104 +41,121 @@ import utils.log as log
 # - block_selection_frequency_flashbots = 58 # % of blocks seen by Flashbots-enabled miners contains Flashbots bundles
 ########################################################################################################
 
-dprs = [1.4, 2., 4., 6., 8.]
-sandwitcher_balances = [x * 10**18 for x in [100, 1_000, 10_000, 100_000]]
+dprs = scenarios.dprs
+sandwitcher_balances = scenarios.sandwitcher_balances
 
-# Large ETH holder
-eth_holder: str = '0x00000000219ab540356cBB839Cbe05303d7705Fa'
+# Off-chain model sweep, checked against the fork on a few cells only
+model_dprs = np.linspace(1., 8., 141)
+model_balances = np.logspace(2, 5, 181) * 10**18
+model_spot_check_cells = [(1.4, 100 * 10**18), (4., 10_000 * 10**18), (8., 100_000 * 10**18)]
 
 @pytest.fixture(scope="module")
 def sandwicher(accounts):
-    exchanger = CurveExchanger.deploy({'from': accounts[0]})
-    # burn extra funds
-    exchanger_acc = accounts.at(exchanger, force=True)
-    exchanger_acc.transfer(ZERO_ADDRESS, exchanger_acc.balance(), gas_price=0)
-    return exchanger
+    return scenarios.deploy_sandwicher(CurveExchanger, accounts)
 
-def test_mev_tx_fee_sandwiching_trading_only(
-    sandwicher, accounts, lido, oracle, dao_voting
-):
-    whale = accounts.at(eth_holder, force=True)
-    oracle.setAllowedBeaconBalanceAnnualRelativeIncrease(10000, {'from': dao_voting})
-    chain.snapshot()
-
-    for dpr in dprs:
-        for sandwiching_balance in sandwitcher_balances:
-            whale.transfer(sandwicher, sandwiching_balance, gas_price=0)
+def _mev_tx_fee_sandwiching(strategy, scenario_tree, result_cache, sandwicher, accounts, lido, oracle, dao_voting):
+    # balance-major order: cells with the same balance share the funded setup prefix
+    for sandwiching_balance in sandwitcher_balances:
+        for dpr in dprs:
+            def round_trip():
+                scenario_tree.enter(scenarios.mev_steps(oracle, dao_voting, accounts, sandwicher, sandwiching_balance))
+                return scenarios.mev_round_trip(accounts, lido, oracle, sandwicher, strategy, dpr, sandwiching_balance)
 
-            log.h(f'Testing DPR {dpr}')
-            log.ok('Testing sandwiching balance', sandwicher.balance() / 10**18)
+            # cells evaluated before at the same fork block and code are read from disk
+            key = cell_key('mev', strategy, {'dpr': dpr, 'balance': sandwiching_balance}, CurveExchanger)
+            pnl = result_cache.memoize(key, round_trip)
 
-            sandwicher.swapETH2StETH({'from': accounts[0]})
-            log.ok('Supply increase (ETH)', (dpr * lido.getTotalPooledEther() / 10000) // 10**18)
-            oracle_report(lido, oracle, dpr)
+            assert pnl < 0
 
-            sandwicher.swapStETH2ETH({'from': accounts[0]})
 
-            log.ok('Sandwicher ETH balance (after swap)', sandwicher.balance() / 10**18)
-
-            if sandwicher.balance() > sandwiching_balance:
-                log.nb("Sandwicher wins (ETH)", (sandwicher.balance() - sandwiching_balance) / 10**18)
-            else:
-                log.ok('Sandwicher loss (ETH)', (sandwiching_balance - sandwicher.balance()) / 10**18)
+def test_mev_tx_fee_sandwiching_trading_only(
+    scenario_tree, result_cache, sandwicher, accounts, lido, oracle, dao_voting
+):
+    _mev_tx_fee_sandwiching('trade', scenario_tree, result_cache, sandwicher, accounts, lido, oracle, dao_voting)
 
-            assert sandwicher.balance() < sandwiching_balance
 
-            chain.revert()
+def test_mev_tx_fee_sandwiching_stake_trading(
+    scenario_tree, result_cache, sandwicher, accounts, lido, oracle, dao_voting
+):
+    _mev_tx_fee_sandwiching('stake', scenario_tree, result_cache, sandwicher, accounts, lido, oracle, dao_voting)
 
 
-def test_mev_tx_fee_sandwiching_stake_trading(
-    sandwicher, accounts, lido, oracle, dao_voting
+def test_mev_tx_fee_sandwiching_stake_trading_quotes(
+    sandwicher, lido, oracle, dao_voting
 ):
-    whale = accounts.at(eth_holder, force=True)
     oracle.setAllowedBeaconBalanceAnnualRelativeIncrease(10000, {'from': dao_voting})
     chain.snapshot()
 
+    quoter = Quoter(sandwicher, lido)
+
     for dpr in dprs:
-        for sandwiching_balance in sandwitcher_balances:
-            whale.transfer(sandwicher, sandwiching_balance, gas_price=0)
+        # shares the sandwicher would get by staking; the stake itself is not sent,
+        # so the rebase applies to totals without the sandwicher's ETH
+        shares = shares_by_pooled_eth(sandwitcher_balances, lido.getTotalShares(), lido.getTotalPooledEther())
+        oracle_report(lido, oracle, dpr)
+
+        # the whole balance dimension in one eth_call batch
+        eth_amounts = quoter.shares_to_eth(shares)
 
-            log.h(f'Testing DPR {dpr}')
-            log.ok('Testing sandwiching balance', sandwicher.balance() / 10**18)
+        log.h(f'Quoting DPR {dpr}')
+        for sandwiching_balance, eth_amount in zip(sandwitcher_balances, eth_amounts):
+            log.ok(f'Sandwicher PnL with {sandwiching_balance / 10**18} ETH (ETH)', (eth_amount - sandwiching_balance) / 10**18)
+            assert eth_amount < sandwiching_balance
 
-            sandwicher.stakeETH4StETH({'from': accounts[0]})
-            log.ok('Supply increase (ETH)', (dpr * lido.getTotalPooledEther() / 10000) // 10**18)
-            oracle_report(lido, oracle, dpr)
+        chain.revert()
 
-            sandwicher.swapStETH2ETH({'from': accounts[0]})
 
-            log.ok('Sandwicher ETH balance (after swap)', sandwicher.balance() / 10**18)
+@pytest.mark.parametrize('strategy', ['trade', 'stake'])
+def test_mev_tx_fee_sandwiching_max_profit_size(
+    strategy, sandwicher, accounts, lido, oracle, dao_voting
+):
+    oracle.setAllowedBeaconBalanceAnnualRelativeIncrease(10000, {'from': dao_voting})
+
+    evaluate = ForkEvaluator(mev_size_scenario(accounts, lido, oracle, sandwicher, strategy, max(dprs)))
+    result = max_profit_size(evaluate, min(sandwitcher_balances), max(sandwitcher_balances))
 
-            if sandwicher.balance() > sandwiching_balance:
-                log.nb("Sandwicher wins (ETH)", (sandwicher.balance() - sandwiching_balance) / 10**18)
-            else:
-                log.ok('Sandwicher loss (ETH)', (sandwiching_balance - sandwicher.balance()) / 10**18)
+    log.h(f'Max-profit sandwiching balance ({strategy}, DPR {max(dprs)}) after {len(result.trace)} evaluations')
+    log.ok('Sandwiching balance', result.x / 10**18)
+    log.ok('Sandwicher PnL (ETH)', result.value / 10**18)
 
-            assert sandwicher.balance() < sandwiching_balance
+    assert result.value < 0
+
+
+@pytest.mark.parametrize('strategy', ['trade', 'stake'])
+def test_mev_tx_fee_sandwiching_model_spot_check(
+    strategy, sandwicher, accounts, lido, oracle, dao_voting, curve_pool
+):
+    whale = accounts.at(scenarios.eth_holder, force=True)
+    oracle.setAllowedBeaconBalanceAnnualRelativeIncrease(10000, {'from': dao_voting})
+    chain.snapshot()
 
-            chain.revert()
+    pool = StableSwapPool.from_contract(curve_pool)
+    pnl = sandwich_pnl(pool, model_balances, model_dprs, strategy)
 
+    log.h(f'Model sweep ({strategy}) over {pnl.size} cells')
+    dpr_ind, balance_ind = np.unravel_index(np.argmax(pnl), pnl.shape)
+    log.ok('Max sandwicher PnL (ETH)', float(pnl[dpr_ind, balance_ind]) / 10**18)
+    log.ok('Reached at DPR', float(model_dprs[dpr_ind]))
+    log.ok('Reached at sandwiching balance', float(model_balances[balance_ind]) / 10**18)
 
-def oracle_report(lido, oracle, change):
-    _, validators, beaconBalance = lido.getBeaconStat()
+    for dpr, sandwiching_balance in model_spot_check_cells:
+        expected_pnl = float(sandwich_pnl(pool, [sandwiching_balance], [dpr], strategy)[0, 0])
 
-    expectedEpoch = oracle.getExpectedEpochId()
-    reporters = oracle.getOracleMembers()
-    quorum = oracle.getQuorum()
+        whale.transfer(sandwicher, sandwiching_balance, gas_price=0)
 
-    before_share_price = lido.getPooledEthByShares(10 ** 27)
-    buffered = lido.getTotalPooledEther() - beaconBalance
+        scenarios.step_in(sandwicher, strategy, accounts[0])
+        oracle_report(lido, oracle, dpr)
+        sandwicher.swapStETH2ETH({'from': accounts[0]})
 
-    if change > 0:
-        change = change / 0.9 # protocol fee
+        actual_pnl = sandwicher.balance() - sandwiching_balance
 
-    new_total_pooled_ether = lido.getTotalPooledEther() * (1. + change / 10000.)
-    new_balance = new_total_pooled_ether - buffered
+        log.h(f'Spot check DPR {dpr}, sandwiching balance {sandwiching_balance / 10**18}')
+        log.ok('Model PnL (ETH)', expected_pnl / 10**18)
+        log.ok('Fork PnL (ETH)', actual_pnl / 10**18)
 
-    for reporter in reporters[:quorum]:
-        oracle.reportBeacon(expectedEpoch, int(new_balance / 10**9 + 0.5), validators, { 'from': reporter })
+        # the oracle report hits the requested rebase only within 1% (see `oracle_report`)
+        assert math.isclose(actual_pnl, expected_pnl, rel_tol=0, abs_tol=2e-5 * sandwiching_balance), \
+            "model diverges from the fork"
 
-    after_share_price = lido.getPooledEthByShares(10 ** 27)
-    real_change = (after_share_price / before_share_price - 1.) * 10000.
+        chain.revert()
 
-    assert math.isclose(change, real_change, rel_tol=1e-2, abs_tol=0.0), "unexpected change"
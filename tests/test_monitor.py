@@ -0,0 +1,117 @@
+"""
+Tests for the live monitor: state followed from logs against fresh reads, report scores against the fork
+
+"""
+
+import asyncio
+import math
+
+from brownie import ZERO_ADDRESS, chain
+
+from utils.monitor import Monitor, Report, ScriptedFeed, State
+from utils.oracle_report import oracle_report, report_beacon
+from utils.stableswap import ETH_INDEX, STETH_INDEX
+import utils.rpc as rpc
+
+
+def _state(lido, oracle, curve_pool):
+    state = State(rpc.provider_url(), lido.address, oracle.address, curve_pool.address)
+    state.resync()
+    return state
+
+
+def _follow(state):
+    """Applies the logs of every block mined since the state was read."""
+    head = chain.height
+    logs = rpc.request(state.url, 'eth_getLogs', [{
+        'address': [state.lido_address, state.oracle_address, state.pool_address],
+        'fromBlock': hex(state.block + 1), 'toBlock': hex(head),
+    }])
+    for number in range(state.block + 1, head + 1):
+        block_logs = sorted(
+            (log for log in logs if int(log['blockNumber'], 16) == number), key=lambda log: int(log['logIndex'], 16)
+        )
+        assert state.apply(block_logs), f'state lost track at block {number}'
+        state.block = number
+
+
+def test_state_follows_logs(accounts, lido, oracle, dao_voting, curve_pool):
+    oracle.setAllowedBeaconBalanceAnnualRelativeIncrease(10000, {'from': dao_voting})
+    state = _state(lido, oracle, curve_pool)
+
+    trader = accounts[1]
+    lido.submit(ZERO_ADDRESS, {'from': trader, 'value': 100 * 10**18})
+    curve_pool.exchange(ETH_INDEX, STETH_INDEX, 50 * 10**18, 0, {'from': trader, 'value': 50 * 10**18})
+    lido.approve(curve_pool, 2**256 - 1, {'from': trader})
+    curve_pool.exchange(STETH_INDEX, ETH_INDEX, 120 * 10**18, 0, {'from': trader})
+    oracle_report(lido, oracle, 4., backend='quorum')
+
+    _follow(state)
+    fresh = _state(lido, oracle, curve_pool)
+
+    assert state.lido.total_shares == fresh.lido.total_shares
+    assert state.lido.total_pooled_ether == fresh.lido.total_pooled_ether
+    # admin fees are rebuilt from amounts net of the fee, up to rounding
+    assert abs(state.pool_eth - fresh.pool_eth) <= 2
+    assert abs(state.pool_steth - fresh.pool_steth) <= 2
+    assert state.last_completed_epoch == fresh.last_completed_epoch
+
+
+def test_report_score_matches_fork(lido, oracle, dao_voting, curve_pool):
+    oracle.setAllowedBeaconBalanceAnnualRelativeIncrease(10000, {'from': dao_voting})
+    state = _state(lido, oracle, curve_pool)
+
+    _, validators, beacon_balance = lido.getBeaconStat()
+    epoch = oracle.getExpectedEpochId()
+    report = Report('0x' + '00' * 32, ZERO_ADDRESS, epoch, int(beacon_balance * 1.001) // 10**9, validators)
+
+    published = []
+    monitor = Monitor(state, budget=2., publish=published.append)
+    asyncio.run(monitor.run(ScriptedFeed([(0, report)])))
+    monitor.close()
+
+    result, = published
+    assert result['status'] == 'ok'
+    assert result['latency'] < monitor.budget
+    assert monitor.metrics.snapshot()['report']['count'] == 1
+
+    before = lido.getPooledEthByShares(10**27)
+    report_beacon(lido, oracle, epoch, report.beacon_balance, validators, 'quorum')
+    real_change = (lido.getPooledEthByShares(10**27) / before - 1.) * 10000.
+    assert math.isclose(result['rebase_bp'], real_change, rel_tol=1e-6)
+
+
+def test_member_votes_count_towards_quorum(lido, oracle, dao_voting, curve_pool):
+    oracle.setAllowedBeaconBalanceAnnualRelativeIncrease(10000, {'from': dao_voting})
+    state = _state(lido, oracle, curve_pool)
+
+    members, quorum = oracle.getOracleMembers(), oracle.getQuorum()
+    _, validators, beacon_balance = lido.getBeaconStat()
+    epoch = oracle.getExpectedEpochId()
+    balance = int(beacon_balance * 1.0001) // 10**9
+    for member in members[:quorum - 1]:
+        oracle.reportBeacon(epoch, balance, validators, {'from': member})
+    _follow(state)
+
+    report = Report('0x' + '00' * 32, members[quorum - 1], epoch, balance, validators)
+    assert state.completes_quorum(report)
+    if quorum > 1:
+        assert not state.completes_quorum(report._replace(beacon_balance=balance + 1))
+
+
+def test_reports_over_budget_do_not_queue(lido, oracle, curve_pool):
+    state = _state(lido, oracle, curve_pool)
+    _, validators, beacon_balance = lido.getBeaconStat()
+    report = Report('0x' + '00' * 32, ZERO_ADDRESS, oracle.getExpectedEpochId(), beacon_balance // 10**9, validators)
+
+    published = []
+    monitor = Monitor(state, budget=0., publish=published.append)
+    asyncio.run(monitor.run(ScriptedFeed([(0, report)] * 5)))
+    assert [result['status'] for result in published] == ['over_budget'] * 5
+
+    # the scoring thread is free again for a report within budget
+    monitor.budget = 2.
+    asyncio.run(monitor.run(ScriptedFeed([(0, report)])))
+    monitor.close()
+    assert published[-1]['status'] == 'ok'
+    assert monitor.metrics.snapshot()['report']['over_budget'] == 5
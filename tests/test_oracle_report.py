@@ -0,0 +1,59 @@
+"""
+Tests for the fast oracle report backend against the quorum one
+
+"""
+
+import pytest
+
+from brownie import ZERO_ADDRESS
+
+from utils.oracle_report import oracle_report, report_outcome
+import utils.evm as evm
+import utils.scenarios as scenarios
+
+
+@pytest.mark.parametrize('change', [-100, 0, 1.4, 8.])
+def test_fast_report_matches_quorum(lido, oracle, dao_voting, change):
+    oracle.setAllowedBeaconBalanceAnnualRelativeIncrease(10000, {'from': dao_voting})
+
+    oracle_report(lido, oracle, change, check=False, backend='diff')
+
+
+def test_consecutive_fast_reports_match_quorum(lido, oracle, dao_voting):
+    oracle.setAllowedBeaconBalanceAnnualRelativeIncrease(10000, {'from': dao_voting})
+
+    oracle_report(lido, oracle, 2., check=False, backend='diff')
+    oracle_report(lido, oracle, 3., check=False, backend='diff')
+
+    # the second fast report starts from the oracle state written by the first one
+    snapshot_id = evm.snapshot()
+    oracle_report(lido, oracle, 1., check=False, backend='fast')
+    oracle_report(lido, oracle, 5., check=False, backend='fast')
+    fast_outcome = report_outcome(lido, oracle)
+
+    evm.revert(snapshot_id)
+    oracle_report(lido, oracle, 1., check=False, backend='quorum')
+    oracle_report(lido, oracle, 5., check=False, backend='quorum')
+    assert report_outcome(lido, oracle) == fast_outcome
+
+
+def test_fast_report_matches_quorum_during_coverage(
+    accounts, lido, oracle, dao_voting, self_owned_steth_burner
+):
+    self_owned_steth_burner.setBurnAmountPerRunQuota(scenarios.burn_quota_bp, {'from': dao_voting})
+
+    whale = accounts.at(scenarios.eth_holder, force=True)
+    steth_amount = 10_000 * 10**18
+    lido.submit(ZERO_ADDRESS, {'from': whale, 'value': steth_amount + 10**18})
+    lido.transfer(dao_voting.address, steth_amount, {'from': whale})
+    lido.approve(self_owned_steth_burner.address, steth_amount, {'from': dao_voting.address})
+    self_owned_steth_burner.requestBurnMyStETHForCover(steth_amount, {'from': dao_voting.address})
+
+    rounds = 0
+    while lido.balanceOf(self_owned_steth_burner) > 0:
+        before = report_outcome(lido, oracle)
+        oracle_report(lido, oracle, 0, check=False, backend='diff')
+        assert report_outcome(lido, oracle) != before, "burn has not progressed"
+        rounds += 1
+
+    assert rounds > 1, "expected the burn to take several rounds"
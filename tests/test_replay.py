@@ -0,0 +1,120 @@
+"""
+Tests for the checkpointed replay run: resumption, cutting back a torn output and refusing to overwrite
+
+"""
+
+import json
+import os
+
+import pytest
+
+import utils.replay as replay
+
+
+def _report(block):
+    return {
+        'block': block, 'tx': hex(block), 'post_total_pooled_ether': 1_001, 'pre_total_pooled_ether': 1_000,
+        'time_elapsed': 86_400, 'total_shares': 900, 'fee_bp': 1000,
+        'pool': {'balances': [10**21, 10**21], 'A': 50., 'fee': 4_000_000, 'admin_fee': 5 * 10**9},
+    }
+
+
+@pytest.fixture
+def archive(tmp_path):
+    path = tmp_path / 'reports.jsonl'
+    path.write_text(''.join(json.dumps(_report(block)) + '\n' for block in range(10, 20)))
+    return str(path)
+
+
+@pytest.fixture
+def scored(monkeypatch):
+    """Blocks scored by `run`, in order; the stub result is just the block."""
+    blocks = []
+
+    def score(report, sizes):
+        blocks.append(report['block'])
+        return {'block': report['block']}
+
+    monkeypatch.setattr(replay, 'score', score)
+    return blocks
+
+
+def _blocks(path):
+    with open(path) as f:
+        return [json.loads(line)['block'] for line in f]
+
+
+def test_run_resumes_from_the_checkpoint(tmp_path, archive, scored):
+    out = str(tmp_path / 'out.jsonl')
+    assert replay.run(archive, out, every=2, limit=3) == 3
+    assert replay.run(archive, out, every=2) == 10
+
+    assert scored == list(range(10, 20))
+    assert _blocks(out) == list(range(10, 20))
+    with open(out + '.checkpoint') as f:
+        checkpoint = json.load(f)
+    assert checkpoint['output_size'] == os.path.getsize(out)
+    assert checkpoint['archive_offset'] == os.path.getsize(archive)
+
+    # nothing left to score
+    assert replay.run(archive, out) == 10
+    assert len(scored) == 10
+
+
+def test_output_after_the_checkpoint_is_cut_back(tmp_path, archive, scored):
+    out = str(tmp_path / 'out.jsonl')
+    replay.run(archive, out, limit=4)
+
+    # killed after writing a result and part of the next, before checkpointing them
+    with open(out, 'a') as f:
+        f.write(json.dumps({'block': 14}) + '\n{"blo')
+
+    assert replay.run(archive, out) == 10
+    assert _blocks(out) == list(range(10, 20))
+
+
+def test_interrupted_run_checkpoints_what_it_wrote(tmp_path, archive, monkeypatch):
+    def score(report, sizes):
+        if report['block'] == 13:
+            raise KeyboardInterrupt
+        return {'block': report['block']}
+
+    out = str(tmp_path / 'out.jsonl')
+    monkeypatch.setattr(replay, 'score', score)
+    with pytest.raises(KeyboardInterrupt):
+        replay.run(archive, out, every=100)
+
+    monkeypatch.setattr(replay, 'score', lambda report, sizes: {'block': report['block']})
+    assert replay.run(archive, out) == 10
+    assert _blocks(out) == list(range(10, 20))
+
+
+def test_existing_output_without_checkpoint(tmp_path, archive, scored):
+    out = tmp_path / 'out.jsonl'
+    out.write_text('{"block": 1}\n')
+
+    with pytest.raises(FileExistsError):
+        replay.run(archive, str(out))
+    with pytest.raises(FileExistsError):
+        replay.run(archive, str(out), checkpoint=str(tmp_path / 'other.checkpoint'))
+    assert out.read_text() == '{"block": 1}\n'
+
+    assert replay.run(archive, str(out), overwrite=True) == 10
+    assert _blocks(out) == list(range(10, 20))
+
+
+def test_checkpoint_of_another_archive(tmp_path, archive, scored):
+    out = str(tmp_path / 'out.jsonl')
+    replay.run(archive, out, limit=2)
+
+    other = tmp_path / 'other.jsonl'
+    other.write_text(json.dumps(_report(30)) + '\n')
+    with pytest.raises(ValueError):
+        replay.run(str(other), out)
+
+
+def test_score_of_a_report():
+    result = replay.score(_report(10), [10**18, 10**20])
+    assert set(result['pnl']) == set(replay.strategies)
+    assert result['rebase_bp'] == pytest.approx(9.)
+    assert result['best_pnl'] == max(max(pnl) for pnl in result['pnl'].values())
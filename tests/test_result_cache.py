@@ -0,0 +1,108 @@
+"""
+Tests for the on-disk cell result cache: keys, storage, replayed result rows and eviction
+
+"""
+
+import os
+import time
+
+from types import SimpleNamespace
+
+import pytest
+
+from utils.result_cache import ResultCache, cell_key, digest
+import utils.results as results
+import utils.trace_profile as trace_profile
+
+
+EXCHANGER = SimpleNamespace(bytecode='0x6080604052')
+
+
+@pytest.fixture
+def cache(tmp_path):
+    return ResultCache(str(tmp_path / 'cache'))
+
+
+@pytest.fixture
+def pinned(monkeypatch):
+    monkeypatch.setenv('FORK_BLOCK', '15000000')
+
+
+def test_cell_key(monkeypatch, pinned):
+    key = cell_key('mev', 'trade', {'dpr': 1.4, 'balance': 10**20}, EXCHANGER)
+    assert key['fork_block'] == 15_000_000
+    assert digest(key) == digest(cell_key('mev', 'trade', {'balance': 10**20, 'dpr': 1.4}, EXCHANGER))
+    assert digest(key) != digest(cell_key('mev', 'stake', {'dpr': 1.4, 'balance': 10**20}, EXCHANGER))
+    assert digest(key) != digest(cell_key('mev', 'trade', {'dpr': 1.4, 'balance': 10**20}, SimpleNamespace(bytecode='0x00')))
+
+    monkeypatch.setattr(trace_profile.profiler, 'enabled', True)
+    assert cell_key('mev', 'trade', {'dpr': 1.4}, EXCHANGER) is None
+
+    monkeypatch.setattr(trace_profile.profiler, 'enabled', False)
+    monkeypatch.delenv('FORK_BLOCK')
+    assert cell_key('mev', 'trade', {'dpr': 1.4}, EXCHANGER) is None
+
+
+def test_get_and_put(cache, pinned):
+    key = cell_key('mev', 'trade', {'dpr': 2.}, EXCHANGER)
+    assert cache.get(key) is None
+    cache.put(key, -5)
+    assert cache.get(key) == -5
+    assert (cache.hits, cache.misses) == (1, 1)
+
+    # an entry stored under a colliding file name but another key is a miss
+    other = {**key, 'params': {'dpr': 4.}}
+    os.makedirs(os.path.dirname(cache._file(digest(other))), exist_ok=True)
+    os.replace(cache._file(digest(key)), cache._file(digest(other)))
+    assert cache.get(other) is None
+
+    cache.put(None, 1)
+    assert cache.get(None) is None
+
+    disabled = ResultCache(cache.path, enabled=False)
+    disabled.put(other, 1)
+    assert disabled.get(other) is None
+
+
+def test_memoize_replays_recorded_rows(cache, pinned):
+    key = cell_key('mev', 'trade', {'dpr': 2.}, EXCHANGER)
+    calls = []
+
+    def compute():
+        calls.append(1)
+        results.record('sandwicher_exit', scenario='mev', strategy='trade', dpr=2., pnl=-0.5)
+        return -5
+
+    with results.capture() as first:
+        assert cache.memoize(key, compute) == -5
+    with results.capture() as second:
+        assert cache.memoize(key, compute) == -5
+
+    assert len(calls) == 1
+    assert first == second == [('mev', 'trade', 'sandwicher_exit', 2., None, None, None, None, -0.5, None)]
+
+    # without a key every call computes
+    cache.memoize(None, compute)
+    assert len(calls) == 2
+
+
+def test_evict(cache, pinned):
+    keys = [cell_key('mev', 'trade', {'dpr': dpr}, EXCHANGER) for dpr in (1., 2., 3.)]
+    for age, key in zip((30, 20, 10), keys):
+        cache.put(key, 0)
+        past = time.time() - age
+        os.utime(cache._file(digest(key)), (past, past))
+    size = os.path.getsize(cache._file(digest(keys[0])))
+
+    assert cache.evict() == 0
+
+    # the least recently used entry goes first
+    cache.max_bytes = 2 * size
+    assert cache.evict() == 1
+    assert cache.get(keys[0]) is None and cache.get(keys[2]) == 0
+
+    cache.max_age = 15
+    assert cache.evict() == 1
+    assert cache.get(keys[1]) is None and cache.get(keys[2]) == 0
+
+    assert ResultCache(str(cache.path) + '-missing').evict() == 0
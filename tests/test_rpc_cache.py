@@ -0,0 +1,146 @@
+"""
+Tests for the caching JSON-RPC proxy on a fake upstream: keys, hits, upstream errors, export and import
+
+"""
+
+import io
+import json
+import urllib.error
+
+import pytest
+
+from utils.rpc_cache import CHAIN_BLOCK, CachingProxy, ResponseStore, cache_key, export_rows, import_rows
+import utils.rpc_cache as rpc_cache
+
+
+HOLDER = '0x' + '77' * 20
+
+
+@pytest.fixture
+def store(tmp_path):
+    store = ResponseStore(str(tmp_path / 'cache.sqlite'))
+    yield store
+    store.close()
+
+
+@pytest.fixture
+def upstream(monkeypatch):
+    """Fake upstream answering every request with `reply(request)`; `upstream.batches` holds what it was sent."""
+    class Upstream:
+        batches = []
+
+        @staticmethod
+        def reply(request):
+            return {'jsonrpc': '2.0', 'id': request['id'], 'result': f'{request["method"]}:{len(Upstream.batches)}'}
+
+        @staticmethod
+        def answer(requests):
+            return [Upstream.reply(request) for request in requests]
+
+    def urlopen(request, timeout):
+        requests = json.loads(request.data)
+        Upstream.batches.append(requests)
+        return io.BytesIO(json.dumps(Upstream.answer(requests)).encode())
+
+    monkeypatch.setattr(rpc_cache.urllib.request, 'urlopen', urlopen)
+    return Upstream
+
+
+def _request(method, params, id=1):
+    return {'jsonrpc': '2.0', 'id': id, 'method': method, 'params': params}
+
+
+def test_cache_key():
+    assert cache_key('eth_getBalance', [HOLDER, '0x10']) == (16, 'eth_getBalance', json.dumps([HOLDER, '0x10']).replace(' ', ''))
+    # addresses are keyed case-insensitively
+    assert cache_key('eth_getCode', [HOLDER.upper().replace('0X', '0x'), '0x10']) == cache_key('eth_getCode', [HOLDER, '0x10'])
+    assert cache_key('eth_getBlockByNumber', ['0x10', False])[0] == 16
+    assert cache_key('eth_chainId', [])[0] == CHAIN_BLOCK
+
+    assert cache_key('eth_getBalance', [HOLDER, 'latest']) is None
+    assert cache_key('eth_getBlockByNumber', ['pending', False]) is None
+    assert cache_key('eth_call', [{'to': HOLDER}, '0x10']) is None
+    assert cache_key('eth_getBalance', []) is None
+
+
+def test_pinned_reads_are_served_from_the_store(store, upstream):
+    proxy = CachingProxy(store, 'http://upstream', block=16)
+    requests = [
+        _request('eth_getBalance', [HOLDER, '0x10'], 'a'),
+        _request('eth_getBalance', [HOLDER, 'latest'], 'b'),
+        _request('eth_blockNumber', [], 'c'),
+    ]
+    first = proxy.handle(requests)
+    assert [reply['id'] for reply in first] == ['a', 'b', 'c']
+    assert first[2]['result'] == '0x10'
+    # ids are renumbered for the upstream and the pinned block number never leaves the proxy
+    assert [(r['id'], r['method']) for r in upstream.batches[0]] == [(0, 'eth_getBalance'), (1, 'eth_getBalance')]
+
+    second = proxy.handle(requests)
+    assert second[0] == first[0]
+    assert second[1]['result'] != first[1]['result']
+    assert [r['params'] for r in upstream.batches[1]] == [[HOLDER, 'latest']]
+    assert (proxy.hits, proxy.misses) == (1, 3)
+
+
+def test_errors_and_null_results_are_not_stored(store, upstream):
+    upstream.reply = staticmethod(lambda request: {'jsonrpc': '2.0', 'id': request['id'], 'result': None})
+    proxy = CachingProxy(store, 'http://upstream')
+    assert proxy.handle([_request('eth_getBlockByNumber', ['0x10', False])])[0]['result'] is None
+
+    upstream.reply = staticmethod(lambda request: {'jsonrpc': '2.0', 'id': request['id'], 'error': {'code': -32000, 'message': 'missing trie node'}})
+    assert 'error' in proxy.handle([_request('eth_getCode', [HOLDER, '0x10'])])[0]
+    assert store.stats() == []
+
+
+def test_batch_wide_upstream_error(store, upstream):
+    limited = {'jsonrpc': '2.0', 'id': None, 'error': {'code': -32005, 'message': 'rate limited'}}
+    upstream.answer = staticmethod(lambda requests: limited)
+    proxy = CachingProxy(store, 'http://upstream')
+
+    replies = proxy.handle([_request('eth_getCode', [HOLDER, '0x10'], 7), _request('eth_gasPrice', [], 8)])
+    assert [reply['id'] for reply in replies] == [7, 8]
+    assert all(reply['error'] == limited['error'] for reply in replies)
+    assert store.stats() == []
+
+
+def test_missing_replies_are_errors(store, upstream):
+    upstream.answer = staticmethod(lambda requests: [upstream.reply(requests[1])])
+    proxy = CachingProxy(store, 'http://upstream')
+
+    missing, answered = proxy.handle([_request('eth_getCode', [HOLDER, '0x10'], 1), _request('eth_getCode', [HOLDER, '0x11'], 2)])
+    assert missing['id'] == 1 and missing['error']['code'] == -32603
+    assert answered['id'] == 2 and 'result' in answered
+    assert [block for block, _, _ in store.stats()] == [17]
+
+
+def test_unreachable_upstream(store, monkeypatch):
+    def urlopen(request, timeout):
+        raise urllib.error.HTTPError(request.full_url, 429, 'Too Many Requests', {}, None)
+
+    monkeypatch.setattr(rpc_cache.urllib.request, 'urlopen', urlopen)
+    reply, = CachingProxy(store, 'http://upstream').handle([_request('eth_getCode', [HOLDER, '0x10'])])
+    assert '429' in reply['error']['message']
+
+
+def test_offline(store):
+    reply, = CachingProxy(store, None).handle([_request('eth_getCode', [HOLDER, '0x10'])])
+    assert reply['error']['message'] == 'offline: eth_getCode is not cached'
+
+
+def test_export_and_import(tmp_path, store, upstream):
+    proxy = CachingProxy(store, 'http://upstream')
+    proxy.handle([
+        _request('eth_getCode', [HOLDER, '0x10'], 1), _request('eth_getCode', [HOLDER, '0x11'], 2), _request('eth_chainId', [], 3),
+    ])
+
+    path = str(tmp_path / 'cache.jsonl.gz')
+    assert export_rows(store, path, block=16) == 2
+    other = ResponseStore(str(tmp_path / 'other.sqlite'))
+    assert import_rows(other, path, batch_size=1) == 2
+    assert sorted(other.rows()) == sorted(row for row in store.rows() if row[0] in (16, CHAIN_BLOCK))
+
+    offline = CachingProxy(other, None)
+    assert offline.handle([_request('eth_getCode', [HOLDER, '0x10'])])[0]['result'] == 'eth_getCode:1'
+    assert 'error' in offline.handle([_request('eth_getCode', [HOLDER, '0x11'])])[0]
+    other.close()
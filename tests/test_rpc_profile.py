@@ -0,0 +1,75 @@
+"""
+Tests for the JSON-RPC profiler on a fake provider: step tags, concurrent requests and uninstalling
+
+"""
+
+import threading
+
+import utils.log as log
+
+from utils.rpc_profile import RpcProfiler
+
+
+class Provider:
+    """Encodes and decodes like web3's `HTTPProvider`; the response of a request is `size` bytes."""
+    def __init__(self, barrier=None):
+        self.barrier = barrier
+
+    def encode_rpc_request(self, method, params):
+        return b'x' * params[0]
+
+    def decode_rpc_response(self, raw):
+        return {'jsonrpc': '2.0', 'result': len(raw)}
+
+    def make_request(self, method, params):
+        self.encode_rpc_request(method, params)
+        if self.barrier is not None:
+            # every request is encoded before any response is decoded
+            self.barrier.wait()
+        return self.decode_rpc_response(b'y' * params[1])
+
+
+def test_calls_are_tagged_with_the_heading():
+    provider = Provider()
+    profiler = RpcProfiler().install(provider)
+    profiler.start_test('test_mev')
+    provider.make_request('eth_call', [10, 100])
+    log.h('\x1b[93mTesting DPR 2.0\x1b[0m')
+    provider.make_request('eth_call', [20, 200])
+    profiler.uninstall()
+
+    assert {(row['step'], row['sent'], row['received']) for row in profiler.summary()} == {
+        ('test_mev :: setup', 10, 100), ('test_mev :: Testing DPR 2.0', 20, 200),
+    }
+    assert 'make_request' not in provider.__dict__
+
+
+def test_uninstalled_profiler_stops_following_headings():
+    profiler = RpcProfiler().install(Provider())
+    profiler.uninstall()
+    log.h('after uninstall')
+    assert profiler.step == 'setup'
+
+    # never installed
+    RpcProfiler().uninstall()
+
+
+def test_concurrent_requests_keep_their_sizes():
+    threads = 8
+    provider = Provider(threading.Barrier(threads))
+    profiler = RpcProfiler().install(provider)
+
+    workers = [
+        threading.Thread(target=provider.make_request, args=('eth_getTransactionReceipt', [ind + 1, 100 * (ind + 1)]))
+        for ind in range(threads)
+    ]
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join()
+    profiler.uninstall()
+
+    sizes = sorted((event['args']['sent'], event['args']['received']) for event in profiler.events)
+    assert sizes == [(ind + 1, 100 * (ind + 1)) for ind in range(threads)]
+    row, = profiler.summary()
+    assert row['count'] == threads
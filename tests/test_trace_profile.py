@@ -0,0 +1,147 @@
+"""
+Tests for the gas profiler on a canned `debug_traceTransaction` response
+
+"""
+
+import io
+import json
+
+import pytest
+
+import utils.rpc as rpc
+import utils.trace_profile as trace_profile
+
+from utils.trace_profile import TraceProfile, diff, struct_logs
+
+
+EXCHANGER = '0x' + 'aa' * 20
+LIDO = '0x' + 'bb' * 20
+LIDO_IMPL = '0x' + 'cc' * 20
+BURNER = '0x' + 'dd' * 20
+
+ABIS = {
+    'Exchanger': [{'type': 'function', 'name': 'swap', 'inputs': []}],
+    'Lido': [{'type': 'function', 'name': 'submit', 'inputs': [{'name': '_referral', 'type': 'address'}]}],
+}
+SWAP = sorted(trace_profile.selectors(ABIS['Exchanger']))[0]
+SUBMIT = sorted(trace_profile.selectors(ABIS['Lido']))[0]
+
+
+def _stack(*words):
+    return [hex(word) for word in words]
+
+
+def _step(op, depth, gas, cost=0, stack=(), **extra):
+    return {'pc': 0, 'op': op, 'depth': depth, 'gas': gas, 'gasCost': cost, 'stack': _stack(*stack), **extra}
+
+
+# Exchanger.swap -> Lido.submit (proxy) -> delegatecall to the implementation,
+# then a call to the burner that reverts and the same call again
+STRUCT_LOGS = [
+    _step('PUSH1', 1, 100_000, 3),
+    _step('CALLDATALOAD', 1, 99_997, 3, [0]),
+    _step('SLOAD', 1, 99_994, 2100, [1]),
+    _step('SLOAD', 1, 97_894, 100, [1]),
+    _step('CALL', 1, 97_794, 100, [0, int(LIDO, 16), 60_000]),
+    _step('CALLDATALOAD', 2, 60_000, 3, [0]),
+    _step('SHR', 2, 59_997, 3, [SUBMIT << 224]),
+    _step('DELEGATECALL', 2, 59_994, 100, [0, int(LIDO_IMPL, 16), 40_000]),
+    _step('CALLDATALOAD', 3, 40_000, 3, [0]),
+    _step('SHR', 3, 39_997, 3, [SUBMIT << 224]),
+    # storage enabled on some nodes: a nested object inside the log
+    _step('SSTORE', 3, 39_994, 22_100, [1, 5], storage={'0x5': '0x1'}),
+    _step('RETURN', 3, 17_894),
+    _step('SLOAD', 2, 37_788, 100, [5]),
+    _step('CALL', 2, 37_688, 100, [0, int(BURNER, 16), 20_000]),
+    _step('SLOAD', 3, 20_000, 2100, [7]),
+    _step('REVERT', 3, 17_900, error='execution reverted: {quota}'),
+    _step('CALL', 2, 35_488, 100, [0, int(BURNER, 16), 20_000]),
+    _step('SLOAD', 3, 20_000, 2100, [7]),
+    _step('STOP', 3, 17_900),
+    _step('RETURN', 2, 33_288),
+    _step('STOP', 1, 70_982),
+]
+
+
+def _response(logs):
+    return json.dumps({'jsonrpc': '2.0', 'id': 1, 'result': {
+        'gas': 60_000, 'failed': False, 'returnValue': '', 'structLogs': logs,
+    }}).encode()
+
+
+@pytest.fixture
+def node(monkeypatch):
+    """Serves `STRUCT_LOGS` for any transaction; `node.reads` counts the reads of the response."""
+    class Node:
+        struct_logs = STRUCT_LOGS
+        reads = 0
+
+    class Response(io.BytesIO):
+        def read(self, size=-1):
+            Node.reads += 1
+            return super().read(size)
+
+    monkeypatch.setattr(trace_profile.urllib.request, 'urlopen', lambda request, timeout: Response(_response(Node.struct_logs)))
+    # labels and ABIs come from the tests, not from the config addresses
+    monkeypatch.setattr(TraceProfile, '_load_config', lambda self, network=None: None)
+    monkeypatch.setattr(rpc, 'batch', lambda url, calls: [
+        {'to': EXCHANGER, 'input': '0x' + format(SWAP, '08x')}, {'gasUsed': hex(50_000), 'contractAddress': None},
+    ])
+    return Node
+
+
+def _profile():
+    return TraceProfile({EXCHANGER: 'Exchanger', LIDO: 'Lido', BURNER: 'Burner'}, ABIS)
+
+
+def test_struct_logs_are_split_across_chunks(node):
+    assert list(struct_logs('http://node', '0x01', chunk_size=7)) == STRUCT_LOGS
+    assert node.reads > len(STRUCT_LOGS)
+    assert list(struct_logs('http://node', '0x01')) == STRUCT_LOGS
+
+
+def test_gas_and_storage_access_per_function(node):
+    profile = _profile()
+    assert profile.add('0x01', 'swap', url='http://node') == 29_018
+
+    stats = {(row['contract'], row['function']): row for row in profile.summary()}
+    assert set(stats) == {('Exchanger', 'swap'), ('Lido', 'submit'), ('Burner', 'fallback')}
+
+    exchanger = stats['Exchanger', 'swap']
+    assert (exchanger['gas'], exchanger['self_gas']) == (29_018, 2306)
+    assert (exchanger['sload_cold'], exchanger['sload_warm']) == (1, 1)
+
+    # the proxy frame and the delegatecalled implementation, both in Lido storage
+    lido = stats['Lido', 'submit']
+    assert lido['calls'] == 2
+    assert lido['self_gas'] == 406 + 22_106
+    assert (lido['sstore_cold'], lido['sload_warm'], lido['sload_cold']) == (1, 1, 0)
+
+    # the reverted call leaves the burner slot cold for the second call
+    burner = stats['Burner', 'fallback']
+    assert (burner['calls'], burner['gas'], burner['self_gas']) == (2, 4200, 4200)
+    assert (burner['sload_cold'], burner['sload_warm']) == (2, 0)
+
+    assert profile.transactions == [{'step': 'swap', 'tx': '0x01', 'gas_used': 50_000, 'traced_gas': 29_018}]
+
+
+def test_diff_of_two_profiles(node):
+    before = _profile()
+    before.add('0x01', 'swap', url='http://node')
+
+    # the burner is called once, successfully
+    node.struct_logs = STRUCT_LOGS[:13] + [
+        _step('CALL', 2, 37_688, 100, [0, int(BURNER, 16), 20_000]),
+        _step('SLOAD', 3, 20_000, 2100, [7]),
+        _step('STOP', 3, 17_900),
+        _step('RETURN', 2, 35_488),
+        _step('STOP', 1, 73_182),
+    ]
+    after = _profile()
+    after.add('0x01', 'swap', url='http://node')
+
+    rows = {row['contract']: row for row in diff(before.to_json(), after.to_json())}
+    assert set(rows) == {'Exchanger', 'Lido', 'Burner'}
+    assert (rows['Burner']['calls'], rows['Burner']['gas'], rows['Burner']['sload_cold']) == (-1, -2100, -1)
+    assert (rows['Lido']['gas'], rows['Lido']['self_gas']) == (-2200, -100)
+    assert (rows['Exchanger']['gas'], rows['Exchanger']['self_gas']) == (-2200, 0)
@@ -0,0 +1,124 @@
+"""
+Compact ABIs of `interfaces/*.json`, pre-parsed into one file
+
+`utils/abi_cache.json` keeps every interface ABI stripped to the keys brownie needs, together with
+the hash of its source file. `abi(name)` reads the cache once per process and falls back to the
+source when the interface changed since the cache was built.
+
+Usage:
+    python -m utils.abi_cache          # rebuild utils/abi_cache.json
+    python -m utils.abi_cache --check  # exit code 1 if the cache is stale
+
+"""
+
+import argparse
+import glob
+import hashlib
+import json
+import os
+import sys
+
+from functools import lru_cache
+from typing import Dict, List
+
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+INTERFACES_DIR = os.path.join(ROOT, 'interfaces')
+CACHE_PATH = os.path.join(ROOT, 'utils', 'abi_cache.json')
+
+_kept_keys = ('type', 'name', 'inputs', 'outputs', 'stateMutability', 'anonymous', 'indexed', 'components')
+
+
+def _source(name: str) -> str:
+    return os.path.join(INTERFACES_DIR, f'{name}.json')
+
+
+def _digest(path: str) -> str:
+    with open(path, 'rb') as f:
+        return hashlib.sha1(f.read()).hexdigest()
+
+
+def _compact_param(param: Dict) -> Dict:
+    result = {key: param[key] for key in ('name', 'type', 'indexed') if key in param}
+    if 'components' in param:
+        result['components'] = [_compact_param(component) for component in param['components']]
+    return result
+
+
+def compact(abi: List[Dict]) -> List[Dict]:
+    """Drops docs, gas estimates and legacy flags; `constant`/`payable` become `stateMutability`."""
+    result = []
+    for entry in abi:
+        item = {key: entry[key] for key in _kept_keys if key in entry}
+        item.setdefault('type', 'function')
+        if item['type'] in ('function', 'constructor', 'fallback', 'receive') and 'stateMutability' not in item:
+            if entry.get('constant'):
+                item['stateMutability'] = 'view'
+            elif entry.get('payable'):
+                item['stateMutability'] = 'payable'
+            else:
+                item['stateMutability'] = 'nonpayable'
+        for key in ('inputs', 'outputs'):
+            if key in item:
+                item[key] = [_compact_param(param) for param in item[key]]
+        result.append(item)
+    return result
+
+
+def build() -> Dict[str, Dict]:
+    cache = {}
+    for path in sorted(glob.glob(os.path.join(INTERFACES_DIR, '*.json'))):
+        name = os.path.splitext(os.path.basename(path))[0]
+        with open(path) as f:
+            source = json.load(f)
+        cache[name] = {'sha1': _digest(path), 'abi': compact(source.get('abi', source) if isinstance(source, dict) else source)}
+    return cache
+
+
+@lru_cache(maxsize=None)
+def _cache() -> Dict[str, Dict]:
+    if not os.path.exists(CACHE_PATH):
+        return {}
+    with open(CACHE_PATH) as f:
+        return json.load(f)
+
+
+@lru_cache(maxsize=None)
+def abi(name: str) -> List[Dict]:
+    """Compact ABI of `interfaces/<name>.json`."""
+    entry = _cache().get(name)
+    if entry is not None and entry['sha1'] == _digest(_source(name)):
+        return entry['abi']
+    with open(_source(name)) as f:
+        source = json.load(f)
+    return compact(source.get('abi', source) if isinstance(source, dict) else source)
+
+
+def stale() -> List[str]:
+    cached = _cache()
+    current = build()
+    return sorted(
+        name for name in set(cached) | set(current)
+        if cached.get(name, {}).get('sha1') != current.get(name, {}).get('sha1')
+    )
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--check', action='store_true', help='only check that the cache is up to date')
+    args = parser.parse_args(argv)
+
+    if args.check:
+        names = stale()
+        if names:
+            print(f'{CACHE_PATH} is stale for: {", ".join(names)}')
+            sys.exit(1)
+        return
+
+    with open(CACHE_PATH, 'w') as f:
+        json.dump(build(), f, separators=(',', ':'), sort_keys=True)
+        f.write('\n')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,165 @@
+"""
+Batched contract reads and a read cache invalidated by state changes
+
+`read(...)` sends all the view calls of a step as one JSON-RPC batch and returns the decoded results:
+
+    (_, validators, beacon_balance), epoch = read(lido.getBeaconStat, oracle.getExpectedEpochId)
+    share_price, eth = read((lido.getPooledEthByShares, 10**27), balance(sandwicher))
+
+`ReadCache` wraps the web3 provider brownie uses: reads (`eth_call`, `eth_getBalance`, ...) are answered
+from memory until a request that may change the state goes out (a transaction, `evm_revert`,
+`evm_mine`, ...), so repeated reads of unchanged state cost nothing, through `read` and plain
+brownie calls alike.
+
+"""
+
+import json
+
+from typing import Any, Callable, Dict, List, NamedTuple, Optional, Tuple
+
+import utils.rpc as rpc
+
+
+# answered from the cache while no state change goes out
+cached_methods = {
+    'eth_call',
+    'eth_getBalance',
+    'eth_getCode',
+    'eth_getStorageAt',
+    'eth_chainId',
+    'net_version',
+}
+# neither cached nor invalidating
+passthrough_methods = {
+    'eth_accounts',
+    'eth_blockNumber',
+    'eth_estimateGas',
+    'eth_feeHistory',
+    'eth_gasPrice',
+    'eth_getBlockByHash',
+    'eth_getBlockByNumber',
+    'eth_getLogs',
+    'eth_getTransactionByHash',
+    'eth_getTransactionCount',
+    'eth_getTransactionReceipt',
+    'eth_maxPriorityFeePerGas',
+    'web3_clientVersion',
+    'debug_traceTransaction',
+    'evm_snapshot',
+}
+
+
+def _key(method: str, params) -> Tuple[str, str]:
+    return method, json.dumps(params, sort_keys=True, default=str)
+
+
+class ReadCache:
+    def __init__(self):
+        self.epoch = 0
+        self.hits = 0
+        self.misses = 0
+        self._results: Dict[Tuple[str, str], Any] = {}
+        self._provider = None
+        self._make_request = None
+
+    @property
+    def active(self) -> bool:
+        """Results are only kept while the provider hook sees every state change."""
+        return self._provider is not None
+
+    def invalidate(self):
+        self.epoch += 1
+        self._results = {}
+
+    def get(self, method: str, params) -> Optional[dict]:
+        if not self.active:
+            return None
+        response = self._results.get(_key(method, params))
+        if response is None:
+            self.misses += 1
+        else:
+            self.hits += 1
+        return response
+
+    def put(self, method: str, params, response: dict):
+        if self.active and 'error' not in response:
+            self._results[_key(method, params)] = response
+
+    def install(self, provider) -> 'ReadCache':
+        assert self._provider is None, "read cache already installed"
+        self._provider = provider
+        self._make_request = provider.__dict__.get('make_request')
+        make_request = provider.make_request
+
+        def caching_make_request(method, params):
+            if method in cached_methods:
+                response = self.get(method, params)
+                if response is None:
+                    response = make_request(method, params)
+                    self.put(method, params, response)
+                return response
+            if method not in passthrough_methods:
+                self.invalidate()
+            return make_request(method, params)
+
+        provider.make_request = caching_make_request
+        return self
+
+    def uninstall(self):
+        if self._provider is None:
+            return
+        if self._make_request is None:
+            self._provider.__dict__.pop('make_request', None)
+        else:
+            self._provider.make_request = self._make_request
+        self._provider = None
+        self.invalidate()
+
+
+# shared by `read` and the provider hook
+cache = ReadCache()
+
+
+class Read(NamedTuple):
+    method: str
+    params: list
+    decode: Callable[[str], Any]
+
+
+def call(method, *args, block: str = 'latest') -> Read:
+    """View call of a brownie contract method, e.g. `call(lido.balanceOf, holder)`."""
+    tx = {'to': method._address, 'data': method.encode_input(*args)}
+    return Read('eth_call', [tx, block], method.decode_output)
+
+
+def balance(address, block: str = 'latest') -> Read:
+    """ETH balance of an address or contract (wei)."""
+    return Read('eth_getBalance', [str(address), block], lambda result: int(result, 16))
+
+
+def _as_read(item) -> Read:
+    if isinstance(item, Read):
+        return item
+    if isinstance(item, tuple):
+        return call(*item)
+    return call(item)
+
+
+def read(*items) -> List[Any]:
+    """
+    Decoded results of `items` in order, with the uncached ones fetched in one JSON-RPC batch.
+
+    An item is a `Read`, a contract method without arguments or a `(method, *args)` tuple. Reads go to
+    the node brownie is connected to, the only one whose state changes the cache sees.
+    """
+    reads = [_as_read(item) for item in items]
+    responses = [cache.get(r.method, r.params) for r in reads]
+
+    missing = [ind for ind, response in enumerate(responses) if response is None]
+    if missing:
+        results = rpc.batch(rpc.provider_url(), [(reads[ind].method, reads[ind].params) for ind in missing])
+        for ind, result in zip(missing, results):
+            responses[ind] = {'jsonrpc': '2.0', 'result': result}
+            cache.put(reads[ind].method, reads[ind].params, responses[ind])
+
+    return [r.decode(response['result']) for r, response in zip(reads, responses)]
@@ -0,0 +1,271 @@
+"""
+Benchmarks of the sandwich scenario phases with stored JSON baselines
+
+Phases:
+    fork_boot        -- ganache fork node start until it answers RPC
+    exchanger_deploy -- `CurveExchanger` deploy (`deploy_sandwicher`)
+    setup_prefix     -- the coverage setup before the sandwicher steps in (`coverage_steps`)
+    oracle_report    -- one `oracle_report(lido, oracle, 0)` with the configured backend
+    round_trip       -- one MEV cell: step in, rebase, swap back (`mev_round_trip`)
+    full_grid        -- every MEV and coverage cell of `utils/sweep.py`, serially
+
+Every phase but `fork_boot` starts from the base state of `utils/sweep.py` and reverts to it.
+By default the fork goes through an offline `utils/rpc_cache.py` proxy, so the numbers do not
+depend on the network; fill the cache once with `--mode live --cache`.
+
+Usage:
+    python -m utils.bench run [--mode cached|live] [--block N] [--repeat 5] [--save bench.json]
+                              [--baseline base.json] [--threshold 0.1] [--phases a,b]
+    python -m utils.bench compare current.json baseline.json [--threshold 0.1]
+
+"""
+
+import argparse
+import contextlib
+import datetime
+import json
+import os
+import statistics
+import subprocess
+import sys
+import time
+
+from typing import Callable, Dict, List, Optional
+
+import utils.fork_pool as fork_pool
+import utils.rpc_cache as rpc_cache
+import utils.scenarios as scenarios
+import utils.sweep as sweep
+
+from utils.snapshot_tree import run_steps
+from utils.stats import percentile
+
+
+phases = ('fork_boot', 'exchanger_deploy', 'setup_prefix', 'oracle_report', 'round_trip', 'full_grid')
+
+DEFAULT_THRESHOLD = 0.1
+DEFAULT_PORT = 8650
+
+
+def summarize(samples: List[float]) -> Dict:
+    return {
+        'median': statistics.median(samples),
+        'p95': percentile(samples, 95),
+        'min': min(samples),
+        'max': max(samples),
+        'samples': samples,
+    }
+
+
+def measure(fn: Callable[[], None], repeat: int, reset: Optional[Callable[[], None]] = None) -> List[float]:
+    """Wall time of `repeat` calls of `fn`; `reset` runs untimed after each call."""
+    samples = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        samples.append(time.perf_counter() - start)
+        if reset is not None:
+            reset()
+    return samples
+
+
+def _bench_fork_boot(network_id: str, block: int, upstream: Optional[str], port: int, repeat: int) -> List[float]:
+    return measure(lambda: fork_pool.stop(fork_pool.launch(network_id, 1, block, port, upstream)), repeat)
+
+
+def _bench_on_fork(ctx: Dict, selected: List[str], repeat: int, grid_repeat: int) -> Dict[str, List[float]]:
+    from brownie import accounts, chain, CurveExchanger
+    from utils.oracle_report import oracle_report
+
+    lido, oracle, dao_voting = ctx['lido'], ctx['oracle'], ctx['dao_voting']
+
+    def setup_prefix():
+        run_steps(scenarios.coverage_steps(
+            accounts, dao_voting, lido, oracle, ctx['self_owned_steth_burner'], ctx['sandwicher']
+        ))
+
+    def report():
+        oracle_report(lido, oracle, 0, check=False)
+
+    def round_trip():
+        balance = scenarios.sandwitcher_balances[0]
+        oracle.setAllowedBeaconBalanceAnnualRelativeIncrease(10000, {'from': dao_voting})
+        scenarios.fund_sandwicher(accounts, ctx['sandwicher'], balance)
+        scenarios.mev_round_trip(accounts, lido, oracle, ctx['sandwicher'], 'trade', scenarios.dprs[0], balance)
+
+    def full_grid():
+        for cell in sweep.mev_cells() + sweep.coverage_cells():
+            sweep.run_cell(ctx, cell)
+
+    benches = {
+        'exchanger_deploy': (lambda: scenarios.deploy_sandwicher(CurveExchanger, accounts), repeat),
+        'setup_prefix': (setup_prefix, repeat),
+        'oracle_report': (report, repeat),
+        'round_trip': (round_trip, repeat),
+        'full_grid': (full_grid, grid_repeat),
+    }
+    return {
+        name: measure(fn, count, chain.revert)
+        for name, (fn, count) in benches.items() if name in selected
+    }
+
+
+def _git_revision() -> Optional[str]:
+    try:
+        return subprocess.check_output(['git', 'rev-parse', 'HEAD'], cwd=fork_pool.ROOT, text=True).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def run(network_id: str = 'mainnet-fork', mode: str = 'cached', block: Optional[int] = None,
+        db: str = rpc_cache.DEFAULT_DB, cache: bool = False, repeat: int = 5, grid_repeat: int = 1,
+        selected: Optional[List[str]] = None, port: int = DEFAULT_PORT, verbose: bool = False) -> Dict:
+    """
+    Benchmarks `selected` phases (all by default) and returns them with the run metadata.
+
+    `mode='cached'` forks through an offline proxy over `db` at `block` (the only cached block by default);
+    `mode='live'` forks the network's upstream, through a filling proxy when `cache` is set.
+    """
+    selected = list(selected or phases)
+    store = None
+    server = None
+    upstream = None
+
+    if mode == 'cached' or cache:
+        store = rpc_cache.ResponseStore(db)
+        if block is None and mode == 'cached':
+            blocks = rpc_cache.cached_blocks(store)
+            assert len(blocks) == 1, f'pass --block, {db} has blocks {blocks}'
+            block = blocks[0]
+        proxied = None
+        if mode == 'live':
+            proxied = fork_pool.fork_url(fork_pool.network_settings(network_id)['cmd_settings']['fork'])
+            if block is None:
+                block = fork_pool.latest_block(proxied)
+        server, _ = rpc_cache.serve_in_background(store, proxied, port + 1, block)
+        upstream = f'http://127.0.0.1:{port + 1}'
+
+    results = {}
+    try:
+        with contextlib.ExitStack() as stack:
+            if not verbose:
+                stack.enter_context(contextlib.redirect_stdout(stack.enter_context(open(os.devnull, 'w'))))
+
+            if 'fork_boot' in selected:
+                results['fork_boot'] = _bench_fork_boot(network_id, block, upstream, port, repeat)
+
+            if set(selected) - {'fork_boot'}:
+                nodes = fork_pool.launch(network_id, 1, block, port, upstream)
+                stack.callback(fork_pool.stop, nodes)
+                sweep.connect_worker(network_id, port)
+                results.update(_bench_on_fork(sweep.prepare_worker(), selected, repeat, grid_repeat))
+    finally:
+        if server is not None:
+            server.shutdown()
+            server.server_close()
+        if store is not None:
+            store.close()
+
+    return {
+        'meta': {
+            'network': network_id,
+            'mode': mode,
+            'block': block,
+            'repeat': repeat,
+            'oracle_report_backend': os.environ.get('ORACLE_REPORT_BACKEND', 'quorum'),
+            'revision': _git_revision(),
+            'date': datetime.datetime.now(datetime.timezone.utc).isoformat(timespec='seconds'),
+        },
+        'phases': {name: summarize(results[name]) for name in phases if name in results},
+    }
+
+
+def compare(current: Dict, baseline: Dict, threshold: float = DEFAULT_THRESHOLD) -> List[Dict]:
+    """Per-phase median ratios against `baseline`; `regression` is set above `1 + threshold`."""
+    rows = []
+    for name, stats in current['phases'].items():
+        if name not in baseline['phases']:
+            continue
+        ratio = stats['median'] / baseline['phases'][name]['median']
+        rows.append({
+            'phase': name,
+            'median': stats['median'],
+            'baseline_median': baseline['phases'][name]['median'],
+            'ratio': ratio,
+            'regression': ratio > 1 + threshold,
+        })
+    return rows
+
+
+def format_report(report: Dict, comparison: Optional[List[Dict]] = None) -> str:
+    meta = report['meta']
+    lines = [f'{meta["network"]} @ {meta["block"]} ({meta["mode"]}, {meta["oracle_report_backend"]} oracle reports)']
+    ratios = {row['phase']: row for row in comparison or []}
+    for name, stats in report['phases'].items():
+        line = f'{name:<18} median {stats["median"]:9.3f}s  p95 {stats["p95"]:9.3f}s  n={len(stats["samples"])}'
+        if name in ratios:
+            row = ratios[name]
+            line += f'  {row["ratio"]:6.2f}x baseline' + ('  REGRESSION' if row['regression'] else '')
+        lines.append(line)
+    return '\n'.join(lines)
+
+
+def _load(path: str) -> Dict:
+    with open(path) as f:
+        return json.load(f)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    run_cmd = commands.add_parser('run')
+    run_cmd.add_argument('--network', default='mainnet-fork')
+    run_cmd.add_argument('--mode', choices=('cached', 'live'), default='cached')
+    run_cmd.add_argument('--block', type=int, default=None)
+    run_cmd.add_argument('--db', default=rpc_cache.DEFAULT_DB)
+    run_cmd.add_argument('--cache', action='store_true', help='live mode: fill the RPC cache on the way')
+    run_cmd.add_argument('--repeat', type=int, default=5)
+    run_cmd.add_argument('--grid-repeat', type=int, default=1)
+    run_cmd.add_argument('--phases', default=','.join(phases))
+    run_cmd.add_argument('--port', type=int, default=DEFAULT_PORT)
+    run_cmd.add_argument('--save', default=None, help='write the results as a JSON baseline')
+    run_cmd.add_argument('--baseline', default=None)
+    run_cmd.add_argument('--threshold', type=float, default=DEFAULT_THRESHOLD)
+    run_cmd.add_argument('-v', '--verbose', action='store_true', help='show scenario logs')
+
+    compare_cmd = commands.add_parser('compare')
+    compare_cmd.add_argument('current')
+    compare_cmd.add_argument('baseline')
+    compare_cmd.add_argument('--threshold', type=float, default=DEFAULT_THRESHOLD)
+
+    args = parser.parse_args(argv)
+
+    if args.command == 'run':
+        selected = args.phases.split(',')
+        unknown = set(selected) - set(phases)
+        if unknown:
+            parser.error(f'unknown phases {sorted(unknown)}')
+        report = run(
+            args.network, args.mode, args.block, args.db, args.cache,
+            args.repeat, args.grid_repeat, selected, args.port, args.verbose
+        )
+        if args.save:
+            with open(args.save, 'w') as f:
+                json.dump(report, f, indent=2)
+        baseline_path = args.baseline
+    else:
+        report = _load(args.current)
+        baseline_path = args.baseline
+
+    comparison = None
+    if baseline_path:
+        comparison = compare(report, _load(baseline_path), args.threshold)
+    print(format_report(report, comparison))
+
+    if comparison and any(row['regression'] for row in comparison):
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
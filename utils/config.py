@@ -1,15 +1,36 @@
-import os
+"""
+Network addresses and contract handles, loaded on first use
+
+Importing this module has no side effects. Address constants (`utils.config.lido_dao_oracle`, ...)
+are looked up in `config_mainnet.py` or `config_goerli.py` for the active network when first read;
+`contracts.<name>` handles are built once per network from the compact ABIs of `utils/abi_cache.py`.
+
+"""
+
+from __future__ import annotations
+
+import importlib
 import sys
 
-from typing import Any, Union, Optional, Dict
+from functools import cached_property, lru_cache
+from typing import TYPE_CHECKING, Any, Dict, Optional
+
+from utils.abi_cache import abi
+
+if TYPE_CHECKING:
+    from brownie import Contract
 
-from utils.brownie_prelude import *
 
-from brownie import network, accounts
-from brownie.utils import color
-from brownie.network.account import Account, LocalAccount
+_address_modules = {
+    'goerli': 'utils.config_goerli',
+    'goerli-fork': 'utils.config_goerli',
+}
+DEFAULT_ADDRESS_MODULE = 'utils.config_mainnet'
+
 
 def network_name() -> Optional[str]:
+    from brownie import network
+
     if network.show_active() != None:
         return network.show_active()
     cli_args = sys.argv[1:]
@@ -21,12 +42,16 @@ def network_name() -> Optional[str]:
 
     return net_name
 
-if network_name() in ("goerli", "goerli-fork"):
-    print(f'Using {color("cyan")}config_goerli.py{color} addresses')
-    from utils.config_goerli import *
-else:
-    print(f'Using {color("magenta")}config_mainnet.py{color} addresses')
-    from utils.config_mainnet import *
+
+@lru_cache(maxsize=None)
+def _load_addresses(module_name: str) -> Dict[str, Any]:
+    module = importlib.import_module(module_name)
+    return {x: getattr(module, x) for x in dir(module) if not x.startswith("__")}
+
+
+def addresses(net_name: Optional[str] = None) -> Dict[str, Any]:
+    """Address table of `net_name` (the active network by default)."""
+    return _load_addresses(_address_modules.get(net_name or network_name(), DEFAULT_ADDRESS_MODULE))
 
 
 def get_is_live() -> bool:
@@ -42,42 +67,64 @@ def prompt_bool() -> Optional[bool]:
         sys.stdout.write("Please respond with 'yes' or 'no'")
 
 def get_config_params() -> Dict[str, str]:
-    ret = []
-    if network_name in ("goerli", "goerli-fork"):
-        import utils.config_goerli
-        ret = {x:globals()[x] for x in dir(utils.config_goerli) if not x.startswith("__")}
-    else:
-        import utils.config_mainnet
-        ret = {x:globals()[x] for x in dir(utils.config_mainnet) if not x.startswith("__")}
-    return ret
+    return dict(addresses())
+
 
 class ContractsLazyLoader:
-    @property
-    def lido(self) -> interface.Lido:
-        return interface.Lido(lido_dao_steth_address)
+    """Contract handles of one network, each built on first access and reused afterwards."""
+
+    def __init__(self, config: Dict[str, Any]):
+        self._config = config
+
+    def _at(self, interface_name: str, address_key: str) -> Contract:
+        from brownie import Contract
+
+        return Contract.from_abi(interface_name, self._config[address_key], abi(interface_name), persist=False)
+
+    @cached_property
+    def lido(self) -> Contract:
+        return self._at('Lido', 'lido_dao_steth_address')
+
+    @cached_property
+    def oracle(self) -> Contract:
+        return self._at('LidoOracle', 'lido_dao_oracle')
+
+    @cached_property
+    def voting(self) -> Contract:
+        return self._at('Voting', 'lido_dao_voting_address')
+
+    @cached_property
+    def acl(self) -> Contract:
+        return self._at('ACL', 'lido_dao_acl_address')
+
+    @cached_property
+    def composite_post_rebase_beacon_receiver(self) -> Contract:
+        return self._at('CompositePostRebaseBeaconReceiver', 'lido_dao_composite_post_rebase_beacon_receiver')
+
+    @cached_property
+    def self_owned_steth_burner(self) -> Contract:
+        return self._at('SelfOwnedStETHBurner', 'lido_dao_self_owned_steth_burner')
 
-    @property
-    def oracle(self) -> interface.LidoOracle:
-        return interface.LidoOracle(lido_dao_oracle_address)
+    @cached_property
+    def curve_pool(self) -> Contract:
+        return self._at('CurveStETHPool', 'curve_steth_pool_address')
 
-    @property
-    def voting(self) -> interface.Voting:
-        return interface.Voting(lido_dao_voting_address)
 
-    @property
-    def acl(self) -> interface.ACL:
-        return interface.ACL(lido_dao_acl_address)
+_loaders: Dict[str, ContractsLazyLoader] = {}
 
-    @property
-    def composite_post_rebase_beacon_receiver(self) -> interface.CompositePostRebaseBeaconReceiver:
-        return interface.CompositePostRebaseBeaconReceiver(composite_post_rebase_beacon_receiver_address)
 
-    @property
-    def self_owned_steth_burner(self) -> interface.SelfOwnedStETHBurner:
-        return interface.SelfOwnedStETHBurner(self_owned_steth_burner_address)
+def contracts_for(net_name: Optional[str] = None) -> ContractsLazyLoader:
+    net_name = net_name or network_name()
+    if net_name not in _loaders:
+        _loaders[net_name] = ContractsLazyLoader(addresses(net_name))
+    return _loaders[net_name]
 
 
 def __getattr__(name: str) -> Any:
     if name == "contracts":
-        return ContractsLazyLoader()
+        return contracts_for()
+    if not name.startswith("__"):
+        config = addresses()
+        if name in config:
+            return config[name]
     raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
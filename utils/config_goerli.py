@@ -20,6 +20,7 @@ lido_dao_oracle_repo = "0x9234e37Adeb44022A078557D9943b72AB89bF36a"
 
 curve_rewards_manager_address = ""
 balancer_rewards_manager = ""
+curve_steth_pool_address = ""
 
 lido_dao_deposit_security_module_address = "0x7DC1C1ff64078f73C98338e2f17D1996ffBb2eDe"
 
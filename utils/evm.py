@@ -0,0 +1,24 @@
+"""
+Numbered EVM snapshots on top of brownie's single `chain.snapshot()` slot
+
+Ganache consumes a snapshot on revert and drops every snapshot taken after it,
+so `revert` returns a fresh id for the same state.
+
+"""
+
+from brownie import chain, web3
+
+
+def snapshot() -> int:
+    return chain._snap()
+
+
+def revert(snapshot_id: int) -> int:
+    """Reverts to `snapshot_id` and returns the id of a new snapshot of that state."""
+    return chain._revert(snapshot_id)
+
+
+def set_storage_at(address: str, slot: str, value: int):
+    """Overwrites one storage slot; sent through the brownie provider so the read cache sees the state change."""
+    response = web3.provider.make_request('evm_setAccountStorageAt', [address, slot, '0x' + value.to_bytes(32, 'big').hex()])
+    assert 'error' not in response, f"evm_setAccountStorageAt: {response['error']}"
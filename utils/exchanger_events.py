@@ -0,0 +1,80 @@
+"""
+Sandwich results rebuilt from `CurveExchanger` event logs
+
+Every leg of a round trip logs its amounts (`SoldETHToStETH`, `StakedETHToStETH`, `SoldStETHToETH`),
+so the PnL of a cell follows from one ranged `eth_getLogs` instead of balance reads after each step.
+Logs of reverted blocks are gone, so the range is fetched before the chain reverts past it:
+once per cell in the snapshot-based grids.
+
+"""
+
+from typing import List, NamedTuple, Optional
+
+import utils.rpc as rpc
+
+
+# topic -> (leg, name of the first and second data word)
+legs = {
+    rpc.topic('SoldETHToStETH(uint256,uint256)'): ('trade', 'eth_amount', 'steth_amount'),
+    rpc.topic('StakedETHToStETH(uint256,uint256)'): ('stake', 'eth_amount', 'steth_amount'),
+    rpc.topic('SoldStETHToETH(uint256,uint256)'): ('exit', 'steth_amount', 'eth_amount'),
+}
+
+
+class ExchangerEvent(NamedTuple):
+    leg: str
+    eth_amount: int
+    steth_amount: int
+    block: int
+    tx: str
+    log_index: int
+
+
+class RoundTrip(NamedTuple):
+    path: List[str]
+    eth_in: int
+    steth: int
+    eth_out: int
+
+    @property
+    def pnl(self) -> int:
+        return self.eth_out - self.eth_in
+
+
+def _decode(log: dict) -> ExchangerEvent:
+    leg, first, second = legs[log['topics'][0]]
+    data = log['data'][2:]
+    values = {first: int(data[:64], 16), second: int(data[64:128], 16)}
+    return ExchangerEvent(
+        leg, values['eth_amount'], values['steth_amount'],
+        int(log['blockNumber'], 16), log['transactionHash'], int(log['logIndex'], 16)
+    )
+
+
+def fetch(exchanger: str, from_block: int, to_block='latest', url: Optional[str] = None) -> List[ExchangerEvent]:
+    """All exchanger events in [from_block, to_block], in chain order, with one `eth_getLogs`."""
+    logs = rpc.request(url or rpc.provider_url(), 'eth_getLogs', [{
+        'address': str(exchanger),
+        'topics': [list(legs)],
+        'fromBlock': hex(from_block),
+        'toBlock': to_block if isinstance(to_block, str) else hex(to_block),
+    }])
+    events = [_decode(log) for log in logs]
+    return sorted(events, key=lambda event: (event.block, event.log_index))
+
+
+def round_trip(events: List[ExchangerEvent]) -> RoundTrip:
+    """Entry legs (`trade`/`stake`) against exit legs of one cell."""
+    entries = [event for event in events if event.leg != 'exit']
+    exits = [event for event in events if event.leg == 'exit']
+    return RoundTrip(
+        [event.leg for event in events],
+        sum(event.eth_amount for event in entries),
+        sum(event.steth_amount for event in entries),
+        sum(event.eth_amount for event in exits),
+    )
+
+
+def round_trip_since(exchanger, from_block: int, url: Optional[str] = None) -> RoundTrip:
+    """Round trip of the exchanger from `from_block` (e.g. the block of the step-in) to the head."""
+    return round_trip(fetch(exchanger, from_block, 'latest', url))
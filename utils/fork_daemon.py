@@ -0,0 +1,237 @@
+"""
+Long-lived warm fork node shared by consecutive test sessions
+
+`start` launches the fork of a network from `network-config.yaml` detached from the shell, waits
+until it answers and pins a baseline snapshot. Brownie attaches to a node already listening on the
+network's port instead of launching one, so sessions on `mainnet-fork-daemon` skip the node start
+and the cold fork; the session fixture in `tests/conftest.py` reverts the node to the baseline first.
+
+`watch` health-checks the node and restarts it (with a new baseline) when it dies or stops answering.
+
+Usage:
+    python -m utils.fork_daemon start [--network mainnet-fork-daemon] [--block N]
+    python -m utils.fork_daemon status | stop | restart
+    python -m utils.fork_daemon watch [--interval 10] [--failures 3]
+
+"""
+
+import argparse
+import json
+import os
+import signal
+import subprocess
+import time
+
+from typing import Dict, Optional
+
+import utils.fork_pool as fork_pool
+import utils.rpc as rpc
+
+
+DEFAULT_NETWORK = 'mainnet-fork-daemon'
+STATE_PATH = os.path.join(fork_pool.ROOT, '.fork-daemon.json')
+LOG_PATH = os.path.join(fork_pool.ROOT, '.fork-daemon.log')
+
+HEALTH_TIMEOUT = 5.
+
+# daemon state adopted by the current test session, None when not attached
+adopted: Optional[Dict] = None
+
+
+def load_state() -> Optional[Dict]:
+    if not os.path.exists(STATE_PATH):
+        return None
+    with open(STATE_PATH) as f:
+        return json.load(f)
+
+
+def save_state(state: Dict):
+    tmp = STATE_PATH + '.tmp'
+    with open(tmp, 'w') as f:
+        json.dump(state, f, indent=2)
+    os.replace(tmp, STATE_PATH)
+
+
+def _url(state: Dict) -> str:
+    return f'http://127.0.0.1:{state["port"]}'
+
+
+def _alive(pid: int) -> bool:
+    try:
+        os.kill(pid, 0)
+        return True
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+
+
+def healthy(state: Dict, timeout: float = HEALTH_TIMEOUT) -> bool:
+    """The node process exists and answers a cheap request within `timeout` seconds."""
+    if not _alive(state['pid']):
+        return False
+    try:
+        rpc.request(_url(state), 'eth_blockNumber', timeout=timeout)
+        return True
+    except (OSError, rpc.RpcError):
+        return False
+
+
+def start(network_id: str = DEFAULT_NETWORK, block: Optional[int] = None) -> Dict:
+    """Launches the node unless a healthy one is already running, returns the daemon state."""
+    state = load_state()
+    if state is not None and healthy(state):
+        return state
+    if state is not None:
+        stop()
+
+    network = fork_pool.network_settings(network_id)
+    settings = network['cmd_settings']
+    url = fork_pool.fork_url(settings['fork'])
+    if block is None and os.environ.get('FORK_BLOCK'):
+        block = int(os.environ['FORK_BLOCK'])
+    if block is None:
+        block = fork_pool.latest_block(url)
+
+    # the node keeps its own copy of the descriptor
+    with open(LOG_PATH, 'a') as log:
+        process = subprocess.Popen(
+            [os.path.join(fork_pool.ROOT, network['cmd'])] + fork_pool.ganache_args(settings, settings['port'], block, url),
+            cwd=fork_pool.ROOT, stdout=log, stderr=subprocess.STDOUT, start_new_session=True
+        )
+    node = fork_pool.ForkNode(settings['port'], process)
+    try:
+        node.wait_ready(network.get('timeout', 120))
+    except BaseException:
+        _kill(process.pid)
+        raise
+
+    state = {
+        'network': network_id,
+        'pid': process.pid,
+        'port': settings['port'],
+        'block': block,
+        'baseline': int(rpc.request(node.url, 'evm_snapshot'), 16),
+        'started': time.time(),
+    }
+    save_state(state)
+    return state
+
+
+def _kill(pid: int, timeout: float = 10.):
+    # ganache.sh runs node as a child: signal the whole session
+    try:
+        os.killpg(pid, signal.SIGTERM)
+    except ProcessLookupError:
+        return
+    deadline = time.monotonic() + timeout
+    while _alive(pid) and time.monotonic() < deadline:
+        time.sleep(0.2)
+    if _alive(pid):
+        os.killpg(pid, signal.SIGKILL)
+
+
+def stop():
+    state = load_state()
+    if state is None:
+        return
+    _kill(state['pid'])
+    os.remove(STATE_PATH)
+
+
+def restart(network_id: Optional[str] = None, block: Optional[int] = None) -> Dict:
+    state = load_state() or {}
+    stop()
+    return start(network_id or state.get('network', DEFAULT_NETWORK), block or state.get('block'))
+
+
+def watch(interval: float = 10., failures: int = 3):
+    """Restarts the node after `failures` failed health checks in a row."""
+    failed = 0
+    while True:
+        state = load_state()
+        if state is None:
+            return
+        failed = 0 if healthy(state) else failed + 1
+        if failed >= failures:
+            print(f'fork daemon on port {state["port"]} is not answering, restarting')
+            restart(state['network'], state['block'])
+            failed = 0
+        time.sleep(interval)
+
+
+def attached() -> bool:
+    """Brownie is connected to the daemon node."""
+    from brownie import network, web3
+
+    state = load_state()
+    if state is None or network.show_active() != state['network']:
+        return False
+    return web3.provider.endpoint_uri.rstrip('/').endswith(f':{state["port"]}') and _alive(state['pid'])
+
+
+def adopt_baseline():
+    """
+    Reverts the node to the baseline snapshot and makes it brownie's reset point.
+
+    Ganache consumes the snapshot on revert, so a fresh baseline id is stored; brownie's
+    own reset snapshot (taken at connect, dropped by the revert) is retaken on top of it.
+    The session then runs at the daemon's block (`pinned_block`); a `FORK_BLOCK` naming
+    another block is refused.
+    """
+    from brownie import chain
+
+    global adopted
+
+    state = load_state()
+    if os.environ.get('FORK_BLOCK') and int(os.environ['FORK_BLOCK']) != state['block']:
+        raise RuntimeError(
+            f'FORK_BLOCK={os.environ["FORK_BLOCK"]} but the fork daemon is pinned to block {state["block"]}: '
+            f'unset FORK_BLOCK or run `python -m utils.fork_daemon restart --block {os.environ["FORK_BLOCK"]}`'
+        )
+    state['baseline'] = chain._revert(state['baseline'])
+    save_state(state)
+    adopted = state
+
+    chain._reset_id = chain._snap()
+    if hasattr(chain, '_current_id'):
+        chain._current_id = chain._reset_id
+
+
+def pinned_block() -> Optional[int]:
+    """Fork block of the session: the daemon's when attached to it, else `FORK_BLOCK`, None for the upstream head."""
+    if adopted is not None:
+        return adopted['block']
+    return int(os.environ['FORK_BLOCK']) if os.environ.get('FORK_BLOCK') else None
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('command', choices=('start', 'stop', 'restart', 'status', 'watch'))
+    parser.add_argument('--network', default=None, help=f'network from network-config.yaml, {DEFAULT_NETWORK} by default')
+    parser.add_argument('--block', type=int, default=None, help='fork block, FORK_BLOCK or the upstream head by default')
+    parser.add_argument('--interval', type=float, default=10.)
+    parser.add_argument('--failures', type=int, default=3)
+    args = parser.parse_args(argv)
+
+    if args.command == 'start':
+        state = start(args.network or DEFAULT_NETWORK, args.block)
+        print(f'fork daemon {state["network"]} on port {state["port"]} at block {state["block"]} (pid {state["pid"]})')
+    elif args.command == 'stop':
+        stop()
+    elif args.command == 'restart':
+        state = restart(args.network, args.block)
+        print(f'fork daemon {state["network"]} on port {state["port"]} at block {state["block"]} (pid {state["pid"]})')
+    elif args.command == 'status':
+        state = load_state()
+        if state is None:
+            print('fork daemon is not running')
+        else:
+            status = 'healthy' if healthy(state) else 'NOT ANSWERING'
+            print(f'fork daemon {state["network"]} on port {state["port"]} at block {state["block"]}: {status}')
+    else:
+        watch(args.interval, args.failures)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,138 @@
+"""
+Pool of ganache fork nodes pinned to the same fork block
+
+Nodes are started with the `cmd`/`cmd_settings` of a network from `network-config.yaml`,
+each one on its own port.
+
+"""
+
+import os
+import subprocess
+import time
+
+from typing import Dict, List, Optional
+
+import yaml
+
+import utils.rpc as rpc
+
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+NETWORK_CONFIG = os.path.join(ROOT, 'network-config.yaml')
+
+fork_urls = {
+    'mainnet': 'https://mainnet.infura.io/v3/{}',
+    'goerli': 'https://goerli.infura.io/v3/{}',
+}
+
+# brownie `cmd_settings` -> ganache v7 flags
+_ganache_flags = {
+    'accounts': '--wallet.totalAccounts',
+    'chain_id': '--chain.chainId',
+    'evm_version': '--hardfork',
+    'gas_limit': '--miner.blockGasLimit',
+    'mnemonic': '--wallet.mnemonic',
+}
+
+
+def network_settings(network_id: str) -> Dict:
+    with open(NETWORK_CONFIG) as f:
+        config = yaml.safe_load(f)
+    for network in config['development']:
+        if network['id'] == network_id:
+            return network
+    raise ValueError(f'unknown network {network_id!r} in {NETWORK_CONFIG}')
+
+
+def fork_url(fork: str) -> str:
+    """Upstream RPC for a `fork` setting: `FORK_RPC_URL` if set, otherwise Infura."""
+    if os.environ.get('FORK_RPC_URL'):
+        return os.environ['FORK_RPC_URL']
+    if fork in fork_urls:
+        return fork_urls[fork].format(os.environ['WEB3_INFURA_PROJECT_ID'])
+    return fork
+
+
+def latest_block(url: str) -> int:
+    return int(rpc.request(url, 'eth_blockNumber'), 16)
+
+
+class ForkNode:
+    def __init__(self, port: int, process: subprocess.Popen):
+        self.port = port
+        self.process = process
+
+    @property
+    def url(self) -> str:
+        return f'http://127.0.0.1:{self.port}'
+
+    def wait_ready(self, timeout: float = 120.):
+        deadline = time.monotonic() + timeout
+        while True:
+            if self.process.poll() is not None:
+                raise RuntimeError(f'fork node on port {self.port} exited with code {self.process.returncode}')
+            try:
+                rpc.request(self.url, 'web3_clientVersion', timeout=1.)
+                return
+            except OSError:
+                if time.monotonic() > deadline:
+                    raise TimeoutError(f'fork node on port {self.port} is not ready after {timeout}s')
+                time.sleep(0.25)
+
+    def stop(self):
+        if self.process.poll() is None:
+            self.process.terminate()
+            try:
+                self.process.wait(timeout=10)
+            except subprocess.TimeoutExpired:
+                self.process.kill()
+
+
+def ganache_args(settings: Dict, port: int, block: int, url: str) -> List[str]:
+    args = ['--server.port', str(port), '--fork.url', url, '--fork.blockNumber', str(block)]
+    for key, flag in _ganache_flags.items():
+        if key in settings:
+            args += [flag, str(settings[key])]
+    return args
+
+
+def launch(network_id: str, count: int, block: Optional[int] = None, base_port: int = 8600,
+           upstream: Optional[str] = None, log_dir: Optional[str] = None) -> List[ForkNode]:
+    """
+    Starts `count` fork nodes on ports `base_port`, `base_port + 1`, ...
+
+    All of them fork `upstream` (the network's `fork` setting by default) at `block`,
+    which defaults to `FORK_BLOCK` and is otherwise pinned to the upstream head once.
+    """
+    network = network_settings(network_id)
+    settings = network['cmd_settings']
+    url = upstream or fork_url(settings['fork'])
+    if block is None and os.environ.get('FORK_BLOCK'):
+        block = int(os.environ['FORK_BLOCK'])
+    if block is None:
+        block = latest_block(url)
+
+    cmd = os.path.join(ROOT, network['cmd'])
+    nodes = []
+    try:
+        for port in range(base_port, base_port + count):
+            output = subprocess.DEVNULL
+            if log_dir is not None:
+                output = open(os.path.join(log_dir, f'fork-{port}.log'), 'w')
+            process = subprocess.Popen(
+                [cmd] + ganache_args(settings, port, block, url),
+                cwd=ROOT, stdout=output, stderr=subprocess.STDOUT
+            )
+            nodes.append(ForkNode(port, process))
+        for node in nodes:
+            node.wait_ready(network.get('timeout', 120))
+    except BaseException:
+        stop(nodes)
+        raise
+
+    return nodes
+
+
+def stop(nodes: List[ForkNode]):
+    for node in nodes:
+        node.stop()
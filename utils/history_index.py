@@ -0,0 +1,334 @@
+"""
+Block-indexed history of the Curve pool and the stETH share rate, memory-mapped
+
+`dump` writes Lido, oracle and pool logs of a block range to a JSON-lines file, with a full state
+snapshot at the start and after every block the logs alone cannot follow (see `utils.monitor.State`).
+`ingest` replays a dump into an append-only columnar store: one raw little-endian uint64 file per
+column, one row per block where something changed, amounts in gwei:
+
+    block, pool_eth, pool_steth, A_precise, fee, admin_fee, total_pooled_ether, total_shares
+
+`HistoryIndex` memory-maps the columns. A point lookup is one `searchsorted` on the block column,
+`range` returns zero-copy views of the mapped files, and `pools` builds a `StableSwapPool` over a
+range shaped to broadcast against the size/DPR grid of `sandwich_pnl`. A ramping A is stored as read at
+the snapshot taken on `RampA`. Ingesting a newer dump into the
+same directory appends to it; a crash mid-append is cut back to the last committed row count.
+
+Usage:
+    python -m utils.history_index dump --from-block N --to-block M dump.jsonl.gz [--url URL] [--network mainnet]
+    python -m utils.history_index ingest dump.jsonl.gz history/
+    python -m utils.history_index at history/ BLOCK
+
+"""
+
+import argparse
+import json
+import os
+
+from typing import Dict, Iterator, List, Optional
+
+import numpy as np
+
+import utils.rpc as rpc
+
+from utils.monitor import State
+from utils.replay import DEFAULT_LOG_CHUNK, _open
+from utils.stableswap import A_PRECISION, StableSwapPool
+
+
+COLUMNS = (
+    'block', 'pool_eth', 'pool_steth', 'A_precise', 'fee', 'admin_fee', 'total_pooled_ether', 'total_shares',
+)
+# stored in gwei
+GWEI_COLUMNS = ('pool_eth', 'pool_steth', 'total_pooled_ether', 'total_shares')
+
+GWEI = 10**9
+DTYPE = np.dtype('<u8')
+
+META = 'meta.json'
+FORMAT_VERSION = 1
+
+
+def _row(state: State) -> Dict[str, int]:
+    return {
+        'block': state.block,
+        'pool_eth': state.pool_eth // GWEI,
+        'pool_steth': state.pool_steth // GWEI,
+        'A_precise': round(state.A * A_PRECISION),
+        'fee': state.fee,
+        'admin_fee': state.admin_fee,
+        'total_pooled_ether': state.lido.total_pooled_ether // GWEI,
+        'total_shares': state.lido.total_shares // GWEI,
+    }
+
+
+# dump
+
+def dump(url: str, path: str, from_block: int, to_block: int, lido: str, oracle: str, pool: str,
+         chunk: int = DEFAULT_LOG_CHUNK) -> int:
+    """Writes the logs of [from_block, to_block] and the snapshots they need to `path`. Returns the number of snapshots."""
+    state = State(url, lido, oracle, pool)
+    state.resync(from_block - 1)
+    snapshots = 1
+
+    with _open(path, 'wt') as out:
+        out.write(json.dumps({'addresses': {'lido': lido, 'oracle': oracle, 'pool': pool}}) + '\n')
+        out.write(json.dumps({'state': state.snapshot()}) + '\n')
+        for start in range(from_block, to_block + 1, chunk):
+            logs = rpc.request(url, 'eth_getLogs', [{
+                'address': [lido, oracle, pool],
+                'fromBlock': hex(start),
+                'toBlock': hex(min(start + chunk - 1, to_block)),
+            }])
+            logs.sort(key=lambda log: (int(log['blockNumber'], 16), int(log['logIndex'], 16)))
+
+            ind = 0
+            while ind < len(logs):
+                block = int(logs[ind]['blockNumber'], 16)
+                end = ind
+                while end < len(logs) and int(logs[end]['blockNumber'], 16) == block:
+                    end += 1
+                for log in logs[ind:end]:
+                    out.write(json.dumps(log) + '\n')
+                if state.apply(logs[ind:end]):
+                    state.block = block
+                else:
+                    state.resync(block)
+                    out.write(json.dumps({'state': state.snapshot()}) + '\n')
+                    snapshots += 1
+                ind = end
+    return snapshots
+
+
+def read_dump(path: str) -> Iterator[Dict]:
+    with _open(path, 'rt') as f:
+        for line in f:
+            if line.strip():
+                yield json.loads(line)
+
+
+# store
+
+def _column_path(directory: str, name: str) -> str:
+    return os.path.join(directory, f'{name}.u64')
+
+
+def _load_meta(directory: str) -> Optional[Dict]:
+    path = os.path.join(directory, META)
+    if not os.path.exists(path):
+        return None
+    with open(path) as f:
+        return json.load(f)
+
+
+def _save_meta(directory: str, meta: Dict):
+    path = os.path.join(directory, META)
+    with open(path + '.tmp', 'w') as f:
+        json.dump(meta, f)
+    os.replace(path + '.tmp', path)
+
+
+class _Appender:
+    """Buffers rows and appends them column by column; `meta.json` is replaced only after the columns are written."""
+
+    def __init__(self, directory: str, meta: Dict):
+        self.directory = directory
+        self.meta = meta
+        self._rows: List[Dict[str, int]] = []
+        # drop the tail of an append that did not commit
+        for name in COLUMNS:
+            with open(_column_path(directory, name), 'ab') as f:
+                f.truncate(meta['rows'] * DTYPE.itemsize)
+
+    @property
+    def pending(self) -> int:
+        return len(self._rows)
+
+    def append(self, row: Dict[str, int]):
+        if self._rows and self._rows[-1]['block'] == row['block']:
+            self._rows[-1] = row
+            return
+        if row['block'] <= self.meta['last_block']:
+            return
+        self._rows.append(row)
+
+    def commit(self, state: Optional[State]):
+        if self._rows:
+            for name in COLUMNS:
+                with open(_column_path(self.directory, name), 'ab') as f:
+                    np.fromiter((row[name] for row in self._rows), dtype=DTYPE, count=len(self._rows)).tofile(f)
+            self.meta['rows'] += len(self._rows)
+            self.meta['last_block'] = self._rows[-1]['block']
+            self._rows = []
+        self.meta['cursor'] = state.snapshot() if state is not None else None
+        _save_meta(self.directory, self.meta)
+
+
+def ingest(dump_path: str, directory: str, batch_size: int = 65536) -> int:
+    """
+    Appends the blocks of the dump after the last ingested one. Returns the number of rows added.
+
+    Blocks after logs the state cannot follow are skipped until the next snapshot in the dump.
+    """
+    os.makedirs(directory, exist_ok=True)
+    meta = _load_meta(directory) or {
+        'version': FORMAT_VERSION, 'columns': list(COLUMNS), 'addresses': None, 'rows': 0, 'last_block': -1, 'cursor': None,
+    }
+    if meta['version'] != FORMAT_VERSION:
+        raise ValueError(f'{directory} has format {meta["version"]}, expected {FORMAT_VERSION}')
+    appender = _Appender(directory, meta)
+    rows_before = meta['rows']
+
+    entries = read_dump(dump_path)
+    addresses = next(entries)['addresses']
+    if meta['addresses'] not in (None, addresses):
+        raise ValueError(f'{dump_path} is for {addresses}, {directory} for {meta["addresses"]}')
+    meta['addresses'] = addresses
+
+    def new_state() -> State:
+        return State(None, addresses['lido'], addresses['oracle'], addresses['pool'])
+
+    # None while the logs cannot be followed
+    state: Optional[State] = None
+    if meta['cursor'] is not None:
+        state = new_state()
+        state.restore(meta['cursor'])
+
+    block_logs = []
+
+    def apply_block():
+        nonlocal state
+        if state is not None and block_logs:
+            block = int(block_logs[0]['blockNumber'], 16)
+            if block > state.block:
+                if state.apply(block_logs):
+                    state.block = block
+                    appender.append(_row(state))
+                else:
+                    state = None
+        block_logs.clear()
+
+    for entry in entries:
+        if 'state' in entry:
+            apply_block()
+            if entry['state']['block'] >= meta['last_block']:
+                state = new_state()
+                state.restore(entry['state'])
+                appender.append(_row(state))
+            continue
+
+        if block_logs and entry['blockNumber'] != block_logs[0]['blockNumber']:
+            apply_block()
+            if appender.pending >= batch_size:
+                appender.commit(state)
+        block_logs.append(entry)
+
+    apply_block()
+    appender.commit(state)
+    return meta['rows'] - rows_before
+
+
+class HistoryIndex:
+    def __init__(self, directory: str):
+        meta = _load_meta(directory)
+        if meta is None:
+            raise FileNotFoundError(f'no history index in {directory}')
+        self.rows = meta['rows']
+        self.columns = {
+            name: np.memmap(_column_path(directory, name), dtype=DTYPE, mode='r', shape=(self.rows,))
+            if self.rows else np.empty(0, dtype=DTYPE)
+            for name in COLUMNS
+        }
+        self.blocks = self.columns['block']
+
+    def __len__(self) -> int:
+        return self.rows
+
+    def row(self, block: int) -> int:
+        """Index of the last row at or before `block`."""
+        ind = int(np.searchsorted(self.blocks, block, side='right')) - 1
+        if ind < 0:
+            raise KeyError(f'block {block} is before the index starts')
+        return ind
+
+    def at(self, block: int) -> Dict[str, int]:
+        """State after `block`, amounts in wei (to gwei precision)."""
+        ind = self.row(block)
+        return {
+            name: int(column[ind]) * (GWEI if name in GWEI_COLUMNS else 1)
+            for name, column in self.columns.items()
+        }
+
+    def range(self, from_block: int, to_block: int) -> Dict[str, np.ndarray]:
+        """Views of the rows in effect over [from_block, to_block]: the row in effect at `from_block`, then every change."""
+        start = self.row(from_block)
+        stop = int(np.searchsorted(self.blocks, to_block, side='right'))
+        return {name: column[start:stop] for name, column in self.columns.items()}
+
+    def share_rate(self, block: int) -> float:
+        """stETH per share after `block`."""
+        ind = self.row(block)
+        return float(self.columns['total_pooled_ether'][ind]) / float(self.columns['total_shares'][ind])
+
+    def pool(self, block: int) -> StableSwapPool:
+        state = self.at(block)
+        return StableSwapPool(
+            (state['pool_eth'], state['pool_steth']), state['A_precise'] / A_PRECISION, state['fee'], state['admin_fee']
+        )
+
+    def pools(self, from_block: int, to_block: int) -> StableSwapPool:
+        """
+        Pool states over the range as one model with leading row axis, shaped `(rows, 1, 1)`.
+
+        `sandwich_pnl(index.pools(a, b), sizes, dprs)` then has shape `(rows, len(dprs), len(sizes))`.
+        """
+        rows = self.range(from_block, to_block)
+
+        def column(name, scale=1.):
+            return (rows[name] * scale).reshape(-1, 1, 1)
+
+        return StableSwapPool(
+            (column('pool_eth', float(GWEI)), column('pool_steth', float(GWEI))),
+            column('A_precise', 1. / A_PRECISION), column('fee'), column('admin_fee'),
+        )
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    dump_parser = commands.add_parser('dump', help='write the logs and snapshots of a block range from a node')
+    dump_parser.add_argument('path')
+    dump_parser.add_argument('--from-block', type=int, required=True)
+    dump_parser.add_argument('--to-block', type=int, required=True)
+    dump_parser.add_argument('--url', default='http://127.0.0.1:8545', help='archive node')
+    dump_parser.add_argument('--network', default='mainnet', help='address table of utils/config.py')
+    dump_parser.add_argument('--chunk', type=int, default=DEFAULT_LOG_CHUNK)
+
+    ingest_parser = commands.add_parser('ingest', help='append a dump to an index directory')
+    ingest_parser.add_argument('dump')
+    ingest_parser.add_argument('directory')
+
+    at_parser = commands.add_parser('at', help='print the state after a block')
+    at_parser.add_argument('directory')
+    at_parser.add_argument('block', type=int)
+
+    args = parser.parse_args(argv)
+
+    if args.command == 'dump':
+        from utils.config import addresses
+
+        config = addresses(args.network)
+        snapshots = dump(
+            args.url, args.path, args.from_block, args.to_block, config['lido_dao_steth_address'],
+            config['lido_dao_oracle'], config['curve_steth_pool_address'], args.chunk
+        )
+        print(f'dumped blocks {args.from_block}..{args.to_block} with {snapshots} snapshots to {args.path}')
+    elif args.command == 'ingest':
+        print(f'{ingest(args.dump, args.directory)} rows added to {args.directory}')
+    else:
+        print(json.dumps(HistoryIndex(args.directory).at(args.block), indent=2))
+
+
+if __name__ == '__main__':
+    main()
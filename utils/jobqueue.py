@@ -0,0 +1,364 @@
+"""
+Resumable sweep job queue in SQLite
+
+`submit` turns a sweep spec into grid cells (`utils/sweep.py` format) and stores them in a SQLite file,
+together with the fork block every cell has to run at. Workers lease cells, run them on their own fork
+node and record each result in the same transaction that ends the lease. A worker renews the lease of
+its cell while running it; cells leased by a worker that died come back once the lease expires, and
+workers with nothing left to lease wait for such leases before they exit. So a sweep survives crashes
+and restarts: running `work` again continues with the cells that are not done. Submitting the same sweep again adds only new cells.
+
+Workers on several hosts can share the queue file on a common filesystem (SQLite locking must work there,
+which rules out some NFS setups). Cells are spread over `--shards`; a worker restricted to `--shard K`
+only leases cells of that shard.
+
+Usage:
+    python -m utils.jobqueue submit --db sweep.db --sweep grid [--scenario all|mev|coverage] [--quotas 0,8,100] [--shards N] [--block N]
+    python -m utils.jobqueue work --db sweep.db --sweep grid [--workers 4] [--shard K] [--base-port 8700]
+    python -m utils.jobqueue status --db sweep.db --sweep grid
+    python -m utils.jobqueue results --db sweep.db --sweep grid [--out results.json]
+    python -m utils.jobqueue retry --db sweep.db --sweep grid
+
+"""
+
+import argparse
+import contextlib
+import json
+import multiprocessing
+import os
+import socket
+import sqlite3
+import sys
+import threading
+import time
+
+from typing import Dict, Iterator, List, Optional, Tuple
+
+import utils.fork_pool as fork_pool
+import utils.sweep as sweep
+
+
+DEFAULT_LEASE = 900.
+DEFAULT_MAX_ATTEMPTS = 3
+# longest wait between lease attempts while other workers hold cells
+DEFAULT_POLL_INTERVAL = 30.
+
+_schema = '''
+CREATE TABLE IF NOT EXISTS sweeps (
+    name TEXT PRIMARY KEY,
+    network TEXT NOT NULL,
+    block INTEGER NOT NULL,
+    shards INTEGER NOT NULL,
+    created REAL NOT NULL
+);
+CREATE TABLE IF NOT EXISTS cells (
+    sweep TEXT NOT NULL,
+    id INTEGER NOT NULL,
+    key TEXT NOT NULL,
+    cell TEXT NOT NULL,
+    shard INTEGER NOT NULL,
+    state TEXT NOT NULL DEFAULT 'pending',
+    worker TEXT,
+    lease_until REAL,
+    attempts INTEGER NOT NULL DEFAULT 0,
+    result TEXT,
+    error TEXT,
+    PRIMARY KEY (sweep, id),
+    UNIQUE (sweep, key)
+);
+CREATE INDEX IF NOT EXISTS cells_state ON cells (sweep, state, shard);
+'''
+
+
+def cell_key(cell: Dict) -> str:
+    return json.dumps(cell, sort_keys=True)
+
+
+def worker_id() -> str:
+    return f'{socket.gethostname()}:{os.getpid()}'
+
+
+class JobQueue:
+    def __init__(self, path: str, lease: float = DEFAULT_LEASE, max_attempts: int = DEFAULT_MAX_ATTEMPTS):
+        self.path = path
+        self.lease_timeout = lease
+        self.max_attempts = max_attempts
+        # autocommit; writes take the database lock up front with BEGIN IMMEDIATE
+        self._db = sqlite3.connect(path, timeout=60., isolation_level=None)
+        self._db.executescript(_schema)
+
+    def close(self):
+        self._db.close()
+
+    @contextlib.contextmanager
+    def _transaction(self) -> Iterator[sqlite3.Cursor]:
+        cursor = self._db.cursor()
+        cursor.execute('BEGIN IMMEDIATE')
+        try:
+            yield cursor
+        except BaseException:
+            cursor.execute('ROLLBACK')
+            raise
+        cursor.execute('COMMIT')
+
+    def submit(self, name: str, cells: List[Dict], network_id: str, block: int, shards: int = 1) -> int:
+        """Creates the sweep or extends it with cells it does not have yet. Returns the number of new cells."""
+        with self._transaction() as cursor:
+            row = cursor.execute('SELECT network, block, shards FROM sweeps WHERE name = ?', (name,)).fetchone()
+            if row is None:
+                cursor.execute(
+                    'INSERT INTO sweeps (name, network, block, shards, created) VALUES (?, ?, ?, ?, ?)',
+                    (name, network_id, block, shards, time.time())
+                )
+            elif tuple(row[:2]) != (network_id, block):
+                raise ValueError(f'sweep {name!r} runs on {row[0]} at block {row[1]}, not {network_id} at {block}')
+            else:
+                shards = row[2]
+
+            next_id = cursor.execute('SELECT COALESCE(MAX(id) + 1, 0) FROM cells WHERE sweep = ?', (name,)).fetchone()[0]
+            added = 0
+            for cell in cells:
+                cursor.execute(
+                    'INSERT OR IGNORE INTO cells (sweep, id, key, cell, shard) VALUES (?, ?, ?, ?, ?)',
+                    (name, next_id + added, cell_key(cell), json.dumps(cell), (next_id + added) % shards)
+                )
+                added += cursor.rowcount
+        return added
+
+    def sweep(self, name: str) -> Dict:
+        row = self._db.execute('SELECT network, block, shards FROM sweeps WHERE name = ?', (name,)).fetchone()
+        if row is None:
+            raise KeyError(f'no sweep {name!r} in {self.path}')
+        return {'name': name, 'network': row[0], 'block': row[1], 'shards': row[2]}
+
+    def lease(self, name: str, worker: str, shard: Optional[int] = None) -> Optional[Tuple[int, Dict]]:
+        """Leases the next pending cell, or one whose lease expired. Returns (id, cell), None when nothing is left."""
+        now = time.time()
+        query = (
+            'SELECT id, cell FROM cells WHERE sweep = ? AND attempts < ? '
+            'AND (state = \'pending\' OR (state = \'leased\' AND lease_until < ?))'
+        )
+        params = [name, self.max_attempts, now]
+        if shard is not None:
+            query += ' AND shard = ?'
+            params.append(shard)
+        with self._transaction() as cursor:
+            # workers died on the last attempt
+            cursor.execute(
+                'UPDATE cells SET state = \'failed\', error = \'lease expired\' '
+                'WHERE sweep = ? AND state = \'leased\' AND lease_until < ? AND attempts >= ?',
+                (name, now, self.max_attempts)
+            )
+            row = cursor.execute(query + ' ORDER BY id LIMIT 1', params).fetchone()
+            if row is None:
+                return None
+            cursor.execute(
+                'UPDATE cells SET state = \'leased\', worker = ?, lease_until = ?, attempts = attempts + 1 '
+                'WHERE sweep = ? AND id = ?',
+                (worker, now + self.lease_timeout, name, row[0])
+            )
+        return row[0], json.loads(row[1])
+
+    def renew(self, name: str, cell_id: int, worker: str) -> bool:
+        """Extends the lease of a cell still held by `worker`. False when the lease was lost."""
+        with self._transaction() as cursor:
+            cursor.execute(
+                'UPDATE cells SET lease_until = ? WHERE sweep = ? AND id = ? AND state = \'leased\' AND worker = ?',
+                (time.time() + self.lease_timeout, name, cell_id, worker)
+            )
+            return cursor.rowcount == 1
+
+    @contextlib.contextmanager
+    def heartbeat(self, name: str, cell_id: int, worker: str) -> Iterator[None]:
+        """Renews the lease of the cell every third of the lease time, from a thread with its own connection."""
+        stop = threading.Event()
+
+        def beat():
+            queue = JobQueue(self.path, self.lease_timeout, self.max_attempts)
+            try:
+                while not stop.wait(self.lease_timeout / 3) and queue.renew(name, cell_id, worker):
+                    pass
+            finally:
+                queue.close()
+
+        thread = threading.Thread(target=beat, name=f'lease-{cell_id}', daemon=True)
+        thread.start()
+        try:
+            yield
+        finally:
+            stop.set()
+            thread.join()
+
+    def next_expiry(self, name: str, shard: Optional[int] = None) -> Optional[float]:
+        """When the first lease held by a worker runs out, None when no cell is leased."""
+        query = 'SELECT MIN(lease_until) FROM cells WHERE sweep = ? AND state = \'leased\''
+        params = [name]
+        if shard is not None:
+            query += ' AND shard = ?'
+            params.append(shard)
+        return self._db.execute(query, params).fetchone()[0]
+
+    def complete(self, name: str, cell_id: int, worker: str, result: Dict) -> bool:
+        """Records the result unless the cell is done already. False when the lease was lost to another worker."""
+        with self._transaction() as cursor:
+            cursor.execute(
+                'UPDATE cells SET state = \'done\', result = ?, error = NULL, lease_until = NULL '
+                'WHERE sweep = ? AND id = ? AND state != \'done\' AND worker = ?',
+                (json.dumps(result), name, cell_id, worker)
+            )
+            return cursor.rowcount == 1
+
+    def fail(self, name: str, cell_id: int, worker: str, error: str):
+        """Releases the cell for another attempt, or marks it failed after `max_attempts`."""
+        with self._transaction() as cursor:
+            cursor.execute(
+                'UPDATE cells SET state = CASE WHEN attempts < ? THEN \'pending\' ELSE \'failed\' END, '
+                'error = ?, lease_until = NULL WHERE sweep = ? AND id = ? AND state = \'leased\' AND worker = ?',
+                (self.max_attempts, error, name, cell_id, worker)
+            )
+
+    def retry(self, name: str) -> int:
+        """Gives failed cells a fresh set of attempts."""
+        with self._transaction() as cursor:
+            cursor.execute(
+                'UPDATE cells SET state = \'pending\', attempts = 0 WHERE sweep = ? AND state = \'failed\'', (name,)
+            )
+            return cursor.rowcount
+
+    def progress(self, name: str) -> Dict[str, int]:
+        now = time.time()
+        counts = {'pending': 0, 'leased': 0, 'expired': 0, 'done': 0, 'failed': 0}
+        for state, expired, count in self._db.execute(
+            'SELECT state, state = \'leased\' AND lease_until < ?, COUNT(*) FROM cells WHERE sweep = ? GROUP BY 1, 2',
+            (now, name)
+        ):
+            counts['expired' if expired else state] += count
+        return counts
+
+    def results(self, name: str) -> List[Dict]:
+        """Finished cells with their results, in submission order."""
+        return [
+            {**json.loads(cell), **json.loads(result)}
+            for cell, result in self._db.execute(
+                'SELECT cell, result FROM cells WHERE sweep = ? AND state = \'done\' ORDER BY id', (name,)
+            )
+        ]
+
+    def errors(self, name: str) -> List[Tuple[Dict, str]]:
+        return [
+            (json.loads(cell), error)
+            for cell, error in self._db.execute(
+                'SELECT cell, error FROM cells WHERE sweep = ? AND state = \'failed\' ORDER BY id', (name,)
+            )
+        ]
+
+
+def work(path: str, name: str, port: int, shard: Optional[int] = None, lease: float = DEFAULT_LEASE,
+         verbose: bool = False, poll_interval: float = DEFAULT_POLL_INTERVAL) -> int:
+    """
+    Runs leased cells on a fork node on `port` until the sweep has none left. Returns the number completed.
+
+    While other workers hold cells, waits for them to finish or for their leases to expire.
+    """
+    queue = JobQueue(path, lease)
+    spec = queue.sweep(name)
+    worker = worker_id()
+
+    nodes = fork_pool.launch(spec['network'], 1, spec['block'], port)
+    completed = 0
+    try:
+        if not verbose:
+            sys.stdout = open(os.devnull, 'w')
+        sweep.connect_worker(spec['network'], port)
+        ctx = sweep.prepare_worker()
+        from brownie import chain
+
+        while True:
+            leased = queue.lease(name, worker, shard)
+            if leased is None:
+                expiry = queue.next_expiry(name, shard)
+                if expiry is None:
+                    return completed
+                time.sleep(min(max(expiry - time.time(), 0.), poll_interval))
+                continue
+            cell_id, cell = leased
+            try:
+                with queue.heartbeat(name, cell_id, worker):
+                    result = sweep.run_cell(ctx, cell)
+            except Exception as error:
+                queue.fail(name, cell_id, worker, f'{type(error).__name__}: {error}')
+                # back to the base state for the next cell
+                chain.revert()
+                continue
+            if queue.complete(name, cell_id, worker, result):
+                completed += 1
+    finally:
+        if not verbose:
+            sys.stdout.close()
+            sys.stdout = sys.__stdout__
+        fork_pool.stop(nodes)
+        queue.close()
+
+
+def _work(args: Tuple) -> int:
+    return work(*args)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('command', choices=('submit', 'work', 'status', 'results', 'retry'))
+    parser.add_argument('--db', default='sweep.db')
+    parser.add_argument('--sweep', default='grid')
+    parser.add_argument('--network', default='mainnet-fork')
+    parser.add_argument('--block', type=int, default=None, help='fork block of the sweep, FORK_BLOCK or the upstream head by default')
+    parser.add_argument('--scenario', choices=('all', 'mev', 'coverage'), default='all')
+    parser.add_argument('--quotas', default=None, help='comma-separated burn quotas (bp) of the coverage cells')
+    parser.add_argument('--shards', type=int, default=1)
+    parser.add_argument('--shard', type=int, default=None, help='lease only cells of this shard')
+    parser.add_argument('--workers', type=int, default=1, help='worker processes on this host, one fork node each')
+    parser.add_argument('--base-port', type=int, default=8700)
+    parser.add_argument('--lease', type=float, default=DEFAULT_LEASE, help='seconds before a leased cell is handed out again')
+    parser.add_argument('--out', default=None, help='write results as JSON here instead of stdout')
+    parser.add_argument('-v', '--verbose', action='store_true', help='show scenario logs of the workers')
+    args = parser.parse_args(argv)
+
+    if args.command == 'submit':
+        cells = []
+        if args.scenario in ('all', 'mev'):
+            cells += sweep.mev_cells()
+        if args.scenario in ('all', 'coverage'):
+            quotas = [int(quota) for quota in args.quotas.split(',')] if args.quotas else None
+            cells += sweep.coverage_cells(quotas) if quotas else sweep.coverage_cells()
+
+        block = args.block
+        if block is None and os.environ.get('FORK_BLOCK'):
+            block = int(os.environ['FORK_BLOCK'])
+        if block is None:
+            settings = fork_pool.network_settings(args.network)['cmd_settings']
+            block = fork_pool.latest_block(fork_pool.fork_url(settings['fork']))
+
+        queue = JobQueue(args.db)
+        added = queue.submit(args.sweep, cells, args.network, block, args.shards)
+        print(f'{added} new cells in sweep {args.sweep!r} at block {queue.sweep(args.sweep)["block"]}')
+    elif args.command == 'work':
+        jobs = [
+            (args.db, args.sweep, args.base_port + i, args.shard, args.lease, args.verbose)
+            for i in range(args.workers)
+        ]
+        with multiprocessing.get_context('spawn').Pool(args.workers) as pool:
+            completed = sum(pool.map(_work, jobs))
+        print(f'{completed} cells completed')
+    elif args.command == 'status':
+        queue = JobQueue(args.db)
+        print(', '.join(f'{state} {count}' for state, count in queue.progress(args.sweep).items()))
+        for cell, error in queue.errors(args.sweep):
+            print(f'failed {cell_key(cell)}: {error}')
+    elif args.command == 'retry':
+        print(f'{JobQueue(args.db).retry(args.sweep)} failed cells pending again')
+    else:
+        with open(args.out, 'w') if args.out else contextlib.nullcontext(sys.stdout) as out:
+            json.dump(JobQueue(args.db).results(args.sweep), out, indent=2)
+
+
+if __name__ == '__main__':
+    main()
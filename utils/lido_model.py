@@ -0,0 +1,295 @@
+"""
+In-memory model of Lido v1 share accounting and `SelfOwnedStETHBurner` burns
+
+Mirrors the integer math of `Lido.handleOracleReport`/`distributeFee` (protocol fee minted as new shares
+on beacon rewards) and of `SelfOwnedStETHBurner.processLidoOracleReport` (cover first, then non-cover,
+at most `quota_bp` of total shares per report). Execution layer rewards are left out: the scenarios
+drain the rewards vault in `prepare_oracle`.
+
+`LidoModel.from_fork` seeds the model from one JSON-RPC batch; `coverage_pnl` replays the coverage
+scenario of `utils/scenarios.py` on top of it and of a `StableSwapPool`, so quota/slashing grids
+run without the fork.
+
+"""
+
+from typing import Dict, List, Optional, Sequence, Tuple
+
+import utils.rpc as rpc
+import utils.scenario_params as scenario_params
+
+from utils.stableswap import ETH_INDEX, STETH_INDEX, StableSwapPool
+
+
+TOTAL_BASIS_POINTS = 10000
+DEPOSIT_SIZE = 32 * 10**18
+DENOMINATION_OFFSET = 10**9
+
+# holder names used by `coverage_pnl`
+VICTIM = 'victim'
+SANDWICHER = 'sandwicher'
+WHALE = 'whale'
+VOTING = 'voting'
+BURNER = 'burner'
+
+
+class LidoModel:
+    def __init__(self, buffered_ether: int, deposited_validators: int, beacon_validators: int,
+                 beacon_balance: int, total_shares: int, fee_bp: int = 1000,
+                 shares: Optional[Dict[str, int]] = None, burn_quota_bp: int = scenario_params.burn_quota_bp,
+                 cover_shares_requested: int = 0, non_cover_shares_requested: int = 0):
+        self.buffered_ether = buffered_ether
+        self.deposited_validators = deposited_validators
+        self.beacon_validators = beacon_validators
+        self.beacon_balance = beacon_balance
+        self.total_shares = total_shares
+        self.fee_bp = fee_bp
+        self.shares = dict(shares or {})
+        self.burn_quota_bp = burn_quota_bp
+        self.cover_shares_requested = cover_shares_requested
+        self.non_cover_shares_requested = non_cover_shares_requested
+        self.cover_shares_burnt = 0
+        self.non_cover_shares_burnt = 0
+
+    @classmethod
+    def from_fork(cls, lido, burner, holders: Optional[Dict[str, str]] = None,
+                  url: Optional[str] = None, block: str = 'latest') -> 'LidoModel':
+        """
+        Reads the Lido and burner state in one batch; `holders` maps model names to addresses.
+
+        The burner does not expose its pending requests, so all of its shares are taken as
+        pending non-cover burns; the split does not change how much is burnt per report.
+        """
+        holders = dict(holders or {})
+        holders.setdefault(BURNER, burner.address)
+
+        def call(contract, method, *args):
+            return 'eth_call', [{'to': contract.address, 'data': method.encode_input(*args)}, block]
+
+        calls = [
+            call(lido, lido.getBufferedEther),
+            call(lido, lido.getBeaconStat),
+            call(lido, lido.getTotalShares),
+            call(lido, lido.getFee),
+            call(burner, burner.getBurnAmountPerRunQuota),
+        ] + [call(lido, lido.sharesOf, address) for address in holders.values()]
+
+        results = rpc.batch(url or rpc.provider_url(), calls)
+        buffered, beacon_stat, total_shares, fee, quota = results[:5]
+        deposited, beacon_validators, beacon_balance = lido.getBeaconStat.decode_output(beacon_stat)
+        shares = {name: int(result, 16) for name, result in zip(holders, results[5:])}
+
+        return cls(
+            int(buffered, 16), deposited, beacon_validators, beacon_balance, int(total_shares, 16),
+            int(fee, 16), shares, int(quota, 16), non_cover_shares_requested=shares[BURNER]
+        )
+
+    def copy(self) -> 'LidoModel':
+        model = LidoModel.__new__(LidoModel)
+        model.__dict__.update(self.__dict__)
+        model.shares = dict(self.shares)
+        return model
+
+    # stETH
+
+    @property
+    def transient_balance(self) -> int:
+        return (self.deposited_validators - self.beacon_validators) * DEPOSIT_SIZE
+
+    @property
+    def total_pooled_ether(self) -> int:
+        return self.buffered_ether + self.beacon_balance + self.transient_balance
+
+    def get_shares_by_pooled_eth(self, eth_amount: int) -> int:
+        return eth_amount * self.total_shares // self.total_pooled_ether
+
+    def get_pooled_eth_by_shares(self, shares_amount: int) -> int:
+        return shares_amount * self.total_pooled_ether // self.total_shares
+
+    def shares_of(self, holder: str) -> int:
+        return self.shares.get(holder, 0)
+
+    def balance_of(self, holder: str) -> int:
+        return self.get_pooled_eth_by_shares(self.shares_of(holder))
+
+    def _mint_shares(self, holder: str, shares_amount: int):
+        self.shares[holder] = self.shares_of(holder) + shares_amount
+        self.total_shares += shares_amount
+
+    def _burn_shares(self, holder: str, shares_amount: int):
+        assert shares_amount <= self.shares_of(holder), "BURN_AMOUNT_EXCEEDS_BALANCE"
+        self.shares[holder] -= shares_amount
+        self.total_shares -= shares_amount
+
+    def submit(self, holder: str, amount: int) -> int:
+        """`Lido.submit`: returns the shares minted."""
+        shares_amount = self.get_shares_by_pooled_eth(amount) if self.total_pooled_ether else amount
+        self._mint_shares(holder, shares_amount)
+        self.buffered_ether += amount
+        return shares_amount
+
+    def transfer(self, sender: str, recipient: str, amount: int) -> int:
+        """stETH `transfer` of `amount` (rounded down to shares): returns the shares moved."""
+        return self.transfer_shares(sender, recipient, self.get_shares_by_pooled_eth(amount))
+
+    def transfer_shares(self, sender: str, recipient: str, shares_amount: int) -> int:
+        assert shares_amount <= self.shares_of(sender), "TRANSFER_AMOUNT_EXCEEDS_BALANCE"
+        self.shares[sender] -= shares_amount
+        self.shares[recipient] = self.shares_of(recipient) + shares_amount
+        return shares_amount
+
+    # oracle
+
+    def handle_oracle_report(self, beacon_validators: int, beacon_balance: int):
+        """`Lido.handleOracleReport` (`beacon_balance` in wei), fee shares included."""
+        assert beacon_validators <= self.deposited_validators, "REPORTED_MORE_DEPOSITED"
+        assert beacon_validators >= self.beacon_validators, "REPORTED_LESS_VALIDATORS"
+
+        appeared_validators = beacon_validators - self.beacon_validators
+        reward_base = appeared_validators * DEPOSIT_SIZE + self.beacon_balance
+
+        self.beacon_balance = beacon_balance
+        self.beacon_validators = beacon_validators
+
+        if beacon_balance > reward_base:
+            self._distribute_fee(beacon_balance - reward_base)
+
+    def _distribute_fee(self, total_rewards: int):
+        shares_to_mint = (
+            total_rewards * self.fee_bp * self.total_shares //
+            (self.total_pooled_ether * TOTAL_BASIS_POINTS - self.fee_bp * total_rewards)
+        )
+        # split among treasury, insurance and operators, none of them tracked here
+        self.total_shares += shares_to_mint
+
+    # burner
+
+    def request_burn_for_cover(self, sender: str, amount: int) -> int:
+        """`SelfOwnedStETHBurner.requestBurnMyStETHForCover`: returns the shares requested."""
+        shares_amount = self.transfer(sender, BURNER, amount)
+        self.cover_shares_requested += shares_amount
+        return shares_amount
+
+    def request_burn(self, sender: str, amount: int) -> int:
+        """`SelfOwnedStETHBurner.requestBurnMyStETH` (non-cover): returns the shares requested."""
+        shares_amount = self.transfer(sender, BURNER, amount)
+        self.non_cover_shares_requested += shares_amount
+        return shares_amount
+
+    @property
+    def pending_burn_shares(self) -> int:
+        return self.cover_shares_requested + self.non_cover_shares_requested
+
+    def process_burn(self) -> int:
+        """`SelfOwnedStETHBurner.processLidoOracleReport`: returns the shares burnt."""
+        cover = self.cover_shares_requested
+        non_cover = self.non_cover_shares_requested
+        if cover + non_cover == 0:
+            return 0
+
+        max_shares = self.total_shares * self.burn_quota_bp // TOTAL_BASIS_POINTS
+
+        cover_now = min(max_shares, cover)
+        self.cover_shares_requested -= cover_now
+        self.cover_shares_burnt += cover_now
+
+        non_cover_now = 0
+        if cover_now < max_shares and non_cover > 0:
+            non_cover_now = min(max_shares - cover_now, non_cover)
+            self.non_cover_shares_requested -= non_cover_now
+            self.non_cover_shares_burnt += non_cover_now
+
+        self._burn_shares(BURNER, cover_now + non_cover_now)
+        return cover_now + non_cover_now
+
+    def report(self, beacon_balance: int, beacon_validators: Optional[int] = None) -> int:
+        """One completed oracle report: Lido accounting, then the burner callback. Returns the shares burnt."""
+        self.handle_oracle_report(
+            self.beacon_validators if beacon_validators is None else beacon_validators, beacon_balance
+        )
+        return self.process_burn()
+
+    def oracle_report(self, change: float) -> int:
+        """`utils.oracle_report.oracle_report` with the same float math and gwei rounding."""
+        buffered = self.total_pooled_ether - self.beacon_balance
+
+        if change > 0:
+            change = change / 0.9 # protocol fee
+
+        new_total_pooled_ether = self.total_pooled_ether * (1. + change / 10000.)
+        new_balance = new_total_pooled_ether - buffered
+
+        return self.report(int(new_balance / 10**9 + 0.5) * DENOMINATION_OFFSET)
+
+    def burn_all(self, max_rounds: int = 100_000) -> int:
+        """Zero-change reports until nothing is pending; returns the number of reports."""
+        rounds = 0
+        while self.pending_burn_shares > 0:
+            assert rounds < max_rounds, "burn does not converge"
+            self.oracle_report(0)
+            rounds += 1
+        return rounds
+
+
+def _pool_rebase(pool: StableSwapPool, before: LidoModel, after: LidoModel) -> StableSwapPool:
+    factor = (after.total_pooled_ether / after.total_shares) / (before.total_pooled_ether / before.total_shares)
+    return pool.rebase(factor)
+
+
+def coverage_pnl(lido: LidoModel, pool: StableSwapPool, strategy: str,
+                 quota_bp: int = scenario_params.burn_quota_bp, slashing_bp: float = -100) -> Tuple[float, int, int]:
+    """
+    Coverage scenario of `utils.scenarios.coverage_cell` on the models.
+
+    `lido` is the state before the scenario (sandwicher and victim holding nothing) and is not modified.
+    Returns (sandwicher PnL in wei, victim loss in stETH wei, reports until the cover is burnt).
+    """
+    lido = lido.copy()
+    lido.burn_quota_bp = quota_bp
+
+    lido.submit(VICTIM, scenario_params.initial_victim_stETH_balance)
+    lido.submit(WHALE, 50000 * 10**18)
+
+    before = lido.copy()
+    lido.oracle_report(slashing_bp)
+    pool = _pool_rebase(pool, before, lido)
+    steth_amount_to_recover = lido.get_pooled_eth_by_shares(int(0.01 * lido.total_shares))
+
+    eth_in = scenario_params.initial_sandwicher_ETH_balance
+    if strategy == 'trade':
+        steth_out, pool = pool.exchange(ETH_INDEX, STETH_INDEX, eth_in)
+        # shares move out of the pool, which is not tracked as a holder
+        lido.shares[SANDWICHER] = lido.get_shares_by_pooled_eth(int(steth_out))
+    elif strategy == 'stake':
+        lido.submit(SANDWICHER, eth_in)
+    else:
+        raise ValueError(f'unknown strategy {strategy!r}')
+
+    lido.transfer(WHALE, VOTING, steth_amount_to_recover)
+    lido.request_burn_for_cover(VOTING, steth_amount_to_recover)
+
+    before = lido.copy()
+    lido.oracle_report(0)
+    pool = _pool_rebase(pool, before, lido)
+
+    eth_out, pool = pool.exchange(STETH_INDEX, ETH_INDEX, lido.balance_of(SANDWICHER))
+    lido.shares[SANDWICHER] = 0
+    sandwicher_pnl = float(eth_out) - eth_in
+
+    rounds = 1 + lido.burn_all()
+    victim_loss = scenario_params.initial_victim_stETH_balance - lido.balance_of(VICTIM)
+
+    return sandwicher_pnl, victim_loss, rounds
+
+
+def coverage_grid(lido: LidoModel, pool: StableSwapPool, strategy: str, quotas: Sequence[int],
+                  slashings: Sequence[float]) -> List[Dict]:
+    """`coverage_pnl` for every (quota, slashing) pair."""
+    rows = []
+    for slashing_bp in slashings:
+        for quota_bp in quotas:
+            pnl, victim_loss, rounds = coverage_pnl(lido, pool, strategy, quota_bp, slashing_bp)
+            rows.append({
+                'strategy': strategy, 'quota_bp': quota_bp, 'slashing_bp': slashing_bp,
+                'pnl': pnl, 'victim_loss': victim_loss, 'rounds': rounds,
+            })
+    return rows
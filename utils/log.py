@@ -1,15 +1,24 @@
+import os
+
 color_hl = '\x1b[38;5;141m'
 color_green = '\033[92m'
 color_yellow = '\033[93m'
 color_gray = '\x1b[0;m'
 color_end = '\033[0m'
 
+# LOG_CONSOLE=0 silences the narrative output; scenario results still go to `utils/results.py`
+console = os.environ.get('LOG_CONSOLE', '1') != '0'
+
+_heading_listeners = []
+
 
 def highlight(text, color = color_hl):
     return f'{color}{text}{color_end}'
 
 
 def ok(text, value = None):
+    if not console:
+        return
     result = highlight('[ok] ', color_green) + text
 
     if value is not None:
@@ -19,6 +28,8 @@ def ok(text, value = None):
 
 
 def nb(text, value = None):
+    if not console:
+        return
     result = highlight('>>> ', color_yellow) + text
 
     if value is not None:
@@ -27,7 +38,21 @@ def nb(text, value = None):
     print(result)
 
 
+def on_heading(listener):
+    """Calls `listener(text)` on every `h` heading, e.g. to tag what follows with the scenario step."""
+    _heading_listeners.append(listener)
+
+
+def off_heading(listener):
+    if listener in _heading_listeners:
+        _heading_listeners.remove(listener)
+
+
 def h(text):
+    for listener in _heading_listeners:
+        listener(text)
+    if not console:
+        return
     print()
     nb(text)
     print()
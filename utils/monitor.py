@@ -0,0 +1,529 @@
+"""
+Live sandwich risk monitor for pending oracle reports
+
+Watches a node for new blocks and for pending `LidoOracle.reportBeacon` transactions. Lido, pool and
+quorum state is read once and then kept current from the logs of every new block (Lido, oracle and pool
+events in one `eth_getLogs`); events the state cannot follow exactly (`RemoveLiquidityOne`, A ramps, fee
+or member changes), a mismatch with `PostTotalShares` and every `resync_blocks` blocks trigger a full
+re-read in one batch. Each pending report is scored as if it completed the quorum: the worst-case
+sandwich PnL per capital size on the pool model (`utils.replay.score`), published as one JSON line.
+
+Scoring runs on one dedicated thread with a latency budget counted from the moment the transaction was
+seen; a report not scored in time is published with `"status": "over_budget"` and its scoring stops at
+the deadline (or never starts), so late reports do not hold up later ones. Per-event latencies
+(`block`, `report`) are kept as metrics and written to `--metrics` on exit.
+
+`NodeFeed` polls node filters (`eth_newBlockFilter`, `eth_newPendingTransactionFilter`), which works
+over plain HTTP on ganache and geth; `ScriptedFeed` replays a list of events for tests.
+
+Usage:
+    python -m utils.monitor [--url http://127.0.0.1:8545] [--sizes 100,1000,10000,100000] [--budget 0.5] [--metrics metrics.json]
+
+"""
+
+import argparse
+import asyncio
+import collections
+import concurrent.futures
+import functools
+import json
+import sys
+import time
+
+from typing import Any, AsyncIterator, Callable, Deque, Dict, Iterable, List, NamedTuple, Optional, Sequence, Tuple
+
+import utils.rpc as rpc
+
+from utils.lido_model import DENOMINATION_OFFSET, LidoModel
+from utils.replay import DEFAULT_SIZES, score
+from utils.stableswap import A_PRECISION, ETH_INDEX, FEE_DENOMINATOR, STETH_INDEX
+from utils.stats import percentile
+
+
+DEFAULT_BUDGET = 0.5
+DEFAULT_POLL_INTERVAL = 0.1
+DEFAULT_RESYNC_BLOCKS = 50
+
+SECONDS_PER_EPOCH = 32 * 12
+
+# pool's stETH shares in `LidoModel.shares`
+POOL = 'pool'
+
+REPORT_BEACON = rpc.selector('reportBeacon(uint256,uint64,uint32)')
+
+
+lido_topics = {
+    rpc.topic('Submitted(address,uint256,address)'): 'submitted',
+    rpc.topic('Unbuffered(uint256)'): 'unbuffered',
+    rpc.topic('ELRewardsReceived(uint256)'): 'el_rewards',
+    rpc.topic('SharesBurnt(address,uint256,uint256,uint256)'): 'shares_burnt',
+    rpc.topic('FeeSet(uint16)'): 'fee_set',
+}
+oracle_topics = {
+    rpc.topic('BeaconReported(uint256,uint128,uint128,address)'): 'beacon_reported',
+    rpc.topic('Completed(uint256,uint128,uint128)'): 'completed',
+    rpc.topic('PostTotalShares(uint256,uint256,uint256,uint256)'): 'post_total_shares',
+    rpc.topic('ExpectedEpochIdUpdated(uint256)'): 'expected_epoch',
+}
+pool_topics = {
+    rpc.topic('TokenExchange(address,int128,uint256,int128,uint256)'): 'token_exchange',
+    rpc.topic('AddLiquidity(address,uint256[2],uint256[2],uint256,uint256)'): 'add_liquidity',
+    rpc.topic('RemoveLiquidity(address,uint256[2],uint256[2],uint256)'): 'remove_liquidity',
+    rpc.topic('RemoveLiquidityImbalance(address,uint256[2],uint256[2],uint256,uint256)'): 'remove_liquidity_imbalance',
+}
+
+
+class Report(NamedTuple):
+    tx: str
+    sender: str
+    epoch: int
+    beacon_balance: int  # gwei
+    beacon_validators: int
+
+
+class Event(NamedTuple):
+    kind: str  # 'block' or 'report'
+    received: float  # time.monotonic() when the feed saw it
+    block: Optional[int] = None
+    logs: Sequence[Dict] = ()
+    report: Optional[Report] = None
+
+
+def decode_report(tx: Dict, oracle: str) -> Optional[Report]:
+    """The report of a pending `reportBeacon` transaction to `oracle`, None for any other transaction."""
+    if (tx.get('to') or '').lower() != oracle.lower() or not tx['input'].startswith(REPORT_BEACON):
+        return None
+    epoch, beacon_balance, beacon_validators = rpc.words('0x' + tx['input'][len(REPORT_BEACON):])[:3]
+    return Report(tx['hash'], tx['from'], epoch, beacon_balance, beacon_validators)
+
+
+class State:
+    """Lido share accounting, pool balances and quorum votes as of the last applied block."""
+
+    def __init__(self, url: str, lido: str, oracle: str, pool: str):
+        self.url = url
+        self.lido_address = lido
+        self.oracle_address = oracle
+        self.pool_address = pool
+        self.block: Optional[int] = None
+        self.lido: Optional[LidoModel] = None
+        self.pool_eth = 0
+        self.pool_admin_steth = 0
+        self.A = 0.
+        self.fee = 0
+        self.admin_fee = 0
+        self.quorum = 1
+        self.last_completed_epoch = 0
+        # (epoch, beacon balance in gwei, validators) -> members reported it
+        self.votes: Dict[Tuple[int, int, int], int] = collections.Counter()
+        self.resyncs = 0
+
+    def resync(self, block: Optional[int] = None):
+        """Re-reads everything at `block` (the head by default) in one batch."""
+        if block is None:
+            block = int(rpc.request(self.url, 'eth_blockNumber'), 16)
+        reads = [
+            (self.lido_address, rpc.selector('getBufferedEther()')),
+            (self.lido_address, rpc.selector('getBeaconStat()')),
+            (self.lido_address, rpc.selector('getTotalShares()')),
+            (self.lido_address, rpc.selector('getFee()')),
+            (self.lido_address, rpc.selector('sharesOf(address)') + rpc.uint(int(self.pool_address, 16))),
+            (self.lido_address, rpc.selector('balanceOf(address)') + rpc.uint(int(self.pool_address, 16))),
+            (self.pool_address, rpc.selector('balances(uint256)') + rpc.uint(ETH_INDEX)),
+            (self.pool_address, rpc.selector('balances(uint256)') + rpc.uint(STETH_INDEX)),
+            (self.pool_address, rpc.selector('A_precise()')),
+            (self.pool_address, rpc.selector('fee()')),
+            (self.pool_address, rpc.selector('admin_fee()')),
+            (self.oracle_address, rpc.selector('getQuorum()')),
+            (self.oracle_address, rpc.selector('getLastCompletedEpochId()')),
+        ]
+        results = rpc.batch(self.url, [('eth_call', [{'to': to, 'data': data}, hex(block)]) for to, data in reads])
+        (buffered, beacon_stat, total_shares, fee_bp, pool_shares, pool_steth_balance,
+         pool_eth, pool_steth, a_precise, fee, admin_fee, quorum, last_completed_epoch) = results
+        deposited, beacon_validators, beacon_balance = rpc.words(beacon_stat)
+
+        self.lido = LidoModel(
+            int(buffered, 16), deposited, beacon_validators, beacon_balance, int(total_shares, 16),
+            int(fee_bp, 16), {POOL: int(pool_shares, 16)}
+        )
+        self.pool_eth = int(pool_eth, 16)
+        self.pool_admin_steth = int(pool_steth_balance, 16) - int(pool_steth, 16)
+        self.A = int(a_precise, 16) / A_PRECISION
+        self.fee = int(fee, 16)
+        self.admin_fee = int(admin_fee, 16)
+        self.quorum = int(quorum, 16)
+        self.last_completed_epoch = int(last_completed_epoch, 16)
+        self.block = block
+        self.resyncs += 1
+
+    def snapshot(self) -> Dict[str, int]:
+        """Everything `apply` needs, as plain integers (JSON-serializable)."""
+        lido = self.lido
+        return {
+            'block': self.block,
+            'buffered_ether': lido.buffered_ether,
+            'deposited_validators': lido.deposited_validators,
+            'beacon_validators': lido.beacon_validators,
+            'beacon_balance': lido.beacon_balance,
+            'total_shares': lido.total_shares,
+            'fee_bp': lido.fee_bp,
+            'pool_shares': lido.shares_of(POOL),
+            'pool_eth': self.pool_eth,
+            'pool_admin_steth': self.pool_admin_steth,
+            'A_precise': round(self.A * A_PRECISION),
+            'fee': self.fee,
+            'admin_fee': self.admin_fee,
+            'quorum': self.quorum,
+            'last_completed_epoch': self.last_completed_epoch,
+        }
+
+    def restore(self, snapshot: Dict[str, int]):
+        self.lido = LidoModel(
+            snapshot['buffered_ether'], snapshot['deposited_validators'], snapshot['beacon_validators'],
+            snapshot['beacon_balance'], snapshot['total_shares'], snapshot['fee_bp'], {POOL: snapshot['pool_shares']}
+        )
+        self.pool_eth = snapshot['pool_eth']
+        self.pool_admin_steth = snapshot['pool_admin_steth']
+        self.A = snapshot['A_precise'] / A_PRECISION
+        self.fee = snapshot['fee']
+        self.admin_fee = snapshot['admin_fee']
+        self.quorum = snapshot['quorum']
+        self.last_completed_epoch = snapshot['last_completed_epoch']
+        self.block = snapshot['block']
+        self.votes.clear()
+
+    @property
+    def pool_steth(self) -> int:
+        return self.lido.balance_of(POOL) - self.pool_admin_steth
+
+    def _pool_steth_move(self, amount: int):
+        # stETH transfers move whole shares
+        shares = self.lido.get_shares_by_pooled_eth(abs(amount))
+        self.lido.shares[POOL] += shares if amount > 0 else -shares
+
+    def _admin_fee(self, fee: int) -> int:
+        return fee * self.admin_fee // FEE_DENOMINATOR
+
+    def _apply_pool(self, name: str, words: List[int]):
+        if name == 'token_exchange':
+            sold_id, tokens_sold, bought_id, tokens_bought = words
+            # the event has the amount net of the fee; the admin part of the fee stays out of the balances
+            dy_fee = tokens_bought * self.fee // (FEE_DENOMINATOR - self.fee)
+            admin = self._admin_fee(dy_fee)
+            if sold_id == ETH_INDEX:
+                self.pool_eth += tokens_sold
+                self._pool_steth_move(-tokens_bought)
+                self.pool_admin_steth += admin
+            else:
+                self._pool_steth_move(tokens_sold)
+                self.pool_eth -= tokens_bought + admin
+            return
+
+        amounts, fees = words[0:2], words[2:4]
+        if name == 'add_liquidity':
+            sign, admin = 1, [-self._admin_fee(fee) for fee in fees]
+        elif name == 'remove_liquidity':
+            sign, admin = -1, [0, 0]
+        else:
+            sign, admin = -1, [-self._admin_fee(fee) for fee in fees]
+        self.pool_eth += sign * amounts[ETH_INDEX] + admin[ETH_INDEX]
+        self._pool_steth_move(sign * amounts[STETH_INDEX])
+        self.pool_admin_steth -= admin[STETH_INDEX]
+
+    def _apply_lido(self, name: str, log: Dict, words: List[int]):
+        lido = self.lido
+        if name == 'submitted':
+            amount = words[0]
+            lido.total_shares += lido.get_shares_by_pooled_eth(amount)
+            lido.buffered_ether += amount
+        elif name == 'unbuffered':
+            lido.buffered_ether -= words[0]
+            lido.deposited_validators += words[0] // (32 * 10**18)
+        elif name == 'el_rewards':
+            lido.buffered_ether += words[0]
+        elif name == 'shares_burnt':
+            lido.total_shares -= words[2]
+            if int(log['topics'][1], 16) == int(self.pool_address, 16):
+                lido.shares[POOL] -= words[2]
+        elif name == 'fee_set':
+            lido.fee_bp = words[0]
+
+    def apply(self, logs: Iterable[Dict]) -> bool:
+        """Applies the logs of one block in order; False when the state can no longer follow and needs a resync."""
+        pool = self.pool_address.lower()
+        for log in logs:
+            address = log['address'].lower()
+            topic = log['topics'][0] if log['topics'] else None
+            words = rpc.words(log['data'])
+
+            if address == pool:
+                if topic not in pool_topics:
+                    return False
+                self._apply_pool(pool_topics[topic], words)
+            elif address == self.lido_address.lower():
+                if topic in lido_topics:
+                    self._apply_lido(lido_topics[topic], log, words)
+            elif topic in oracle_topics:
+                name = oracle_topics[topic]
+                # the oracle logs beacon balances in wei, members report them in gwei
+                if name == 'beacon_reported':
+                    epoch, beacon_balance, beacon_validators = words[:3]
+                    self.votes[(epoch, beacon_balance // DENOMINATION_OFFSET, beacon_validators)] += 1
+                elif name == 'completed':
+                    epoch, beacon_balance, beacon_validators = words
+                    self.lido.handle_oracle_report(beacon_validators, beacon_balance)
+                    self.last_completed_epoch = epoch
+                    self.votes.clear()
+                elif name == 'post_total_shares':
+                    post_total_pooled_ether, _, _, total_shares = words
+                    self.lido.total_shares = total_shares
+                    if self.lido.total_pooled_ether != post_total_pooled_ether:
+                        return False
+            else:
+                # quorum, member or oracle settings changes
+                return False
+        return True
+
+    def report(self, report: Report) -> Dict:
+        """`utils.replay` archive entry for the state after `report` completes the quorum."""
+        after = self.lido.copy()
+        after.handle_oracle_report(report.beacon_validators, report.beacon_balance * DENOMINATION_OFFSET)
+        return {
+            'block': self.block,
+            'tx': report.tx,
+            # share rate change with the fee shares already minted, hence `fee_bp` 0
+            'pre_total_pooled_ether': self.lido.total_pooled_ether,
+            'post_total_pooled_ether': (
+                after.total_pooled_ether * self.lido.total_shares // after.total_shares
+            ),
+            'time_elapsed': max(report.epoch - self.last_completed_epoch, 0) * SECONDS_PER_EPOCH,
+            'fee_bp': 0,
+            'pool': {
+                'balances': [self.pool_eth, self.pool_steth],
+                'A': self.A, 'fee': self.fee, 'admin_fee': self.admin_fee,
+            },
+        }
+
+    def completes_quorum(self, report: Report) -> bool:
+        key = (report.epoch, report.beacon_balance, report.beacon_validators)
+        return report.epoch > self.last_completed_epoch and self.votes[key] + 1 >= self.quorum
+
+
+class Metrics:
+    """Processing latency per event kind, over the last `window` events."""
+
+    def __init__(self, budget: float, window: int = 10_000):
+        self.budget = budget
+        self.latencies: Dict[str, Deque[float]] = collections.defaultdict(lambda: collections.deque(maxlen=window))
+        self.counts: Dict[str, int] = collections.Counter()
+        self.over_budget: Dict[str, int] = collections.Counter()
+
+    def observe(self, kind: str, latency: float):
+        self.latencies[kind].append(latency)
+        self.counts[kind] += 1
+        if latency > self.budget:
+            self.over_budget[kind] += 1
+
+    def snapshot(self) -> Dict[str, Dict]:
+        return {
+            kind: {
+                'count': self.counts[kind],
+                'over_budget': self.over_budget[kind],
+                'p50': percentile(list(samples), 50),
+                'p95': percentile(list(samples), 95),
+                'p99': percentile(list(samples), 99),
+                'max': max(samples),
+            }
+            for kind, samples in self.latencies.items() if samples
+        }
+
+
+class NodeFeed:
+    """New blocks with their Lido, oracle and pool logs, and pending `reportBeacon` transactions, from node filters."""
+
+    def __init__(self, url: str, state: State, poll_interval: float = DEFAULT_POLL_INTERVAL):
+        self.url = url
+        self.state = state
+        self.poll_interval = poll_interval
+
+    async def _call(self, method: str, params: Optional[list] = None) -> Any:
+        return await asyncio.get_running_loop().run_in_executor(None, rpc.request, self.url, method, params)
+
+    async def _batch(self, calls: List[Tuple[str, list]]) -> List[Any]:
+        return await asyncio.get_running_loop().run_in_executor(None, rpc.batch, self.url, calls)
+
+    async def __aiter__(self) -> AsyncIterator[Event]:
+        state = self.state
+        blocks = await self._call('eth_newBlockFilter')
+        pending = await self._call('eth_newPendingTransactionFilter')
+        addresses = [state.lido_address, state.oracle_address, state.pool_address]
+
+        while True:
+            block_hashes, tx_hashes = await self._batch([
+                ('eth_getFilterChanges', [blocks]), ('eth_getFilterChanges', [pending]),
+            ])
+            received = time.monotonic()
+
+            txs = await self._batch([('eth_getTransactionByHash', [tx]) for tx in tx_hashes])
+            for tx in txs:
+                if tx is None:
+                    # dropped already
+                    continue
+                report = decode_report(tx, state.oracle_address)
+                if report is not None:
+                    yield Event('report', received, report=report)
+
+            if block_hashes:
+                head = int(await self._call('eth_blockNumber'), 16)
+                logs = await self._call('eth_getLogs', [{
+                    'address': addresses, 'fromBlock': hex(state.block + 1), 'toBlock': hex(head),
+                }])
+                by_block = collections.defaultdict(list)
+                for log in logs:
+                    by_block[int(log['blockNumber'], 16)].append(log)
+                for number in range(state.block + 1, head + 1):
+                    yield Event('block', received, block=number, logs=sorted(
+                        by_block[number], key=lambda log: int(log['logIndex'], 16)
+                    ))
+
+            await asyncio.sleep(self.poll_interval)
+
+
+class ScriptedFeed:
+    """
+    Replays `(delay, event)` pairs; `event` is a `Report`, or `(block number, logs)` for a block.
+
+    `received` is stamped when the event is yielded, so latencies are measured as on a node.
+    """
+
+    def __init__(self, script: Iterable[Tuple[float, Any]]):
+        self.script = list(script)
+
+    async def __aiter__(self) -> AsyncIterator[Event]:
+        for delay, item in self.script:
+            if delay:
+                await asyncio.sleep(delay)
+            if isinstance(item, Report):
+                yield Event('report', time.monotonic(), report=item)
+            else:
+                number, logs = item
+                yield Event('block', time.monotonic(), block=number, logs=logs)
+
+
+def print_json(result: Dict):
+    print(json.dumps(result), flush=True)
+
+
+class Monitor:
+    def __init__(self, state: State, sizes: Sequence[int] = DEFAULT_SIZES, budget: float = DEFAULT_BUDGET,
+                 publish: Callable[[Dict], None] = print_json, resync_blocks: int = DEFAULT_RESYNC_BLOCKS):
+        self.state = state
+        self.sizes = list(sizes)
+        self.publish = publish
+        self.resync_blocks = resync_blocks
+        self.metrics = Metrics(budget)
+        self._synced_at = state.block
+        # one scoring job at a time: a report over budget cannot hold threads the next ones need
+        self._scorer = concurrent.futures.ThreadPoolExecutor(max_workers=1, thread_name_prefix='monitor-score')
+
+    @property
+    def budget(self) -> float:
+        """Seconds from seeing a report to its score; over-budget counts follow changes."""
+        return self.metrics.budget
+
+    @budget.setter
+    def budget(self, budget: float):
+        self.metrics.budget = budget
+
+    def close(self):
+        """Stops the scoring thread; a report still being scored stops at its deadline."""
+        self._scorer.shutdown(wait=False)
+
+    async def _resync(self):
+        await asyncio.get_running_loop().run_in_executor(None, self.state.resync)
+        self._synced_at = self.state.block
+
+    async def on_block(self, event: Event):
+        state = self.state
+        if event.block <= state.block:
+            return
+        if not state.apply(event.logs) or event.block - self._synced_at >= self.resync_blocks:
+            await self._resync()
+        else:
+            state.block = event.block
+        self.metrics.observe('block', time.monotonic() - event.received)
+
+    async def on_report(self, event: Event):
+        report = event.report
+        result = {
+            'tx': report.tx, 'member': report.sender, 'epoch': report.epoch,
+            'beacon_balance': report.beacon_balance, 'beacon_validators': report.beacon_validators,
+            'completes_quorum': self.state.completes_quorum(report),
+        }
+        deadline = event.received + self.budget
+        try:
+            # scoring reads only the state as of now, so it runs off the event loop
+            entry = self.state.report(report)
+            scored = await asyncio.wait_for(
+                asyncio.get_running_loop().run_in_executor(
+                    self._scorer, functools.partial(score, entry, self.sizes, deadline=deadline)
+                ),
+                max(deadline - time.monotonic(), 0.)
+            )
+            worst = [max(pnl[ind] for pnl in scored['pnl'].values()) for ind in range(len(self.sizes))]
+            result.update(status='ok', rebase_bp=scored['rebase_bp'], sizes=self.sizes, pnl=scored['pnl'],
+                          worst_case_pnl=worst, worst_case_size=scored['best_size'])
+        except (asyncio.TimeoutError, TimeoutError):
+            result.update(status='over_budget')
+        except AssertionError as error:
+            # the report would revert (e.g. fewer validators than reported before)
+            result.update(status='invalid', error=str(error))
+
+        latency = time.monotonic() - event.received
+        result['latency'] = latency
+        self.metrics.observe('report', latency)
+        self.publish(result)
+
+    async def run(self, feed):
+        async for event in feed:
+            if event.kind == 'block':
+                await self.on_block(event)
+            else:
+                await self.on_report(event)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--url', default='http://127.0.0.1:8545')
+    parser.add_argument('--network', default='mainnet', help='address table of utils/config.py')
+    parser.add_argument('--sizes', default=None, help='comma-separated capital sizes in ETH')
+    parser.add_argument('--budget', type=float, default=DEFAULT_BUDGET, help='seconds from seeing a report to its score')
+    parser.add_argument('--poll', type=float, default=DEFAULT_POLL_INTERVAL)
+    parser.add_argument('--resync-blocks', type=int, default=DEFAULT_RESYNC_BLOCKS)
+    parser.add_argument('--metrics', default=None, help='write latency metrics as JSON here on exit')
+    args = parser.parse_args(argv)
+
+    from utils.config import addresses
+
+    config = addresses(args.network)
+    sizes = [int(float(size) * 10**18) for size in args.sizes.split(',')] if args.sizes else DEFAULT_SIZES
+
+    state = State(args.url, config['lido_dao_steth_address'], config['lido_dao_oracle'], config['curve_steth_pool_address'])
+    state.resync()
+    monitor = Monitor(state, sizes, args.budget, resync_blocks=args.resync_blocks)
+    try:
+        asyncio.run(monitor.run(NodeFeed(args.url, state, args.poll)))
+    except KeyboardInterrupt:
+        pass
+    finally:
+        monitor.close()
+        metrics = json.dumps(monitor.metrics.snapshot(), indent=2)
+        if args.metrics:
+            with open(args.metrics, 'w') as f:
+                f.write(metrics)
+        else:
+            print(metrics, file=sys.stderr)
+
+
+if __name__ == '__main__':
+    main()
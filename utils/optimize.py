@@ -0,0 +1,149 @@
+"""
+Searches over sandwich parameters with few fork evaluations
+
+`max_profit_size` brackets the best sandwich size on a coarse log grid and refines it with
+golden-section search; `break_even_quota` bisects the burn quota for the highest value
+that keeps the sandwich unprofitable. Both take any `evaluate(x) -> pnl` callable:
+a `ForkEvaluator` over a scenario or the off-chain models alike.
+
+"""
+
+import math
+
+from typing import Callable, List, NamedTuple, Tuple
+
+from brownie import chain
+import utils.scenarios as scenarios
+
+
+INVPHI = (math.sqrt(5) - 1) / 2
+
+
+class SearchResult(NamedTuple):
+    x: float
+    value: float
+    trace: List[Tuple[float, float]]
+
+
+class ForkEvaluator:
+    """
+    Evaluates `scenario(x)` from the same chain state every time.
+
+    The state at construction is snapshotted with `chain.snapshot()` and restored with
+    `chain.revert()` after each evaluation; results are memoized and traced in call order.
+    """
+
+    def __init__(self, scenario: Callable[[float], float]):
+        self.scenario = scenario
+        self.trace: List[Tuple[float, float]] = []
+        self._cache = {}
+        chain.snapshot()
+
+    def __call__(self, x: float) -> float:
+        if x not in self._cache:
+            try:
+                self._cache[x] = self.scenario(x)
+            finally:
+                chain.revert()
+            self.trace.append((x, self._cache[x]))
+        return self._cache[x]
+
+
+def _traced(evaluate: Callable[[float], float]) -> Tuple[Callable[[float], float], List[Tuple[float, float]]]:
+    trace = []
+    cache = {}
+
+    def traced(x):
+        if x not in cache:
+            cache[x] = evaluate(x)
+            trace.append((x, cache[x]))
+        return cache[x]
+
+    return traced, trace
+
+
+def golden_section_max(evaluate: Callable[[float], float], lo: float, hi: float, tol: float) -> SearchResult:
+    """Maximum of a unimodal `evaluate` on [lo, hi] down to an interval of width `tol`."""
+    f, trace = _traced(evaluate)
+
+    a, b = lo, hi
+    c = b - INVPHI * (b - a)
+    d = a + INVPHI * (b - a)
+    while b - a > tol:
+        if f(c) >= f(d):
+            b, d = d, c
+            c = b - INVPHI * (b - a)
+        else:
+            a, c = c, d
+            d = a + INVPHI * (b - a)
+
+    x = max((c, d), key=f)
+    return SearchResult(x, f(x), trace)
+
+
+def max_profit_size(evaluate: Callable[[float], float], lo: float, hi: float,
+                    rel_tol: float = 0.01, bracket_points: int = 5) -> SearchResult:
+    """
+    Sandwich size in [lo, hi] maximising `evaluate(size)`, to `rel_tol` relative precision.
+
+    Sizes are searched in log space: `bracket_points` log-spaced sizes locate the best bracket,
+    golden-section search refines it. A dense grid of the same resolution needs
+    `log(hi / lo) / rel_tol` evaluations, this needs about `bracket_points + 2 * log(1 / rel_tol)`.
+    """
+    f, trace = _traced(evaluate)
+
+    log_lo, log_hi = math.log(lo), math.log(hi)
+    step = (log_hi - log_lo) / (bracket_points - 1)
+    grid = [log_lo + ind * step for ind in range(bracket_points)]
+    values = [f(math.exp(x)) for x in grid]
+
+    best = max(range(bracket_points), key=lambda ind: values[ind])
+    a = grid[max(best - 1, 0)]
+    b = grid[min(best + 1, bracket_points - 1)]
+
+    result = golden_section_max(lambda x: f(math.exp(x)), a, b, math.log1p(rel_tol))
+
+    x, value = math.exp(result.x), result.value
+    if values[best] > value:
+        x, value = math.exp(grid[best]), values[best]
+
+    return SearchResult(x, value, trace)
+
+
+def break_even_quota(evaluate: Callable[[int], float], lo: int, hi: int) -> SearchResult:
+    """
+    Highest integer quota in [lo, hi] with `evaluate(quota) <= 0`, for `evaluate` growing with the quota.
+
+    Returns `lo - 1` if even `lo` is profitable and `hi` if the whole range is unprofitable.
+    """
+    f, trace = _traced(evaluate)
+
+    if f(hi) <= 0:
+        return SearchResult(hi, f(hi), trace)
+    if f(lo) > 0:
+        return SearchResult(lo - 1, f(lo), trace)
+
+    # invariant: f(lo) <= 0 < f(hi)
+    while hi - lo > 1:
+        mid = (lo + hi) // 2
+        if f(mid) <= 0:
+            lo = mid
+        else:
+            hi = mid
+
+    return SearchResult(lo, f(lo), trace)
+
+
+def mev_size_scenario(accounts, lido, oracle, sandwicher, strategy: str, dpr: float) -> Callable[[float], float]:
+    return lambda size: scenarios.mev_cell(accounts, lido, oracle, sandwicher, strategy, dpr, int(size))
+
+
+def coverage_quota_scenario(accounts, dao_voting, lido, oracle, self_owned_steth_burner,
+                            sandwicher, strategy: str) -> Callable[[int], float]:
+    def scenario(quota_bp):
+        pnl, _ = scenarios.coverage_cell(
+            accounts, dao_voting, lido, oracle, self_owned_steth_burner, sandwicher, strategy, quota_bp
+        )
+        return pnl
+
+    return scenario
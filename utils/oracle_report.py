@@ -0,0 +1,173 @@
+"""
+Lido oracle reports for the fork scenarios
+
+Backends (`ORACLE_REPORT_BACKEND` env var or the `backend` argument):
+    quorum -- one `reportBeacon` per oracle member up to the quorum (faithful, default)
+    fast   -- the oracle contract is impersonated and pushes the report to Lido (`handleOracleReport`)
+              and to the post-rebase receiver directly: two transactions regardless of the quorum size;
+              the oracle's epoch and report-delta storage is written as `_push` would, sanity checks are skipped
+    diff   -- runs `fast` then `quorum` from the same snapshot, checks that share price, total shares
+              and burner balances match and keeps the `quorum` state
+
+"""
+
+import math
+import os
+
+from brownie import ZERO_ADDRESS, web3
+
+import utils.evm as evm
+import utils.trace_profile as trace_profile
+
+from utils.batch_reads import read
+from utils.pipeline import pipelined
+
+
+backends = ('quorum', 'fast', 'diff')
+
+DEFAULT_BACKEND = 'quorum'
+
+
+def default_backend() -> str:
+    backend = os.environ.get('ORACLE_REPORT_BACKEND', DEFAULT_BACKEND)
+    assert backend in backends, f"unknown oracle report backend {backend!r}"
+    return backend
+
+
+def _quorum_report(lido, oracle, epoch, beacon_balance_gwei, validators):
+    reporters, quorum = read(oracle.getOracleMembers, oracle.getQuorum)
+
+    # members report independently: send them all, then wait for the receipts once
+    last = None
+    with pipelined() as txs:
+        for reporter in reporters[:quorum]:
+            last = txs.call(f'reportBeacon by {reporter}', oracle.reportBeacon, epoch, beacon_balance_gwei, validators, tx={ 'from': reporter })
+
+    # the report completing the quorum runs the rebase and its callbacks
+    trace_profile.observe('reportBeacon quorum', last)
+
+
+def _rebase_receiver(oracle):
+    from brownie import interface
+
+    receiver = oracle.getBeaconReportReceiver()
+    if receiver == ZERO_ADDRESS:
+        return None
+    return interface.CompositePostRebaseBeaconReceiver(receiver)
+
+
+# unstructured storage positions of LidoOracle written when a frame completes (`_push`, `_clearReportingAndAdvanceTo`)
+_oracle_positions = {
+    'expected_epoch': 'lido.LidoOracle.expectedEpochId',
+    'reports_bitmask': 'lido.LidoOracle.reportsBitMask',
+    'pre_total_pooled_ether': 'lido.LidoOracle.preCompletedTotalPooledEther',
+    'post_total_pooled_ether': 'lido.LidoOracle.postCompletedTotalPooledEther',
+    'time_elapsed': 'lido.LidoOracle.timeElapsed',
+    'last_completed_epoch': 'lido.LidoOracle.lastCompletedEpochId',
+}
+# length of `uint256[] currentReportVariants`, declared after `address[] members` (AragonApp keeps no sequential state)
+_REPORT_VARIANTS_SLOT = '0x1'
+
+
+def _write_oracle_state(oracle, **values):
+    for name, value in values.items():
+        evm.set_storage_at(oracle.address, web3.keccak(text=_oracle_positions[name]).hex(), value)
+    # member votes of the completed frame (e.g. the one of `prepare_oracle`) are dropped like `delete currentReportVariants`
+    evm.set_storage_at(oracle.address, _REPORT_VARIANTS_SLOT, 0)
+    assert oracle.getCurrentReportVariantsSize() == 0, "unexpected LidoOracle storage layout"
+
+
+def _fast_report(lido, oracle, epoch, beacon_balance_gwei, validators):
+    from brownie import accounts
+
+    oracle_acc = accounts.at(oracle.address, force=True)
+
+    (epochs_per_frame, slots_per_epoch, seconds_per_slot, _), last_epoch, pre_total_pooled_ether = read(
+        oracle.getBeaconSpec, oracle.getLastCompletedEpochId, lido.totalSupply
+    )
+    time_elapsed = (epoch - last_epoch) * slots_per_epoch * seconds_per_slot
+
+    lido.handleOracleReport(validators, beacon_balance_gwei * 10**9, {'from': oracle_acc, 'gas_price': 0})
+    post_total_pooled_ether = lido.totalSupply()
+
+    _write_oracle_state(
+        oracle,
+        expected_epoch=epoch + epochs_per_frame,
+        reports_bitmask=0,
+        pre_total_pooled_ether=pre_total_pooled_ether,
+        post_total_pooled_ether=post_total_pooled_ether,
+        time_elapsed=time_elapsed,
+        last_completed_epoch=epoch,
+    )
+
+    receiver = _rebase_receiver(oracle)
+    if receiver is not None:
+        receiver.processLidoOracleReport(
+            post_total_pooled_ether, pre_total_pooled_ether, time_elapsed, {'from': oracle_acc, 'gas_price': 0}
+        )
+
+
+def report_outcome(lido, oracle):
+    """
+    State a report is expected to produce: share price, total shares, the oracle's epochs and
+    last report delta, and shares of the rebase callbacks.
+    """
+    outcome = {
+        'share_price': lido.getPooledEthByShares(10 ** 27),
+        'total_shares': lido.getTotalShares(),
+        'last_completed_epoch': oracle.getLastCompletedEpochId(),
+        'expected_epoch': oracle.getExpectedEpochId(),
+        'last_completed_report_delta': tuple(oracle.getLastCompletedReportDelta()),
+    }
+    receiver = _rebase_receiver(oracle)
+    if receiver is not None:
+        for ind in range(receiver.callbacksLength()):
+            callback = receiver.callbacks(ind)
+            outcome[f'shares_of_{callback}'] = lido.sharesOf(callback)
+    return outcome
+
+
+def _diff_report(lido, oracle, epoch, beacon_balance_gwei, validators):
+    snapshot_id = evm.snapshot()
+    _fast_report(lido, oracle, epoch, beacon_balance_gwei, validators)
+    fast_outcome = report_outcome(lido, oracle)
+
+    evm.revert(snapshot_id)
+    _quorum_report(lido, oracle, epoch, beacon_balance_gwei, validators)
+    quorum_outcome = report_outcome(lido, oracle)
+
+    assert fast_outcome == quorum_outcome, f"fast report diverges: {fast_outcome} != {quorum_outcome}"
+
+
+_reporters = {
+    'quorum': _quorum_report,
+    'fast': _fast_report,
+    'diff': _diff_report,
+}
+
+
+def report_beacon(lido, oracle, epoch, beacon_balance_gwei, validators, backend=None):
+    _reporters[backend or default_backend()](lido, oracle, epoch, beacon_balance_gwei, validators)
+
+
+def oracle_report(lido, oracle, change, check=True, backend=None):
+    """Reports a beacon balance changing the stETH share price by `change` basis points (after fee)."""
+    (_, validators, beaconBalance), expectedEpoch, before_share_price, total_pooled_ether = read(
+        lido.getBeaconStat, oracle.getExpectedEpochId, (lido.getPooledEthByShares, 10 ** 27), lido.getTotalPooledEther
+    )
+
+    buffered = total_pooled_ether - beaconBalance
+
+    if change > 0:
+        change = change / 0.9 # protocol fee
+
+    new_total_pooled_ether = total_pooled_ether * (1. + change / 10000.)
+    new_balance = new_total_pooled_ether - buffered
+
+    report_beacon(lido, oracle, expectedEpoch, int(new_balance / 10**9 + 0.5), validators, backend)
+
+    after_share_price = lido.getPooledEthByShares(10 ** 27)
+    real_change = (after_share_price / before_share_price - 1.) * 10000.
+
+    if check:
+        assert math.isclose(change, real_change, rel_tol=1e-2, abs_tol=0.0), "unexpected change"
@@ -0,0 +1,79 @@
+"""
+Pipelined transaction submission
+
+Inside `with pipelined() as txs:` transactions are sent with `required_confs=0`, so brownie returns
+right after `eth_sendTransaction` instead of waiting for and processing each receipt. Leaving the block
+waits for all receipts at once and raises `PipelineError` naming every transaction that reverted,
+by the label it was sent with. Only independent transactions (different senders, or the same sender
+without gas estimates depending on the previous transaction) should share a pipeline.
+
+`PIPELINE_TXS=0` sends and waits one transaction at a time instead.
+
+"""
+
+import contextlib
+import os
+
+from typing import Any, Callable, Dict, Iterator, List, Optional, Tuple
+
+
+class PipelineError(RuntimeError):
+    def __init__(self, failures: List[Tuple[str, str]]):
+        super().__init__('; '.join(f'{label} reverted: {reason}' for label, reason in failures))
+        self.failures = failures
+
+
+def default_enabled() -> bool:
+    return os.environ.get('PIPELINE_TXS', '1') != '0'
+
+
+class Pipeline:
+    def __init__(self, enabled: Optional[bool] = None):
+        self.enabled = default_enabled() if enabled is None else enabled
+        self._sent: List[Tuple[str, Any]] = []
+        self._failures: List[Tuple[str, str]] = []
+
+    def _options(self, tx: Dict) -> Dict:
+        return {**tx, 'required_confs': 0} if self.enabled else tx
+
+    def _send(self, label: str, send: Callable[[], Any]) -> Any:
+        try:
+            receipt = send()
+        except Exception as error:
+            # the node refused the transaction outright (e.g. a revert during gas estimation)
+            self._failures.append((label, str(error)))
+            return None
+        self._sent.append((label, receipt))
+        return receipt
+
+    def call(self, label: str, method, *args, tx: Dict) -> Any:
+        """Sends `method(*args, tx)`, e.g. `call('member 1', oracle.reportBeacon, epoch, balance, validators, tx={'from': m})`."""
+        return self._send(label, lambda: method(*args, self._options(tx)))
+
+    def transfer(self, label: str, sender, to, amount: int, **kwargs) -> Any:
+        options = self._options(kwargs)
+        return self._send(label, lambda: sender.transfer(to, amount, **options))
+
+    def wait(self) -> List[Any]:
+        """Receipts of all transactions in send order; raises `PipelineError` if any of them failed."""
+        failures = list(self._failures)
+        receipts = []
+        for label, receipt in self._sent:
+            if self.enabled:
+                receipt.wait(1)
+            if receipt.status == 0:
+                failures.append((label, receipt.revert_msg or 'reverted'))
+            receipts.append(receipt)
+
+        self._sent = []
+        self._failures = []
+        if failures:
+            raise PipelineError(failures)
+        return receipts
+
+
+@contextlib.contextmanager
+def pipelined(enabled: Optional[bool] = None) -> Iterator[Pipeline]:
+    pipeline = Pipeline(enabled)
+    yield pipeline
+    pipeline.wait()
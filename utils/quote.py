@@ -0,0 +1,95 @@
+"""
+Quote-only evaluation of `CurveExchanger` legs through `eth_call` with state overrides
+
+Instead of funding the exchanger and mining a swap, the exchanger balance (ETH or stETH shares)
+is overridden inside an `eth_call`; quotes for many amounts go out as one JSON-RPC batch
+and nothing is mined.
+
+"""
+
+from typing import Dict, List, Optional, Sequence
+
+from eth_utils import keccak
+
+import utils.rpc as rpc
+
+
+# `StETH.shares` mapping: the first storage variable of the stETH (Lido) implementation
+STETH_SHARES_SLOT = 0
+
+QUOTE_GAS = 2_000_000
+
+
+def shares_slot(holder: str) -> str:
+    """Storage slot of `shares[holder]` in the stETH contract."""
+    key = bytes.fromhex(holder[2:].rjust(64, '0')) + STETH_SHARES_SLOT.to_bytes(32, 'big')
+    return '0x' + keccak(key).hex()
+
+
+def shares_by_pooled_eth(amounts: Sequence[int], total_shares: int, total_pooled_ether: int) -> List[int]:
+    """Same rounding as `Lido.getSharesByPooledEth`."""
+    return [amount * total_shares // total_pooled_ether for amount in amounts]
+
+
+class Quoter:
+    """Quotes `swapETH2StETH`/`swapStETH2ETH`/`stakeETH4StETH` of a deployed exchanger at the latest state."""
+
+    def __init__(self, exchanger, lido, url: Optional[str] = None, block: str = 'latest'):
+        self.exchanger = exchanger
+        self.lido = lido
+        self.url = url or rpc.provider_url()
+        self.block = block
+
+    def _call(self, data: str, overrides: Dict) -> tuple:
+        tx = {'to': self.exchanger.address, 'data': data, 'gas': hex(QUOTE_GAS)}
+        return 'eth_call', [tx, self.block, overrides]
+
+    def _balance_override(self, eth: int = 0, shares: int = 0) -> Dict:
+        return {
+            self.exchanger.address: {'balance': hex(eth)},
+            self.lido.address: {'stateDiff': {shares_slot(self.exchanger.address): '0x' + hex(shares)[2:].rjust(64, '0')}},
+        }
+
+    def _quote(self, method, overrides: Sequence[Dict]) -> List[int]:
+        data = method.encode_input()
+        results = rpc.batch(self.url, [self._call(data, override) for override in overrides])
+        return [int(result, 16) for result in results]
+
+    def _view(self, method, amounts: Sequence[int]) -> List[int]:
+        calls = [
+            ('eth_call', [{'to': self.exchanger.address, 'data': method.encode_input(amount)}, self.block])
+            for amount in amounts
+        ]
+        return [int(result, 16) for result in rpc.batch(self.url, calls)]
+
+    def view_eth_to_steth(self, amounts: Sequence[int]) -> List[int]:
+        """Pool `get_dy` for ETH -> stETH through the exchanger's `quoteETH2StETH` view, no overrides."""
+        return self._view(self.exchanger.quoteETH2StETH, amounts)
+
+    def view_steth_to_eth(self, amounts: Sequence[int]) -> List[int]:
+        """Pool `get_dy` for stETH -> ETH through the exchanger's `quoteStETH2ETH` view, no overrides."""
+        return self._view(self.exchanger.quoteStETH2ETH, amounts)
+
+    def view_stake(self, amounts: Sequence[int]) -> List[int]:
+        """Lido share math for ETH -> stETH through the exchanger's `quoteStakeETH4StETH` view."""
+        return self._view(self.exchanger.quoteStakeETH4StETH, amounts)
+
+    def eth_to_steth(self, amounts: Sequence[int]) -> List[int]:
+        """stETH balance after swapping each ETH amount through Curve."""
+        return self._quote(self.exchanger.swapETH2StETH, [self._balance_override(eth=amount) for amount in amounts])
+
+    def stake(self, amounts: Sequence[int]) -> List[int]:
+        """stETH balance after submitting each ETH amount to Lido."""
+        return self._quote(self.exchanger.stakeETH4StETH, [self._balance_override(eth=amount) for amount in amounts])
+
+    def shares_to_eth(self, shares: Sequence[int]) -> List[int]:
+        """ETH received for swapping the stETH of each shares amount through Curve."""
+        return self._quote(self.exchanger.swapStETH2ETH, [self._balance_override(shares=amount) for amount in shares])
+
+    def steth_to_eth(self, amounts: Sequence[int]) -> List[int]:
+        """ETH received for swapping each stETH amount through Curve (shares rounded down as in Lido)."""
+        total_shares, total_pooled_ether = rpc.batch(self.url, [
+            ('eth_call', [{'to': self.lido.address, 'data': self.lido.getTotalShares.encode_input()}, self.block]),
+            ('eth_call', [{'to': self.lido.address, 'data': self.lido.getTotalPooledEther.encode_input()}, self.block]),
+        ])
+        return self.shares_to_eth(shares_by_pooled_eth(amounts, int(total_shares, 16), int(total_pooled_ether, 16)))
@@ -0,0 +1,252 @@
+"""
+Replay of past oracle reports against the Curve pool model
+
+An archive is a JSON-lines file (optionally `.gz`), one completed `LidoOracle` report per line:
+
+    {"block": ..., "tx": ..., "post_total_pooled_ether": ..., "pre_total_pooled_ether": ...,
+     "time_elapsed": ..., "total_shares": ..., "fee_bp": ...,
+     "pool": {"balances": [eth, steth], "A": ..., "fee": ..., "admin_fee": ...}}
+
+with the pool state and the Lido fee read one block before the report. `fetch` builds it from
+`PostTotalShares` logs of an archive node; `run` streams it, scores the sandwich PnL of every capital
+size and strategy on the pool model (`utils/stableswap.py`) and appends one result line per report.
+Progress is checkpointed, so an interrupted `run` resumes where it stopped.
+
+Usage:
+    python -m utils.replay fetch --from-block N --to-block M archive.jsonl.gz [--url URL]
+    python -m utils.replay run archive.jsonl.gz results.jsonl [--sizes 100,1000,10000] [--every 100] [--overwrite]
+
+"""
+
+import argparse
+import gzip
+import json
+import os
+import time
+
+from typing import Dict, Iterator, List, Optional, Sequence, Tuple
+
+import utils.rpc as rpc
+
+from utils.stableswap import A_PRECISION, ETH_INDEX, STETH_INDEX, StableSwapPool, sandwich_pnl, strategies
+
+
+TOTAL_BASIS_POINTS = 10000
+
+POST_TOTAL_SHARES_TOPIC = rpc.topic('PostTotalShares(uint256,uint256,uint256,uint256)')
+
+DEFAULT_SIZES = [x * 10**18 for x in [100, 1_000, 10_000, 100_000]]
+DEFAULT_LOG_CHUNK = 50_000
+
+
+def _open(path: str, mode: str):
+    return gzip.open(path, mode) if path.endswith('.gz') else open(path, mode)
+
+
+# archive
+
+def _fetch_state(url: str, blocks: Sequence[int], lido: str, pool: str) -> List[Dict]:
+    """Lido fee and pool state at each of `blocks`, all in one batch."""
+    reads = [
+        (lido, rpc.selector('getFee()')),
+        (pool, rpc.selector('balances(uint256)') + rpc.uint(ETH_INDEX)),
+        (pool, rpc.selector('balances(uint256)') + rpc.uint(STETH_INDEX)),
+        (pool, rpc.selector('A_precise()')),
+        (pool, rpc.selector('fee()')),
+        (pool, rpc.selector('admin_fee()')),
+    ]
+    calls = [('eth_call', [{'to': to, 'data': data}, hex(block)]) for block in blocks for to, data in reads]
+    results = [int(result, 16) for result in rpc.batch(url, calls)]
+
+    states = []
+    for ind in range(len(blocks)):
+        fee_bp, eth, steth, a_precise, fee, admin_fee = results[ind * len(reads):(ind + 1) * len(reads)]
+        states.append({
+            'fee_bp': fee_bp,
+            'pool': {'balances': [eth, steth], 'A': a_precise / A_PRECISION, 'fee': fee, 'admin_fee': admin_fee},
+        })
+    return states
+
+
+def fetch(url: str, path: str, from_block: int, to_block: int, oracle: str, lido: str, pool: str,
+          chunk: int = DEFAULT_LOG_CHUNK) -> int:
+    """Writes the reports completed in [from_block, to_block] to the archive at `path`, returns their number."""
+    count = 0
+    with _open(path, 'wt') as out:
+        for start in range(from_block, to_block + 1, chunk):
+            logs = rpc.request(url, 'eth_getLogs', [{
+                'address': oracle,
+                'topics': [POST_TOTAL_SHARES_TOPIC],
+                'fromBlock': hex(start),
+                'toBlock': hex(min(start + chunk - 1, to_block)),
+            }])
+            blocks = [int(log['blockNumber'], 16) for log in logs]
+            states = _fetch_state(url, [block - 1 for block in blocks], lido, pool)
+            for log, block, state in zip(logs, blocks, states):
+                post, pre, time_elapsed, total_shares = rpc.words(log['data'])
+                out.write(json.dumps({
+                    'block': block,
+                    'tx': log['transactionHash'],
+                    'post_total_pooled_ether': post,
+                    'pre_total_pooled_ether': pre,
+                    'time_elapsed': time_elapsed,
+                    'total_shares': total_shares,
+                    **state,
+                }) + '\n')
+                count += 1
+    return count
+
+
+def read_archive(path: str, offset: int = 0) -> Iterator[Tuple[int, Dict]]:
+    """Yields `(offset after the line, report)` from `offset` on, one line at a time."""
+    with _open(path, 'rt') as f:
+        if offset:
+            f.seek(offset)
+        while True:
+            line = f.readline()
+            if not line:
+                return
+            if line.strip():
+                yield f.tell(), json.loads(line)
+
+
+# scoring
+
+def holder_rebase_bp(report: Dict) -> float:
+    """stETH share price change of the report in basis points, net of the protocol fee minted as shares."""
+    pre, post = report['pre_total_pooled_ether'], report['post_total_pooled_ether']
+    if post > pre:
+        post -= (post - pre) * report.get('fee_bp', 1000) / TOTAL_BASIS_POINTS
+    return (post / pre - 1.) * TOTAL_BASIS_POINTS
+
+
+def score(report: Dict, sizes: Sequence[int], strategies: Sequence[str] = strategies,
+          deadline: Optional[float] = None) -> Dict:
+    """
+    Sandwich PnL (wei) of every size and strategy against the pool state before the report.
+
+    Raises `TimeoutError` when `time.monotonic()` passes `deadline` before a strategy is scored.
+    """
+    state = report['pool']
+    pool = StableSwapPool(tuple(state['balances']), state['A'], state['fee'], state['admin_fee'])
+    rebase_bp = holder_rebase_bp(report)
+
+    pnl = {}
+    for strategy in strategies:
+        if deadline is not None and time.monotonic() > deadline:
+            raise TimeoutError(f'deadline passed after {len(pnl)} of {len(strategies)} strategies')
+        pnl[strategy] = sandwich_pnl(pool, sizes, [rebase_bp], strategy)[0].tolist()
+    best = [max(pnl[strategy][ind] for strategy in strategies) for ind in range(len(sizes))]
+    best_ind = max(range(len(sizes)), key=lambda ind: best[ind])
+
+    return {
+        'block': report['block'],
+        'tx': report.get('tx'),
+        'rebase_bp': rebase_bp,
+        'apr': rebase_bp / TOTAL_BASIS_POINTS * 365 * 24 * 3600 / report['time_elapsed'] if report['time_elapsed'] else None,
+        'sizes': list(sizes),
+        'pnl': pnl,
+        'best_pnl': best[best_ind],
+        'best_size': sizes[best_ind],
+    }
+
+
+# checkpointed run
+
+def _load_checkpoint(path: str) -> Dict:
+    if not os.path.exists(path):
+        return {'archive_offset': 0, 'output_size': 0, 'reports': 0}
+    with open(path) as f:
+        return json.load(f)
+
+
+def _save_checkpoint(path: str, checkpoint: Dict):
+    tmp = path + '.tmp'
+    with open(tmp, 'w') as f:
+        json.dump(checkpoint, f)
+    os.replace(tmp, path)
+
+
+def run(archive: str, out: str, sizes: Sequence[int] = DEFAULT_SIZES, checkpoint: Optional[str] = None,
+        every: int = 100, limit: Optional[int] = None, overwrite: bool = False) -> int:
+    """
+    Scores the archive into `out` (JSON lines), resuming from `checkpoint` (`<out>.checkpoint` by default).
+
+    Results are appended as they are computed; every `every` reports the archive position and
+    the output size are checkpointed, and on resume the output is cut back to the checkpointed size.
+    Without a checkpoint a non-empty `out` is only replaced with `overwrite`.
+    Returns the number of reports scored in total.
+    """
+    checkpoint = checkpoint or out + '.checkpoint'
+    if not os.path.exists(checkpoint) and os.path.exists(out) and os.path.getsize(out) and not overwrite:
+        raise FileExistsError(f'{out} has results but there is no checkpoint {checkpoint} to resume from; pass overwrite to replace it')
+    state = _load_checkpoint(checkpoint)
+    if state.get('archive') not in (None, os.path.abspath(archive)):
+        raise ValueError(f'{checkpoint} belongs to {state["archive"]}')
+    state['archive'] = os.path.abspath(archive)
+
+    with open(out, 'ab') as f:
+        f.truncate(state['output_size'])
+
+    scored = 0
+    with open(out, 'a') as f:
+        try:
+            for offset, report in read_archive(archive, state['archive_offset']):
+                f.write(json.dumps(score(report, sizes)) + '\n')
+                state['archive_offset'] = offset
+                state['reports'] += 1
+                scored += 1
+                if scored % every == 0:
+                    f.flush()
+                    state['output_size'] = f.tell()
+                    _save_checkpoint(checkpoint, state)
+                if limit is not None and scored >= limit:
+                    break
+        finally:
+            f.flush()
+            state['output_size'] = f.tell()
+            _save_checkpoint(checkpoint, state)
+
+    return state['reports']
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    fetch_cmd = commands.add_parser('fetch')
+    fetch_cmd.add_argument('--url', default=None, help='archive node RPC, FORK_RPC_URL or Infura mainnet by default')
+    fetch_cmd.add_argument('--from-block', type=int, required=True)
+    fetch_cmd.add_argument('--to-block', type=int, required=True)
+    fetch_cmd.add_argument('--chunk', type=int, default=DEFAULT_LOG_CHUNK)
+    fetch_cmd.add_argument('path')
+
+    run_cmd = commands.add_parser('run')
+    run_cmd.add_argument('archive')
+    run_cmd.add_argument('out')
+    run_cmd.add_argument('--sizes', default=None, help='comma-separated capital sizes in ETH')
+    run_cmd.add_argument('--checkpoint', default=None)
+    run_cmd.add_argument('--every', type=int, default=100)
+    run_cmd.add_argument('--limit', type=int, default=None, help='stop after this many reports')
+    run_cmd.add_argument('--overwrite', action='store_true', help='replace an existing output that has no checkpoint')
+
+    args = parser.parse_args(argv)
+
+    if args.command == 'fetch':
+        from utils.fork_pool import fork_url
+        import utils.config_mainnet as addresses
+
+        count = fetch(
+            args.url or fork_url('mainnet'), args.path, args.from_block, args.to_block,
+            addresses.lido_dao_oracle, addresses.lido_dao_steth_address, addresses.curve_steth_pool_address,
+            args.chunk
+        )
+        print(f'Archived {count} reports to {args.path}')
+    else:
+        sizes = DEFAULT_SIZES if args.sizes is None else [int(float(x) * 10**18) for x in args.sizes.split(',')]
+        total = run(args.archive, args.out, sizes, args.checkpoint, args.every, args.limit, args.overwrite)
+        print(f'{total} reports scored into {args.out}')
+
+
+if __name__ == '__main__':
+    main()
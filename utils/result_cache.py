@@ -0,0 +1,174 @@
+"""
+Content-addressed on-disk cache of scenario cell results
+
+A cell result is stored under the hash of everything it depends on: the fork block, the hash of
+the `CurveExchanger` bytecode, the hash of the scenario code (every module of `utils/`), the scenario
+name, the strategy and the cell parameters. Changing any of them addresses a different entry, so only
+new or invalidated cells are evaluated again. The result rows a cell records (`utils/results.py`) are
+stored with its value and recorded again when it is served from the cache.
+
+Forks of the upstream head (no `FORK_BLOCK`, no fork daemon) are not reproducible and are never cached, nor are cells
+run with the gas profiler on (`utils/trace_profile.py`), which needs their transactions.
+Entries are evicted least recently used first above `max_bytes` and once older than `max_age`.
+
+"""
+
+import glob
+import hashlib
+import json
+import os
+import time
+
+from functools import lru_cache
+from typing import Any, Callable, Dict, List, Optional
+
+from utils.fork_pool import ROOT
+import utils.fork_daemon as fork_daemon
+import utils.results as results
+import utils.trace_profile as trace_profile
+
+
+DEFAULT_DIR = os.path.join(ROOT, '.result-cache')
+DEFAULT_MAX_BYTES = 256 * 2**20
+DEFAULT_MAX_AGE = 30 * 24 * 3600
+
+# bump when the stored value format changes
+CACHE_VERSION = 2
+
+# the scenario steps and everything they run through (PnL from events, batched reads, snapshots)
+_scenario_sources = 'utils/*.py'
+
+
+def _sha256(data: bytes) -> str:
+    return hashlib.sha256(data).hexdigest()
+
+
+@lru_cache(maxsize=None)
+def scenario_code_hash() -> str:
+    digest = hashlib.sha256()
+    for path in sorted(glob.glob(os.path.join(ROOT, _scenario_sources))):
+        digest.update(os.path.relpath(path, ROOT).encode() + b'\0')
+        with open(path, 'rb') as f:
+            digest.update(f.read())
+    return digest.hexdigest()
+
+
+def bytecode_hash(container) -> str:
+    """Hash of a brownie contract container's deployment bytecode."""
+    return _sha256(bytes.fromhex(container.bytecode.replace('0x', '')))
+
+
+def fork_block() -> Optional[int]:
+    return fork_daemon.pinned_block()
+
+
+def cell_key(scenario: str, strategy: str, params: Dict, exchanger_container) -> Optional[Dict]:
+    """Everything a cell result depends on, or None when the fork is not pinned to a block or is being profiled."""
+    block = fork_block()
+    if block is None or trace_profile.profiler.enabled:
+        return None
+    return {
+        'version': CACHE_VERSION,
+        'fork_block': block,
+        'exchanger': bytecode_hash(exchanger_container),
+        'scenario_code': scenario_code_hash(),
+        'scenario': scenario,
+        'strategy': strategy,
+        'params': params,
+    }
+
+
+def digest(key: Dict) -> str:
+    return _sha256(json.dumps(key, sort_keys=True).encode())
+
+
+class ResultCache:
+    def __init__(self, path: str = DEFAULT_DIR, max_bytes: int = DEFAULT_MAX_BYTES,
+                 max_age: float = DEFAULT_MAX_AGE, enabled: bool = True):
+        self.path = path
+        self.max_bytes = max_bytes
+        self.max_age = max_age
+        self.enabled = enabled
+        self.hits = 0
+        self.misses = 0
+
+    @classmethod
+    def from_env(cls) -> 'ResultCache':
+        """`RESULT_CACHE=0` disables the cache, `RESULT_CACHE_DIR` moves it."""
+        return cls(
+            os.environ.get('RESULT_CACHE_DIR', DEFAULT_DIR),
+            enabled=os.environ.get('RESULT_CACHE', '1') != '0',
+        )
+
+    def _file(self, name: str) -> str:
+        return os.path.join(self.path, name[:2], f'{name}.json')
+
+    def get(self, key: Optional[Dict]) -> Optional[Any]:
+        entry = self._load(key)
+        return None if entry is None else entry['value']
+
+    def _load(self, key: Optional[Dict]) -> Optional[Dict]:
+        if not self.enabled or key is None:
+            return None
+        path = self._file(digest(key))
+        try:
+            with open(path) as f:
+                entry = json.load(f)
+        except (OSError, ValueError):
+            self.misses += 1
+            return None
+        if entry['key'] != key:
+            self.misses += 1
+            return None
+        os.utime(path)
+        self.hits += 1
+        return entry
+
+    def put(self, key: Optional[Dict], value: Any, rows: List = ()):
+        """Stores `value` and the result rows recorded while computing it."""
+        if not self.enabled or key is None:
+            return
+        path = self._file(digest(key))
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp = f'{path}.{os.getpid()}.tmp'
+        with open(tmp, 'w') as f:
+            json.dump({'key': key, 'value': value, 'rows': list(rows)}, f)
+        os.replace(tmp, path)
+
+    def memoize(self, key: Optional[Dict], compute: Callable[[], Any]) -> Any:
+        """
+        Cached value of `key`, computed and stored on a miss; `compute` must return JSON-serializable data.
+
+        On a hit the result rows `compute` recorded are recorded again, so result files cover cached cells.
+        """
+        entry = self._load(key)
+        if entry is not None:
+            results.recorder.replay(entry['rows'])
+            return entry['value']
+        with results.capture() as rows:
+            value = compute()
+        self.put(key, value, rows)
+        return value
+
+    def evict(self) -> int:
+        """Drops entries older than `max_age`, then the least recently used above `max_bytes`. Returns the count."""
+        if not os.path.isdir(self.path):
+            return 0
+
+        entries = []
+        for directory, _, files in os.walk(self.path):
+            for name in files:
+                path = os.path.join(directory, name)
+                stat = os.stat(path)
+                entries.append((stat.st_mtime, stat.st_size, path))
+        entries.sort(reverse=True)
+
+        now = time.time()
+        total = 0
+        removed = 0
+        for mtime, size, path in entries:
+            total += size
+            if now - mtime > self.max_age or total > self.max_bytes:
+                os.remove(path)
+                removed += 1
+        return removed
@@ -0,0 +1,169 @@
+"""
+Structured scenario results: typed rows, buffered and written in batches
+
+`record(step, **fields)` appends one row of `FIELDS` (missing fields come from the enclosing
+`context(...)`, amounts are in ETH/stETH). Rows are buffered and written `batch_size` at a time to
+CSV or, with `pyarrow` installed, Parquet. Renderers see every row as it is recorded; the colored
+console view (`render_console`, on unless `RESULTS_CONSOLE=0`) is one of them.
+
+In the tests, `RESULTS_PATH=results.csv` (or `.parquet`) turns the file sink on.
+
+"""
+
+import contextlib
+import csv
+import os
+
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+import utils.log as log
+
+
+FIELDS = (
+    'scenario', 'strategy', 'step', 'dpr', 'balance', 'quota_bp',
+    'eth_balance', 'steth_balance', 'pnl', 'victim_loss',
+)
+
+Row = Tuple[Any, ...]
+
+DEFAULT_BATCH_SIZE = 4096
+
+
+def _parquet_schema():
+    import pyarrow as pa
+
+    return pa.schema([
+        ('scenario', pa.string()), ('strategy', pa.string()), ('step', pa.string()),
+        ('dpr', pa.float64()), ('balance', pa.float64()), ('quota_bp', pa.int64()),
+        ('eth_balance', pa.float64()), ('steth_balance', pa.float64()),
+        ('pnl', pa.float64()), ('victim_loss', pa.float64()),
+    ])
+
+
+class _CsvSink:
+    def __init__(self, path: str):
+        self._file = open(path, 'w', newline='')
+        self._writer = csv.writer(self._file)
+        self._writer.writerow(FIELDS)
+
+    def write(self, rows: List[Row]):
+        self._writer.writerows(rows)
+
+    def close(self):
+        self._file.close()
+
+
+class _ParquetSink:
+    def __init__(self, path: str):
+        try:
+            import pyarrow.parquet as pq
+        except ImportError:
+            raise ImportError('Parquet output needs pyarrow: pip install pyarrow, or write .csv instead')
+        self._schema = _parquet_schema()
+        self._writer = pq.ParquetWriter(path, self._schema)
+
+    def write(self, rows: List[Row]):
+        import pyarrow as pa
+
+        columns = list(zip(*rows))
+        self._writer.write_table(pa.Table.from_arrays(
+            [pa.array(column, type=field.type) for column, field in zip(columns, self._schema)],
+            schema=self._schema,
+        ))
+
+    def close(self):
+        self._writer.close()
+
+
+def render_console(row: Row):
+    fields = dict(zip(FIELDS, row))
+    where = ' '.join(
+        f'{name} {fields[name]}' for name in ('scenario', 'strategy', 'dpr', 'balance', 'quota_bp')
+        if fields[name] is not None
+    )
+    values = ', '.join(
+        f'{name} {fields[name]:.6f}' for name in ('eth_balance', 'steth_balance', 'pnl', 'victim_loss')
+        if fields[name] is not None
+    )
+    log.ok(f'{fields["step"]} [{where}]', values)
+
+
+class Recorder:
+    def __init__(self, batch_size: int = DEFAULT_BATCH_SIZE):
+        self.batch_size = batch_size
+        self.renderers: List[Callable[[Row], None]] = []
+        self._context: Dict[str, Any] = {}
+        self._captures: List[List[Row]] = []
+        self._rows: List[Row] = []
+        self._sink = None
+
+    def open(self, path: str):
+        """Starts writing rows to `path`, Parquet for `.parquet`, CSV otherwise."""
+        self.close()
+        self._sink = _ParquetSink(path) if path.endswith('.parquet') else _CsvSink(path)
+
+    @contextlib.contextmanager
+    def context(self, **fields):
+        """Fields filled into every row recorded inside the block."""
+        outer = self._context
+        self._context = {**outer, **fields}
+        try:
+            yield
+        finally:
+            self._context = outer
+
+    @contextlib.contextmanager
+    def capture(self):
+        """Collects the rows recorded inside the block (they are still rendered and written)."""
+        rows: List[Row] = []
+        self._captures.append(rows)
+        try:
+            yield rows
+        finally:
+            self._captures.remove(rows)
+
+    def record(self, step: str, **fields):
+        context = self._context
+        row = tuple(fields.get(name, context.get(name)) for name in FIELDS[:2]) + (step,) + \
+            tuple(fields.get(name, context.get(name)) for name in FIELDS[3:])
+        self._emit(row)
+
+    def replay(self, rows: List[Row]):
+        """Records rows captured earlier, e.g. those of a cell served from the result cache."""
+        for row in map(tuple, rows):
+            self._emit(row)
+
+    def _emit(self, row: Row):
+        for rows in self._captures:
+            rows.append(row)
+        for render in self.renderers:
+            render(row)
+        if self._sink is not None:
+            self._rows.append(row)
+            if len(self._rows) >= self.batch_size:
+                self.flush()
+
+    def flush(self):
+        if self._rows and self._sink is not None:
+            self._sink.write(self._rows)
+        self._rows = []
+
+    def close(self):
+        if self._sink is not None:
+            self.flush()
+            self._sink.close()
+            self._sink = None
+
+
+recorder = Recorder()
+if os.environ.get('RESULTS_CONSOLE', '1') != '0':
+    recorder.renderers.append(render_console)
+
+context = recorder.context
+record = recorder.record
+capture = recorder.capture
+
+
+def eth(wei: Optional[int]) -> Optional[float]:
+    """Wei to ETH for row fields."""
+    return None if wei is None else wei / 10**18
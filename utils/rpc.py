@@ -0,0 +1,93 @@
+"""
+Plain JSON-RPC over HTTP, single and batched, next to the brownie web3 provider
+
+"""
+
+import json
+import time
+import urllib.request
+
+from typing import Any, Callable, List, Optional, Sequence, Tuple
+
+from eth_utils import keccak
+
+
+# called as `observer(method, sent, received, start, end)` after every request sent from here
+# (sizes in bytes, `time.perf_counter` times); `utils/rpc_profile.py` adds one
+observers: List[Callable[[str, int, int, float, float], None]] = []
+
+
+class RpcError(RuntimeError):
+    def __init__(self, method: str, error: dict, index: Optional[int] = None):
+        where = method if index is None else f'{method} (request #{index})'
+        super().__init__(f'{where}: {error}')
+        self.method = method
+        self.error = error
+        self.index = index
+
+
+def _post(url: str, payload, timeout: float, method: str):
+    data = json.dumps(payload).encode()
+    request = urllib.request.Request(url, data=data, headers={'Content-Type': 'application/json'})
+    raw = b''
+    start = time.perf_counter()
+    try:
+        with urllib.request.urlopen(request, timeout=timeout) as response:
+            raw = response.read()
+    finally:
+        end = time.perf_counter()
+        for observe in observers:
+            observe(method, len(data), len(raw), start, end)
+    return json.loads(raw)
+
+
+def request(url: str, method: str, params: Optional[list] = None, timeout: float = 30.) -> Any:
+    reply = _post(url, {'jsonrpc': '2.0', 'id': 1, 'method': method, 'params': params or []}, timeout, method)
+    if 'error' in reply:
+        raise RpcError(method, reply['error'])
+    return reply['result']
+
+
+def batch(url: str, calls: Sequence[Tuple[str, list]], timeout: float = 120.) -> List[Any]:
+    """Sends `(method, params)` calls as one JSON-RPC batch, returns the results in call order."""
+    if not calls:
+        return []
+    payload = [{'jsonrpc': '2.0', 'id': ind, 'method': method, 'params': params} for ind, (method, params) in enumerate(calls)]
+    name = f'batch[{",".join(sorted({method for method, _ in calls}))}]'
+    replies = {reply['id']: reply for reply in _post(url, payload, timeout, name)}
+
+    results = []
+    for ind, (method, _) in enumerate(calls):
+        reply = replies[ind]
+        if 'error' in reply:
+            raise RpcError(method, reply['error'], ind)
+        results.append(reply['result'])
+    return results
+
+
+def topic(signature: str) -> str:
+    """First log topic of an event, e.g. `topic('Transfer(address,address,uint256)')`."""
+    return '0x' + keccak(text=signature).hex()
+
+
+def selector(signature: str) -> str:
+    """Calldata prefix of a function, e.g. `selector('balanceOf(address)')`."""
+    return '0x' + keccak(text=signature)[:4].hex()
+
+
+def uint(value: int) -> str:
+    """ABI word of an unsigned integer: 64 hex digits without `0x`."""
+    return hex(value)[2:].rjust(64, '0')
+
+
+def words(data: str) -> List[int]:
+    """`0x`-prefixed calldata, return or log data split into ABI words."""
+    data = data[2:]
+    return [int(data[ind:ind + 64], 16) for ind in range(0, len(data), 64)]
+
+
+def provider_url() -> str:
+    """HTTP endpoint of the node brownie is connected to."""
+    from brownie import web3
+
+    return web3.provider.endpoint_uri
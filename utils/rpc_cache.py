@@ -0,0 +1,303 @@
+"""
+Caching JSON-RPC stand-in for the fork upstream
+
+Sits between ganache and the upstream node: state reads pinned to a block number
+(`eth_getStorageAt`, `eth_getCode`, `eth_getBalance`, `eth_getTransactionCount`, ...)
+are stored in SQLite keyed by block, so repeated forks of the same block are served from disk.
+Everything else is passed through (or refused with `--offline`).
+
+Usage:
+    python -m utils.rpc_cache serve [--db .rpc-cache.sqlite] [--port 8549] [--upstream URL] [--block N] [--offline]
+    python -m utils.rpc_cache export [--db ...] [--block N] cache.jsonl.gz
+    python -m utils.rpc_cache import [--db ...] cache.jsonl.gz
+    python -m utils.rpc_cache stats [--db ...]
+
+Fork through it with `FORK_RPC_URL=http://127.0.0.1:8549 FORK_BLOCK=<N> brownie test --network mainnet-fork`.
+
+"""
+
+import argparse
+import gzip
+import json
+import os
+import sqlite3
+import threading
+import urllib.request
+
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Dict, Iterator, List, Optional, Tuple
+
+from utils.fork_pool import ROOT, fork_urls
+
+
+DEFAULT_DB = os.path.join(ROOT, '.rpc-cache.sqlite')
+DEFAULT_PORT = 8549
+
+# methods whose last parameter is the block the answer is pinned to
+block_pinned_methods = {
+    'eth_getStorageAt',
+    'eth_getCode',
+    'eth_getBalance',
+    'eth_getTransactionCount',
+}
+# methods keyed by a block number passed as the first parameter
+block_methods = {
+    'eth_getBlockByNumber',
+}
+# chain-wide constants, stored under `CHAIN_BLOCK`
+chain_methods = {
+    'eth_chainId',
+    'net_version',
+}
+CHAIN_BLOCK = -1
+
+_schema = '''
+CREATE TABLE IF NOT EXISTS responses (
+    block INTEGER NOT NULL,
+    method TEXT NOT NULL,
+    params TEXT NOT NULL,
+    result TEXT NOT NULL,
+    PRIMARY KEY (block, method, params)
+) WITHOUT ROWID;
+'''
+
+
+def _block_number(tag) -> Optional[int]:
+    if isinstance(tag, str) and tag.startswith('0x'):
+        return int(tag, 16)
+    return None
+
+
+def cache_key(method: str, params: list) -> Optional[Tuple[int, str, str]]:
+    """(block, method, params) for cacheable requests, None for requests that must reach the upstream."""
+    if method in chain_methods:
+        block = CHAIN_BLOCK
+    elif method in block_pinned_methods and params:
+        block = _block_number(params[-1])
+    elif method in block_methods and params:
+        block = _block_number(params[0])
+    else:
+        return None
+    if block is None:
+        return None
+    return block, method, json.dumps(params, separators=(',', ':')).lower()
+
+
+class ResponseStore:
+    """Thread-safe SQLite store of cached results."""
+
+    def __init__(self, path: str = DEFAULT_DB):
+        self._db = sqlite3.connect(path, check_same_thread=False)
+        self._db.execute('PRAGMA journal_mode=WAL')
+        self._db.executescript(_schema)
+        self._lock = threading.Lock()
+
+    def get(self, key: Tuple[int, str, str]) -> Optional[str]:
+        with self._lock:
+            row = self._db.execute(
+                'SELECT result FROM responses WHERE block = ? AND method = ? AND params = ?', key
+            ).fetchone()
+        return row[0] if row else None
+
+    def put_many(self, rows: List[Tuple[int, str, str, str]]):
+        with self._lock, self._db:
+            self._db.executemany('INSERT OR REPLACE INTO responses VALUES (?, ?, ?, ?)', rows)
+
+    def rows(self, block: Optional[int] = None) -> Iterator[Tuple[int, str, str, str]]:
+        if block is None:
+            query, args = 'SELECT * FROM responses ORDER BY block', ()
+        else:
+            query, args = 'SELECT * FROM responses WHERE block IN (?, ?)', (block, CHAIN_BLOCK)
+        with self._lock:
+            rows = self._db.execute(query, args).fetchall()
+        return iter(rows)
+
+    def stats(self) -> List[Tuple[int, str, int]]:
+        with self._lock:
+            return self._db.execute(
+                'SELECT block, method, COUNT(*) FROM responses GROUP BY block, method ORDER BY block, method'
+            ).fetchall()
+
+    def close(self):
+        self._db.close()
+
+
+def _error(request: Dict, message: str, code: int = -32000) -> Dict:
+    return {'jsonrpc': '2.0', 'id': request.get('id'), 'error': {'code': code, 'message': message}}
+
+
+class CachingProxy:
+    def __init__(self, store: ResponseStore, upstream: Optional[str], block: Optional[int] = None):
+        self.store = store
+        self.upstream = upstream
+        self.block = block
+        self.hits = 0
+        self.misses = 0
+
+    def _forward(self, requests: List[Dict]) -> List[Dict]:
+        """Upstream reply to each request; whatever goes wrong upstream comes back as JSON-RPC errors."""
+        if self.upstream is None:
+            return [_error(r, f'offline: {r["method"]} is not cached') for r in requests]
+        payload = json.dumps(requests).encode()
+        request = urllib.request.Request(self.upstream, data=payload, headers={'Content-Type': 'application/json'})
+        try:
+            with urllib.request.urlopen(request, timeout=120) as response:
+                replies = json.loads(response.read())
+        except (OSError, ValueError) as error:
+            return [_error(r, f'upstream: {error}') for r in requests]
+
+        if isinstance(replies, dict):
+            if replies.get('id') is None:
+                # one error for the whole batch (rate limit, batch too large)
+                error = replies.get('error') or {'code': -32603, 'message': f'upstream: unexpected reply {replies}'}
+                return [{'jsonrpc': '2.0', 'id': r.get('id'), 'error': error} for r in requests]
+            replies = [replies]
+        by_id = {reply.get('id'): reply for reply in replies if isinstance(reply, dict)}
+        return [by_id.get(r.get('id')) or _error(r, 'upstream: no reply in the batch', -32603) for r in requests]
+
+    def handle(self, requests: List[Dict]) -> List[Dict]:
+        replies: List[Optional[Dict]] = [None] * len(requests)
+        misses = []
+
+        for ind, request in enumerate(requests):
+            method, params = request.get('method'), request.get('params', [])
+            if method == 'eth_blockNumber' and self.block is not None:
+                replies[ind] = {'jsonrpc': '2.0', 'id': request.get('id'), 'result': hex(self.block)}
+                continue
+            key = cache_key(method, params)
+            result = self.store.get(key) if key else None
+            if result is not None:
+                self.hits += 1
+                replies[ind] = {'jsonrpc': '2.0', 'id': request.get('id'), 'result': json.loads(result)}
+            else:
+                self.misses += 1
+                misses.append((ind, key))
+
+        if misses:
+            upstream_requests = [
+                {**requests[ind], 'jsonrpc': '2.0', 'id': n} for n, (ind, _) in enumerate(misses)
+            ]
+            rows = []
+            for (ind, key), reply in zip(misses, self._forward(upstream_requests)):
+                replies[ind] = {**reply, 'id': requests[ind].get('id')}
+                if key is not None and 'result' in reply and reply['result'] is not None:
+                    rows.append(key + (json.dumps(reply['result']),))
+            if rows:
+                self.store.put_many(rows)
+
+        return replies
+
+
+def _handler(proxy: CachingProxy):
+    class Handler(BaseHTTPRequestHandler):
+        def do_POST(self):
+            body = json.loads(self.rfile.read(int(self.headers['Content-Length'])))
+            replies = proxy.handle(body if isinstance(body, list) else [body])
+            payload = json.dumps(replies if isinstance(body, list) else replies[0]).encode()
+
+            self.send_response(200)
+            self.send_header('Content-Type', 'application/json')
+            self.send_header('Content-Length', str(len(payload)))
+            self.end_headers()
+            self.wfile.write(payload)
+
+        def log_message(self, format, *args):
+            pass
+
+    return Handler
+
+
+def make_server(store: ResponseStore, upstream: Optional[str], port: int = DEFAULT_PORT,
+                block: Optional[int] = None) -> Tuple[ThreadingHTTPServer, CachingProxy]:
+    proxy = CachingProxy(store, upstream, block)
+    return ThreadingHTTPServer(('127.0.0.1', port), _handler(proxy)), proxy
+
+
+def serve_in_background(store: ResponseStore, upstream: Optional[str], port: int = DEFAULT_PORT,
+                        block: Optional[int] = None) -> Tuple[ThreadingHTTPServer, CachingProxy]:
+    """Serves from a daemon thread; stop with `server.shutdown()` and `server.server_close()`."""
+    server, proxy = make_server(store, upstream, port, block)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, proxy
+
+
+def cached_blocks(store: ResponseStore) -> List[int]:
+    return sorted({block for block, _, _ in store.stats() if block != CHAIN_BLOCK})
+
+
+def serve(store: ResponseStore, upstream: Optional[str], port: int = DEFAULT_PORT, block: Optional[int] = None):
+    server, proxy = make_server(store, upstream, port, block)
+    mode = 'offline' if upstream is None else f'upstream {upstream}'
+    print(f'RPC cache on http://127.0.0.1:{port} ({mode})')
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        print(f'RPC cache: {proxy.hits} hits, {proxy.misses} misses')
+
+
+def export_rows(store: ResponseStore, path: str, block: Optional[int] = None) -> int:
+    count = 0
+    with gzip.open(path, 'wt') as f:
+        for block_, method, params, result in store.rows(block):
+            f.write(json.dumps({'block': block_, 'method': method, 'params': params, 'result': result}) + '\n')
+            count += 1
+    return count
+
+
+def import_rows(store: ResponseStore, path: str, batch_size: int = 10000) -> int:
+    count = 0
+    batch = []
+    with gzip.open(path, 'rt') as f:
+        for line in f:
+            row = json.loads(line)
+            batch.append((row['block'], row['method'], row['params'], row['result']))
+            if len(batch) >= batch_size:
+                store.put_many(batch)
+                count += len(batch)
+                batch = []
+    store.put_many(batch)
+    return count + len(batch)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--db', default=DEFAULT_DB)
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    serve_cmd = commands.add_parser('serve')
+    serve_cmd.add_argument('--port', type=int, default=DEFAULT_PORT)
+    serve_cmd.add_argument('--upstream', default=None, help='upstream RPC, Infura mainnet by default')
+    serve_cmd.add_argument('--block', type=int, default=None, help='answer eth_blockNumber with this fork block')
+    serve_cmd.add_argument('--offline', action='store_true', help='serve from the cache only')
+
+    export_cmd = commands.add_parser('export')
+    export_cmd.add_argument('--block', type=int, default=None)
+    export_cmd.add_argument('path')
+
+    import_cmd = commands.add_parser('import')
+    import_cmd.add_argument('path')
+
+    commands.add_parser('stats')
+
+    args = parser.parse_args(argv)
+    store = ResponseStore(args.db)
+    try:
+        if args.command == 'serve':
+            upstream = None if args.offline else (args.upstream or fork_urls['mainnet'].format(os.environ['WEB3_INFURA_PROJECT_ID']))
+            serve(store, upstream, args.port, args.block)
+        elif args.command == 'export':
+            print(f'Exported {export_rows(store, args.path, args.block)} responses to {args.path}')
+        elif args.command == 'import':
+            print(f'Imported {import_rows(store, args.path)} responses from {args.path}')
+        elif args.command == 'stats':
+            for block, method, count in store.stats():
+                print(f'{block:>10} {method:<28} {count}')
+    finally:
+        store.close()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,184 @@
+"""
+JSON-RPC profiler for the web3 provider brownie talks to
+
+Every `provider.make_request` is timed and counted per `(step, method)` together with the
+request and response sizes, and so are the requests sent around the provider by `utils/rpc.py`
+(the batched reads of `utils/batch_reads.py`, event and quote batches; a batch is counted as
+`batch[<methods>]`). The step is the latest `log.h` heading (prefixed with the test name
+when the tests set one), so the report tells which scenario phase spends the time.
+
+Enabled in the tests with `RPC_PROFILE=<trace.json>`: the hot-spot report is printed
+at session end and the calls are written in Chrome trace event format
+(open in `chrome://tracing` or Perfetto), with the per-step summary next to them.
+
+"""
+
+import json
+import re
+import threading
+import time
+
+from typing import Dict, List, Optional, Tuple
+
+import utils.log as log
+import utils.rpc as rpc
+
+
+_ansi = re.compile(r'\x1b\[[0-9;]*m')
+
+
+class _Stat:
+    __slots__ = ('count', 'sent', 'received', 'seconds', 'max_seconds')
+
+    def __init__(self):
+        self.count = 0
+        self.sent = 0
+        self.received = 0
+        self.seconds = 0.
+        self.max_seconds = 0.
+
+    def add(self, sent: int, received: int, seconds: float):
+        self.count += 1
+        self.sent += sent
+        self.received += received
+        self.seconds += seconds
+        self.max_seconds = max(self.max_seconds, seconds)
+
+
+class RpcProfiler:
+    def __init__(self):
+        self.test: Optional[str] = None
+        self.step = 'setup'
+        self.stats: Dict[Tuple[str, str], _Stat] = {}
+        self.events: List[dict] = []
+        self._provider = None
+        self._originals = {}
+        # sizes of the request in flight on each thread (brownie confirms pipelined transactions on its own threads)
+        self._sizes = threading.local()
+        self._lock = threading.Lock()
+        self._started = time.perf_counter()
+        log.on_heading(self._on_heading)
+
+    def _on_heading(self, text: str):
+        self.mark(_ansi.sub('', str(text)).strip())
+
+    def mark(self, step: str):
+        """Tags the following calls with `step`."""
+        self.step = step
+
+    def start_test(self, name: str):
+        self.test = name
+        self.step = 'setup'
+
+    @property
+    def tag(self) -> str:
+        return self.step if self.test is None else f'{self.test} :: {self.step}'
+
+    def install(self, provider) -> 'RpcProfiler':
+        """Wraps `make_request` of a web3 `HTTPProvider` (request/response sizes are taken from its codec)."""
+        assert self._provider is None, "profiler already installed"
+        self._provider = provider
+        self._originals = {
+            name: provider.__dict__.get(name)
+            for name in ('make_request', 'encode_rpc_request', 'decode_rpc_response')
+        }
+
+        make_request = provider.make_request
+        encode = provider.encode_rpc_request
+        decode = provider.decode_rpc_response
+
+        sizes = self._sizes
+
+        def encode_rpc_request(method, params):
+            data = encode(method, params)
+            sizes.sent = len(data)
+            return data
+
+        def decode_rpc_response(raw):
+            sizes.received = len(raw)
+            return decode(raw)
+
+        def profiled_make_request(method, params):
+            sizes.sent = sizes.received = 0
+            start = time.perf_counter()
+            try:
+                return make_request(method, params)
+            finally:
+                self.record(method, sizes.sent, sizes.received, start, time.perf_counter())
+
+        provider.encode_rpc_request = encode_rpc_request
+        provider.decode_rpc_response = decode_rpc_response
+        provider.make_request = profiled_make_request
+        rpc.observers.append(self.record)
+        return self
+
+    def uninstall(self):
+        """Restores the provider and stops following `log.h` headings."""
+        log.off_heading(self._on_heading)
+        if self._provider is None:
+            return
+        for name, original in self._originals.items():
+            if original is None:
+                self._provider.__dict__.pop(name, None)
+            else:
+                setattr(self._provider, name, original)
+        rpc.observers.remove(self.record)
+        self._provider = None
+
+    def record(self, method: str, sent: int, received: int, start: float, end: float):
+        tag = self.tag
+        with self._lock:
+            self.stats.setdefault((tag, method), _Stat()).add(sent, received, end - start)
+            self.events.append({
+                'name': method,
+                'cat': tag,
+                'ph': 'X',
+                'ts': round((start - self._started) * 1e6),
+                'dur': round((end - start) * 1e6),
+                'pid': 0,
+                'tid': threading.get_ident(),
+                'args': {'sent': sent, 'received': received},
+            })
+
+    def summary(self) -> List[dict]:
+        """Per `(step, method)` totals, slowest first."""
+        rows = [
+            {
+                'step': tag, 'method': method, 'count': stat.count,
+                'sent': stat.sent, 'received': stat.received,
+                'seconds': stat.seconds, 'max_seconds': stat.max_seconds,
+            }
+            for (tag, method), stat in self.stats.items()
+        ]
+        return sorted(rows, key=lambda row: row['seconds'], reverse=True)
+
+    def report(self, top: int = 25) -> str:
+        rows = self.summary()
+        total = sum(row['seconds'] for row in rows) or 1.
+
+        by_method: Dict[str, _Stat] = {}
+        for (_, method), stat in self.stats.items():
+            merged = by_method.setdefault(method, _Stat())
+            merged.count += stat.count
+            merged.sent += stat.sent
+            merged.received += stat.received
+            merged.seconds += stat.seconds
+            merged.max_seconds = max(merged.max_seconds, stat.max_seconds)
+
+        lines = [f'RPC time {sum(row["seconds"] for row in rows):.2f}s in {len(self.events)} calls', '', 'by method:']
+        for method, stat in sorted(by_method.items(), key=lambda item: item[1].seconds, reverse=True):
+            lines.append(
+                f'{stat.seconds:9.3f}s {100 * stat.seconds / total:5.1f}% {stat.count:7} calls '
+                f'{stat.sent / 1024:9.1f} KiB out {stat.received / 1024:9.1f} KiB in  {method}'
+            )
+        lines += ['', f'top {top} step/method hot spots:']
+        for row in rows[:top]:
+            lines.append(
+                f'{row["seconds"]:9.3f}s {100 * row["seconds"] / total:5.1f}% {row["count"]:7} calls '
+                f'{1000 * row["seconds"] / row["count"]:8.2f}ms avg  {row["method"]}  [{row["step"]}]'
+            )
+        return '\n'.join(lines)
+
+    def dump(self, path: str):
+        with open(path, 'w') as f:
+            json.dump({'traceEvents': self.events, 'summary': self.summary()}, f)
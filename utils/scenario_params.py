@@ -0,0 +1,14 @@
+"""
+Parameters of the sandwich scenarios, shared by the fork scenarios (`utils/scenarios.py`) and the
+off-chain models without importing brownie
+
+"""
+
+# MEV + tx priority fee grid
+dprs = [1.4, 2., 4., 6., 8.]
+sandwitcher_balances = [x * 10**18 for x in [100, 1_000, 10_000, 100_000]]
+
+# Coverage scenario
+initial_victim_stETH_balance = 100 * 10**18
+initial_sandwicher_ETH_balance = 10000 * 10**18
+burn_quota_bp = 8
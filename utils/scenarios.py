@@ -0,0 +1,226 @@
+"""
+Sandwich scenario steps shared by the tests and the parallel sweep runner
+
+"""
+
+from brownie import ZERO_ADDRESS
+from utils.batch_reads import read
+from utils.oracle_report import oracle_report
+from utils.pipeline import pipelined
+from utils.scenario_params import (
+    burn_quota_bp, dprs, initial_sandwicher_ETH_balance, initial_victim_stETH_balance, sandwitcher_balances
+)
+from utils.snapshot_tree import run_steps, step
+import utils.exchanger_events as exchanger_events
+import utils.log as log
+import utils.results as results
+import utils.stableswap as stableswap
+import utils.trace_profile as trace_profile
+
+
+# Large ETH holder
+eth_holder: str = '0x00000000219ab540356cBB839Cbe05303d7705Fa'
+
+# 'trade': ETH -> stETH via Curve, 'stake': ETH -> stETH via Lido submit
+strategies = stableswap.strategies
+
+
+def deploy_sandwicher(exchanger_container, accounts):
+    exchanger = exchanger_container.deploy({'from': accounts[0]})
+    trace_profile.profiler.label({exchanger.address: 'CurveExchanger'}, {'CurveExchanger': exchanger.abi})
+    # burn extra funds
+    exchanger_acc = accounts.at(exchanger, force=True)
+    exchanger_acc.transfer(ZERO_ADDRESS, exchanger_acc.balance(), gas_price=0)
+    return exchanger
+
+
+def prepare_oracle(accounts, oracle, dao_voting, reporter, rewards_vault):
+    oracle.setAllowedBeaconBalanceAnnualRelativeIncrease(2800, {'from': dao_voting.address}) # TODO: remove this temporary hack
+    oracle.reportBeacon(159300, 4700878413390971, 141433, {'from': reporter}) # TODO: remove this temporary hack
+
+    vault = accounts.at(rewards_vault, force=True)
+    vault.transfer(ZERO_ADDRESS, vault.balance(), gas_price=0)
+    return oracle
+
+
+def step_in(sandwicher, strategy, sender):
+    if strategy == 'trade':
+        return sandwicher.swapETH2StETH({'from': sender})
+    if strategy == 'stake':
+        return sandwicher.stakeETH4StETH({'from': sender})
+    raise ValueError(f'unknown strategy {strategy!r}')
+
+
+def fund_sandwicher(accounts, sandwicher, amount):
+    whale = accounts.at(eth_holder, force=True)
+    whale.transfer(sandwicher, amount, gas_price=0)
+
+
+def mev_round_trip(accounts, lido, oracle, sandwicher, strategy, dpr, sandwiching_balance):
+    """
+    Steps in with the funded `sandwiching_balance` before a `dpr` rebase, returns the sandwicher PnL (wei).
+
+    Only transactions are sent here; amounts and PnL come from the exchanger events of the cell.
+    """
+    log.h(f'Testing DPR {dpr}')
+    log.ok('Testing sandwiching balance', sandwiching_balance / 10**18)
+
+    entry = step_in(sandwicher, strategy, accounts[0])
+    trace_profile.observe(f'step_in {strategy}', entry)
+    oracle_report(lido, oracle, dpr)
+    exit_tx = sandwicher.swapStETH2ETH({'from': accounts[0]})
+    trace_profile.observe('swap_back', exit_tx)
+
+    trip = exchanger_events.round_trip_since(sandwicher.address, entry.block_number)
+    results.record(
+        'sandwicher_exit', scenario='mev', strategy=strategy, dpr=dpr, balance=results.eth(sandwiching_balance),
+        eth_balance=results.eth(trip.eth_out), pnl=results.eth(trip.pnl)
+    )
+
+    return trip.pnl
+
+
+def mev_steps(oracle, dao_voting, accounts, sandwicher, sandwiching_balance):
+    """Setup shared by all MEV cells with the same sandwiching balance."""
+    return [
+        step(
+            ('allow_annual_increase', 10000),
+            oracle.setAllowedBeaconBalanceAnnualRelativeIncrease, 10000, {'from': dao_voting}
+        ),
+        step(('fund_sandwicher', sandwiching_balance), fund_sandwicher, accounts, sandwicher, sandwiching_balance),
+    ]
+
+
+def mev_cell(accounts, lido, oracle, sandwicher, strategy, dpr, sandwiching_balance):
+    """Funds the sandwicher and steps in before a `dpr` rebase, returns the sandwicher PnL (wei)."""
+    fund_sandwicher(accounts, sandwicher, sandwiching_balance)
+    return mev_round_trip(accounts, lido, oracle, sandwicher, strategy, dpr, sandwiching_balance)
+
+
+def _round10(val: int) -> int:
+    return ((val + 9) // 10) * 10
+
+
+def _fund_coverage_sandwicher(accounts, sandwicher):
+    fund_sandwicher(accounts, sandwicher, initial_sandwicher_ETH_balance)
+    assert initial_sandwicher_ETH_balance == sandwicher.balance(), "wrong balance"
+
+
+def _submit_stakes(accounts, lido):
+    whale = accounts.at(eth_holder, force=True)
+    with pipelined() as txs:
+        txs.call('victim submit', lido.submit, ZERO_ADDRESS, tx={'from': accounts[0], 'value': 100*10**18})
+        txs.call('whale submit', lido.submit, ZERO_ADDRESS, tx={'from': whale, 'value': 50000*10**18})
+
+    log.h(log.highlight('--- 0. Forked state', log.color_yellow))
+    assert _round10(initial_victim_stETH_balance) == _round10(lido.balanceOf(accounts[0].address)), "wrong balance"
+    log.ok('Victim initial stETH balance', initial_victim_stETH_balance / 10**18)
+
+
+def _slash(accounts, lido, oracle, sandwicher):
+    total_ether_before = lido.getTotalPooledEther()
+
+    # 1% slashing (-100 basis points totalPooledEther change)
+    oracle_report(lido, oracle, -100, check=False)
+
+    victim_balance, total_ether_after, total_shares = read(
+        (lido.balanceOf, accounts[0].address), lido.getTotalPooledEther, lido.getTotalShares
+    )
+
+    log.h(log.highlight('--- 1. Slashing just happenned (1% loss)', log.color_yellow))
+    log.ok('Victim after-slashing stETH balance', victim_balance / 10**18)
+    ether_loss = total_ether_before - total_ether_after
+    log.ok('Lido total ether loss', ether_loss // 10**18)
+    steth_amount_to_recover = lido.getPooledEthByShares(0.01 * total_shares)
+
+    log.h(log.highlight('--- 2. Coverage application decided', log.color_yellow))
+    assert initial_sandwicher_ETH_balance == sandwicher.balance(), "wrong balance"
+    log.ok('Sandwicher initial ETH balance', initial_sandwicher_ETH_balance / 10**18)
+
+    return steth_amount_to_recover
+
+
+def coverage_steps(
+    accounts, dao_voting, lido, oracle,
+    self_owned_steth_burner, sandwicher, quota_bp=burn_quota_bp
+):
+    """Setup before the sandwicher steps in; the last step returns the stETH amount to recover."""
+    return [
+        step(('burn_quota', quota_bp), self_owned_steth_burner.setBurnAmountPerRunQuota, quota_bp, {'from': dao_voting}),
+        step(('fund_sandwicher', initial_sandwicher_ETH_balance), _fund_coverage_sandwicher, accounts, sandwicher),
+        step(('submit_stakes',), _submit_stakes, accounts, lido),
+        step(('slashing', -100), _slash, accounts, lido, oracle, sandwicher),
+    ]
+
+
+def before_sandwicher_step_in(
+    accounts, dao_voting, lido, oracle,
+    self_owned_steth_burner, sandwicher, quota_bp=burn_quota_bp
+):
+    return run_steps(coverage_steps(
+        accounts, dao_voting, lido, oracle, self_owned_steth_burner, sandwicher, quota_bp
+    ))[-1]
+
+
+def after_sandwicher_step_in(
+    accounts, dao_voting, lido, oracle,
+    self_owned_steth_burner, sandwicher, entry,
+    steth_amount_to_recover, quota_bp=burn_quota_bp
+):
+    """
+    Applies the coverage, exits and completes the burn; returns (sandwicher PnL, victim loss) in wei.
+
+    `entry` is the step-in receipt: the sandwicher's amounts and PnL come from the exchanger events since then.
+    """
+    whale = accounts.at(eth_holder, force=True)
+    lido.transfer(dao_voting.address, steth_amount_to_recover, { 'from': whale })
+    apply_coverage(self_owned_steth_burner, dao_voting, oracle, lido, steth_amount_to_recover)
+
+    log.h(log.highlight(f'--- 3. First round of coverage applied with quota {quota_bp} BP', log.color_yellow))
+
+    sandwicher.swapStETH2ETH({'from': accounts[0]})
+
+    trip = exchanger_events.round_trip_since(sandwicher.address, entry.block_number)
+    log.ok('Sandwicher stETH bought on step-in', trip.steth / 10**18)
+    sandwicher_pnl = trip.pnl
+    results.record(
+        'sandwicher_exit', scenario='coverage', quota_bp=quota_bp, balance=results.eth(initial_sandwicher_ETH_balance),
+        eth_balance=results.eth(trip.eth_out), pnl=results.eth(sandwicher_pnl)
+    )
+
+    while lido.balanceOf(self_owned_steth_burner) > 0:
+        oracle_report(lido, oracle, 0, check=False)
+
+    log.h(log.highlight('--- 4. Coverage applied completely', log.color_yellow))
+
+    victim_balance = lido.balanceOf(accounts[0].address)
+    victim_loss = initial_victim_stETH_balance - victim_balance
+    results.record(
+        'coverage_complete', scenario='coverage', quota_bp=quota_bp,
+        steth_balance=results.eth(victim_balance), victim_loss=results.eth(victim_loss)
+    )
+
+    return sandwicher_pnl, victim_loss
+
+
+def coverage_cell(
+    accounts, dao_voting, lido, oracle,
+    self_owned_steth_burner, sandwicher, strategy, quota_bp=burn_quota_bp
+):
+    steth_amount_to_recover = before_sandwicher_step_in(
+        accounts, dao_voting, lido, oracle, self_owned_steth_burner, sandwicher, quota_bp
+    )
+    entry = step_in(sandwicher, strategy, accounts[0])
+    with results.context(strategy=strategy):
+        return after_sandwicher_step_in(
+            accounts, dao_voting, lido, oracle,
+            self_owned_steth_burner, sandwicher, entry, steth_amount_to_recover, quota_bp
+        )
+
+
+def apply_coverage(steth_burner, dao_voting, oracle, lido, steth_amount):
+    lido.approve(steth_burner.address, steth_amount, { 'from': dao_voting.address })
+
+    steth_burner.requestBurnMyStETHForCover(steth_amount, { 'from': dao_voting.address })
+
+    oracle_report(lido, oracle, 0, check=False)
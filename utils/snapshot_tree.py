@@ -0,0 +1,84 @@
+"""
+Scenario-prefix cache: a tree of EVM snapshots keyed by the setup steps applied
+
+`ScenarioTree.enter(steps)` reverts to the snapshot of the longest already executed prefix
+of `steps` and only sends the transactions of the remaining ones, snapshotting after each.
+
+Ganache drops every snapshot taken after the one it reverts to, so the tree tracks
+the order snapshots were taken in and forgets the nodes a revert invalidates.
+Tests sharing a prefix should therefore run one after another.
+
+"""
+
+from typing import Any, Callable, Dict, Hashable, List, NamedTuple, Optional, Sequence, Tuple
+
+import utils.evm as evm
+
+
+class Step(NamedTuple):
+    key: Hashable
+    fn: Callable[[], Any]
+
+
+def step(key: Hashable, fn: Callable, *args, **kwargs) -> Step:
+    """Setup step `fn(*args, **kwargs)`; `key` must identify the state change it makes."""
+    return Step(key, lambda: fn(*args, **kwargs))
+
+
+def run_steps(steps: Sequence[Step]) -> List[Any]:
+    """Applies `steps` without caching, returns their results."""
+    return [s.fn() for s in steps]
+
+
+class _Node:
+    def __init__(self, snapshot_id: int, seq: int, result: Any = None):
+        self.snapshot_id = snapshot_id
+        self.seq = seq
+        self.result = result
+
+
+class ScenarioTree:
+    def __init__(self):
+        self._nodes: Dict[Tuple, _Node] = {}
+        self._seq = 0
+        self.hits = 0
+        self.misses = 0
+
+    def _snapshot(self, result: Any = None) -> _Node:
+        self._seq += 1
+        return _Node(evm.snapshot(), self._seq, result)
+
+    def _revert(self, prefix: Tuple):
+        node = self._nodes[prefix]
+        self._nodes = {key: n for key, n in self._nodes.items() if n.seq <= node.seq}
+        node.snapshot_id = evm.revert(node.snapshot_id)
+        self._seq += 1
+        node.seq = self._seq
+
+    def enter(self, steps: Sequence[Step]) -> List[Any]:
+        """Brings the chain to the state after `steps`, returns the results of all steps."""
+        if () not in self._nodes:
+            self._nodes[()] = self._snapshot()
+
+        keys = tuple(s.key for s in steps)
+        cached = len(keys)
+        while keys[:cached] not in self._nodes:
+            cached -= 1
+
+        self._revert(keys[:cached])
+        self.hits += cached
+        self.misses += len(keys) - cached
+
+        for ind in range(cached, len(keys)):
+            self._nodes[keys[:ind + 1]] = self._snapshot(steps[ind].fn())
+
+        return [self._nodes[keys[:ind + 1]].result for ind in range(len(keys))]
+
+    def reset(self):
+        """Reverts to the state the tree was first entered from and forgets all prefixes."""
+        if () in self._nodes:
+            self._revert(())
+        self._nodes = {}
+
+    def __len__(self) -> int:
+        return len(self._nodes)
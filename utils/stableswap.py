@@ -0,0 +1,146 @@
+"""
+Off-chain vectorized model of the Curve stETH/ETH StableSwap pool
+
+Mirrors the `exchange` math of `CURVE_STETH_POOL` with NumPy arrays so that
+whole grids of trade sizes and rebase sizes can be evaluated in one call.
+Amounts are wei-denominated float64, so results agree with the pool
+up to float rounding (~1e-12 relative), not to the last wei.
+
+"""
+
+from typing import Tuple, Union
+
+import numpy as np
+
+
+ETH_INDEX = 0
+STETH_INDEX = 1
+
+# ways into stETH before the rebase (see `sandwich_pnl`)
+strategies = ('trade', 'stake')
+
+N_COINS = 2
+A_PRECISION = 100
+FEE_DENOMINATOR = 10**10
+
+MAX_ITERATIONS = 255
+D_TOLERANCE = 1e-14
+
+ArrayLike = Union[float, int, np.ndarray]
+
+
+def get_D(x0: ArrayLike, x1: ArrayLike, amp: ArrayLike) -> np.ndarray:
+    """StableSwap invariant for two coins, solved with Newton iterations elementwise."""
+    x0 = np.asarray(x0, dtype=np.float64)
+    x1 = np.asarray(x1, dtype=np.float64)
+    S = x0 + x1
+    Ann = amp * N_COINS
+    D = S.copy()
+
+    for _ in range(MAX_ITERATIONS):
+        D_P = D / (x0 * N_COINS) * D / (x1 * N_COINS) * D
+        D_prev = D
+        D = (Ann * S + D_P * N_COINS) * D / ((Ann - 1) * D + (N_COINS + 1) * D_P)
+        if np.all(np.abs(D - D_prev) <= D_TOLERANCE * D):
+            break
+
+    return D
+
+
+def get_y(x: ArrayLike, D: ArrayLike, amp: ArrayLike) -> np.ndarray:
+    """
+    Balance of the other coin that keeps the invariant `D` when this coin's balance is `x`.
+
+    For two coins the pool's Newton loop `y = (y*y + c) / (2*y + b - D)` converges to
+    the positive root of `y**2 + (b - D)*y - c = 0`, which is computed in closed form.
+    """
+    x = np.asarray(x, dtype=np.float64)
+    Ann = amp * N_COINS
+    c = D / (x * N_COINS) * D / (Ann * N_COINS) * D
+    b = x + D / Ann
+    k = b - D
+    root = np.sqrt(k * k + 4 * c)
+    # pick the cancellation-free form of the quadratic root
+    return np.where(k > 0, 2 * c / (k + root), (root - k) / 2)
+
+
+class StableSwapPool:
+    """Immutable snapshot of the pool: balances may be scalars or arrays broadcasting over a grid."""
+
+    def __init__(self, balances: Tuple[ArrayLike, ArrayLike], A: ArrayLike, fee: int, admin_fee: int):
+        self.balances = tuple(np.asarray(b, dtype=np.float64) for b in balances)
+        self.A = np.asarray(A, dtype=np.float64)
+        self.fee = fee
+        self.admin_fee = admin_fee
+
+    @classmethod
+    def from_contract(cls, pool) -> 'StableSwapPool':
+        """Seed the model with one batch of reads from the (forked) pool contract."""
+        return cls(
+            (pool.balances(ETH_INDEX), pool.balances(STETH_INDEX)),
+            pool.A_precise() / A_PRECISION,
+            pool.fee(),
+            pool.admin_fee(),
+        )
+
+    def __repr__(self) -> str:
+        return f'StableSwapPool(balances={self.balances}, A={self.A}, fee={self.fee}, admin_fee={self.admin_fee})'
+
+    def get_dy(self, i: int, j: int, dx: ArrayLike) -> np.ndarray:
+        """Amount of coin `j` received for `dx` of coin `i`, net of fee (same as the pool's `get_dy`)."""
+        dy, _ = self.exchange(i, j, dx)
+        return dy
+
+    def exchange(self, i: int, j: int, dx: ArrayLike) -> Tuple[np.ndarray, 'StableSwapPool']:
+        """Returns the amount of coin `j` received and the pool state after the exchange."""
+        dx = np.asarray(dx, dtype=np.float64)
+        xp = self.balances
+
+        D = get_D(xp[0], xp[1], self.A)
+        y = get_y(xp[i] + dx, D, self.A)
+
+        dy = xp[j] - y - 1
+        dy_fee = dy * self.fee / FEE_DENOMINATOR
+        dy_admin_fee = dy_fee * self.admin_fee / FEE_DENOMINATOR
+        dy = dy - dy_fee
+
+        balances = [None, None]
+        balances[i] = xp[i] + dx
+        balances[j] = xp[j] - dy - dy_admin_fee
+
+        return dy, StableSwapPool(tuple(balances), self.A, self.fee, self.admin_fee)
+
+    def rebase(self, factor: ArrayLike) -> 'StableSwapPool':
+        """Pool state after a stETH rebase scaling every stETH balance (the pool's included) by `factor`."""
+        balances = (self.balances[ETH_INDEX], self.balances[STETH_INDEX] * factor)
+        return StableSwapPool(balances, self.A, self.fee, self.admin_fee)
+
+
+def rebase_factor(dpr: ArrayLike) -> np.ndarray:
+    """Holder-side stETH rebase factor for a daily rate `dpr` in basis points (protocol fee excluded)."""
+    return 1. + np.asarray(dpr, dtype=np.float64) / 10000.
+
+
+def sandwich_pnl(pool: StableSwapPool, amounts: ArrayLike, dprs: ArrayLike, strategy: str = 'trade') -> np.ndarray:
+    """
+    Sandwicher ETH PnL of entering before a rebase and swapping stETH back to ETH after it.
+
+    Returns an array of shape `(len(dprs), len(amounts))`.
+
+    strategy:
+        'trade' -- ETH -> stETH via the pool (`CurveExchanger.swapETH2StETH`)
+        'stake' -- ETH -> stETH via Lido submit (`CurveExchanger.stakeETH4StETH`)
+    """
+    amounts = np.atleast_1d(np.asarray(amounts, dtype=np.float64))[np.newaxis, :]
+    factors = rebase_factor(np.atleast_1d(dprs))[:, np.newaxis]
+
+    if strategy == 'trade':
+        steth, entered = pool.exchange(ETH_INDEX, STETH_INDEX, amounts)
+    elif strategy == 'stake':
+        steth, entered = amounts, pool
+    else:
+        raise ValueError(f'unknown strategy {strategy!r}')
+
+    eth, _ = entered.rebase(factors).exchange(STETH_INDEX, ETH_INDEX, steth * factors)
+
+    return eth - amounts
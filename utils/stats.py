@@ -0,0 +1,14 @@
+"""
+Summary statistics shared by the benchmarks and the live monitor
+
+"""
+
+import math
+
+from typing import List
+
+
+def percentile(samples: List[float], q: float) -> float:
+    """Nearest-rank percentile, `q` in [0, 100]."""
+    ordered = sorted(samples)
+    return ordered[max(math.ceil(q / 100 * len(ordered)) - 1, 0)]
@@ -0,0 +1,200 @@
+"""
+Parallel sandwich sweep across a pool of fork nodes
+
+Every grid cell of the MEV and coverage scenarios starts from the same base state
+(exchanger deployed, oracle prepared), so cells can run on any node in any order;
+results are merged back in cell order and match a serial run.
+
+Each worker process holds its node through a file lock, so when a worker dies the pool's
+replacement takes over the node it left, reverted to the fork state first. The cell the dead
+worker was running is lost: the sweep fails after `--cell-timeout` instead of waiting for it
+(`utils/jobqueue.py` retries such cells).
+
+Usage:
+    python -m utils.sweep --network mainnet-fork --workers 8 [--block N] [--out results.json]
+
+"""
+
+import argparse
+import contextlib
+import fcntl
+import json
+import multiprocessing
+import os
+import sys
+import tempfile
+
+from typing import Dict, Iterable, List, Optional
+
+import utils.fork_pool as fork_pool
+import utils.rpc as rpc
+import utils.scenarios as scenarios
+
+
+DEFAULT_CELL_TIMEOUT = 1800.
+
+
+def mev_cells(dprs: Iterable[float] = scenarios.dprs,
+              balances: Iterable[int] = scenarios.sandwitcher_balances) -> List[Dict]:
+    return [
+        {'scenario': 'mev', 'strategy': strategy, 'dpr': dpr, 'balance': balance}
+        for strategy in scenarios.strategies
+        for dpr in dprs
+        for balance in balances
+    ]
+
+
+def coverage_cells(quotas: Iterable[int] = (scenarios.burn_quota_bp,)) -> List[Dict]:
+    return [
+        {'scenario': 'coverage', 'strategy': strategy, 'quota_bp': quota_bp}
+        for strategy in scenarios.strategies
+        for quota_bp in quotas
+    ]
+
+
+# per-process worker state
+_worker = {}
+
+
+def connect_worker(network_id: str, port: int):
+    """Loads the project in this process and attaches brownie to the fork node on `port`."""
+    from brownie import network, project
+    from brownie._config import CONFIG
+
+    project.load(fork_pool.ROOT)
+    CONFIG.networks[network_id]['cmd_settings']['port'] = port
+    network.connect(network_id)
+
+
+def prepare_worker():
+    """Brings the node into the base state shared by all cells and snapshots it."""
+    from brownie import accounts, chain, CurveExchanger
+    from utils.config import contracts, p2p_oracle_address, lido_dao_execution_layer_rewards_vault
+
+    ctx = {
+        'accounts': accounts,
+        'dao_voting': contracts.voting,
+        'lido': contracts.lido,
+        'self_owned_steth_burner': contracts.self_owned_steth_burner,
+    }
+    ctx['oracle'] = scenarios.prepare_oracle(
+        accounts, contracts.oracle, ctx['dao_voting'], p2p_oracle_address, lido_dao_execution_layer_rewards_vault
+    )
+    ctx['sandwicher'] = scenarios.deploy_sandwicher(CurveExchanger, accounts)
+    chain.snapshot()
+    return ctx
+
+
+def run_cell(ctx: Dict, cell: Dict) -> Dict:
+    from brownie import chain
+
+    if cell['scenario'] == 'mev':
+        ctx['oracle'].setAllowedBeaconBalanceAnnualRelativeIncrease(10000, {'from': ctx['dao_voting']})
+        pnl = scenarios.mev_cell(
+            ctx['accounts'], ctx['lido'], ctx['oracle'], ctx['sandwicher'],
+            cell['strategy'], cell['dpr'], cell['balance']
+        )
+        result = {'pnl': pnl}
+    elif cell['scenario'] == 'coverage':
+        pnl, victim_loss = scenarios.coverage_cell(
+            ctx['accounts'], ctx['dao_voting'], ctx['lido'], ctx['oracle'],
+            ctx['self_owned_steth_burner'], ctx['sandwicher'], cell['strategy'], cell['quota_bp']
+        )
+        result = {'pnl': pnl, 'victim_loss': victim_loss}
+    else:
+        raise ValueError(f'unknown scenario {cell["scenario"]!r}')
+
+    chain.revert()
+    return {**cell, **result}
+
+
+def _claim_node(locks_dir: str, ports: List[int]) -> int:
+    """
+    Locks the first node no live worker holds and returns its port.
+
+    The lock is released by the OS however the process ends. It records a snapshot of the fork
+    state taken before the node was first used, which a later holder reverts to.
+    """
+    for port in ports:
+        lock = open(os.path.join(locks_dir, f'{port}.lock'), 'a+')
+        try:
+            fcntl.flock(lock, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            lock.close()
+            continue
+
+        url = f'http://127.0.0.1:{port}'
+        lock.seek(0)
+        fork_state = lock.read().strip()
+        if fork_state:
+            # the node of a worker that died, in whatever state it left it
+            assert rpc.request(url, 'evm_revert', [fork_state]), f'cannot reset the fork node on port {port}'
+        lock.seek(0)
+        lock.truncate()
+        lock.write(rpc.request(url, 'evm_snapshot'))
+        lock.flush()
+        # held for the life of the process
+        _worker['lock'] = lock
+        return port
+    raise RuntimeError(f'all fork nodes on ports {ports} are held by workers')
+
+
+def _init_worker(network_id: str, locks_dir: str, ports: List[int], verbose: bool):
+    if not verbose:
+        sys.stdout = open(os.devnull, 'w')
+    connect_worker(network_id, _claim_node(locks_dir, ports))
+    _worker['ctx'] = prepare_worker()
+
+
+def _run_worker_cell(cell: Dict) -> Dict:
+    return run_cell(_worker['ctx'], cell)
+
+
+def run(cells: List[Dict], network_id: str, workers: int, block: Optional[int] = None,
+        base_port: int = 8600, verbose: bool = False, cell_timeout: float = DEFAULT_CELL_TIMEOUT) -> List[Dict]:
+    """
+    Evaluates `cells` on `workers` fork nodes; results come back in the order of `cells`.
+
+    Raises `multiprocessing.TimeoutError` when the next result takes longer than `cell_timeout`.
+    """
+    nodes = fork_pool.launch(network_id, workers, block, base_port)
+    try:
+        ports = [node.port for node in nodes]
+        with tempfile.TemporaryDirectory(prefix='sweep-nodes-') as locks_dir:
+            initargs = (network_id, locks_dir, ports, verbose)
+            with multiprocessing.get_context('spawn').Pool(workers, initializer=_init_worker, initargs=initargs) as pool:
+                results = pool.imap(_run_worker_cell, cells)
+                return [results.next(cell_timeout) for _ in cells]
+    finally:
+        fork_pool.stop(nodes)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--network', default='mainnet-fork')
+    parser.add_argument('--workers', type=int, default=os.cpu_count())
+    parser.add_argument('--block', type=int, default=None, help='fork block, upstream head by default')
+    parser.add_argument('--base-port', type=int, default=8600)
+    parser.add_argument('--cell-timeout', type=float, default=DEFAULT_CELL_TIMEOUT,
+                        help='seconds to wait for the next result before giving up (e.g. its worker died)')
+    parser.add_argument('--scenario', choices=('all', 'mev', 'coverage'), default='all')
+    parser.add_argument('--out', default=None, help='write results as JSON here instead of stdout')
+    parser.add_argument('-v', '--verbose', action='store_true', help='show scenario logs of the workers')
+    args = parser.parse_args(argv)
+
+    cells = []
+    if args.scenario in ('all', 'mev'):
+        cells += mev_cells()
+    if args.scenario in ('all', 'coverage'):
+        cells += coverage_cells()
+
+    results = run(
+        cells, args.network, min(args.workers, len(cells)), args.block, args.base_port, args.verbose, args.cell_timeout
+    )
+
+    with open(args.out, 'w') if args.out else contextlib.nullcontext(sys.stdout) as out:
+        json.dump(results, out, indent=2)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,412 @@
+"""
+Opcode-level gas profile of scenario transactions
+
+`debug_traceTransaction` struct logs (memory and storage disabled, stack kept) are decoded from the
+HTTP response one step at a time and folded into per-frame counters, so a trace is never held in
+memory. Gas is attributed to `(step, contract, function)`: self gas of the frame, inclusive gas with
+its callees, and cold/warm `SLOAD`/`SSTORE` counts: the first access to a slot in the transaction is
+cold, later ones are warm, and a reverted frame rolls its accesses back, as in EIP-2929. This is a
+classification of the access pattern, not of the gas charged: the forks in `network-config.yaml` run
+`istanbul`, where `SLOAD`/`SSTORE` cost the same cold or warm, so the split shows what Berlin pricing
+would make expensive. Storage slots are counted per contract too, to show what a fork cache could
+pre-warm. Contracts are named from the config addresses (delegatecalls are named after the proxy whose
+storage they run in), functions from the compact ABIs; the selector of an inner call is taken from the
+callee's first `CALLDATALOAD(0)`.
+
+In the tests, `TRACE_PROFILE=<profile.json>` profiles the sandwich step-in and exit transactions and the
+`reportBeacon` completing the quorum, prints the report at session end and writes the profile; two
+profiles are compared with `diff`.
+
+Usage:
+    python -m utils.trace_profile tx <hash> [--url URL] [--label 0xaddress=Name] [--out profile.json]
+    python -m utils.trace_profile report profile.json [--top 25]
+    python -m utils.trace_profile diff before.json after.json [--top 25]
+
+"""
+
+import argparse
+import codecs
+import json
+import urllib.request
+
+from typing import Dict, Iterator, List, Optional, Tuple
+
+from eth_utils import keccak
+
+import utils.rpc as rpc
+
+from utils.abi_cache import abi
+
+
+CALL_OPS = ('CALL', 'CALLCODE', 'DELEGATECALL', 'STATICCALL')
+CREATE_OPS = ('CREATE', 'CREATE2')
+SUCCESS_OPS = ('STOP', 'RETURN', 'SELFDESTRUCT')
+
+TRACE_OPTIONS = {'disableMemory': True, 'disableStorage': True, 'disableStack': False}
+
+# interface name in utils/abi_cache.json -> address key in utils/config_*.py
+_known_contracts = {
+    'Lido': 'lido_dao_steth_address',
+    'LidoOracle': 'lido_dao_oracle',
+    'CurveStETHPool': 'curve_steth_pool_address',
+    'SelfOwnedStETHBurner': 'lido_dao_self_owned_steth_burner',
+    'CompositePostRebaseBeaconReceiver': 'lido_dao_composite_post_rebase_beacon_receiver',
+    'Voting': 'lido_dao_voting_address',
+    'ACL': 'lido_dao_acl_address',
+}
+
+FIELDS = ('calls', 'self_gas', 'gas', 'sload_cold', 'sload_warm', 'sstore_cold', 'sstore_warm')
+
+
+def _type(param: Dict) -> str:
+    if param['type'].startswith('tuple'):
+        return '(' + ','.join(_type(component) for component in param['components']) + ')' + param['type'][5:]
+    return param['type']
+
+
+def selectors(contract_abi: List[Dict]) -> Dict[int, str]:
+    """Function selector -> name of every function in the ABI."""
+    result = {}
+    for entry in contract_abi:
+        if entry.get('type', 'function') == 'function':
+            signature = f'{entry["name"]}({",".join(_type(param) for param in entry.get("inputs", []))})'
+            result[int.from_bytes(keccak(text=signature)[:4], 'big')] = entry['name']
+    return result
+
+
+def struct_logs(url: str, tx_hash: str, timeout: float = 600., chunk_size: int = 1 << 20) -> Iterator[Dict]:
+    """
+    Yields the struct logs of a transaction while the response is still being read.
+
+    Each log is decoded as soon as the buffer holds all of it, whatever it nests (storage, error
+    strings); reading stops at the end of the `structLogs` array.
+    """
+    payload = {'jsonrpc': '2.0', 'id': 1, 'method': 'debug_traceTransaction', 'params': [tx_hash, TRACE_OPTIONS]}
+    request = urllib.request.Request(url, data=json.dumps(payload).encode(), headers={'Content-Type': 'application/json'})
+    decoder = codecs.getincrementaldecoder('utf-8')()
+    parser = json.JSONDecoder()
+
+    with urllib.request.urlopen(request, timeout=timeout) as response:
+        buffer = ''
+        started = False
+        while True:
+            chunk = response.read(chunk_size)
+            buffer += decoder.decode(chunk, final=not chunk)
+            if not started:
+                start = buffer.find('"structLogs"')
+                if start < 0 or buffer.find('[', start) < 0:
+                    if not chunk:
+                        raise rpc.RpcError('debug_traceTransaction', json.loads(buffer).get('error', buffer))
+                    continue
+                buffer = buffer[buffer.index('[', start) + 1:]
+                started = True
+
+            pos = 0
+            while True:
+                while pos < len(buffer) and buffer[pos] in ', \t\r\n':
+                    pos += 1
+                if pos == len(buffer):
+                    break
+                if buffer[pos] == ']':
+                    return
+                try:
+                    log, end = parser.raw_decode(buffer, pos)
+                except json.JSONDecodeError:
+                    # the log continues in the next chunk
+                    if not chunk:
+                        raise
+                    break
+                yield log
+                pos = end
+            buffer = buffer[pos:]
+            if not chunk:
+                raise rpc.RpcError('debug_traceTransaction', 'response ended inside structLogs')
+
+
+def _word(value: str) -> int:
+    return int(value, 16)
+
+
+def _address(word: int) -> str:
+    return '0x' + format(word & (2**160 - 1), '040x')
+
+
+class _Frame:
+    __slots__ = ('contract', 'storage', 'function', 'gas', 'children', 'counts', 'journal', 'call', 'last_op', 'await_selector')
+
+    def __init__(self, contract: str, storage: str, function: Optional[str]):
+        self.contract = contract
+        self.storage = storage
+        self.function = function
+        self.gas = 0
+        self.children = 0
+        self.counts = {'sload_cold': 0, 'sload_warm': 0, 'sstore_cold': 0, 'sstore_warm': 0}
+        # storage keys this frame (and its finished callees) warmed up
+        self.journal: List[Tuple[str, int]] = []
+        # (gas before, callee contract, callee storage) of a call in flight
+        self.call: Optional[Tuple[int, str, str]] = None
+        self.last_op = None
+        self.await_selector = False
+
+
+class TraceProfile:
+    def __init__(self, labels: Optional[Dict[str, str]] = None, abis: Optional[Dict[str, List[Dict]]] = None):
+        """`labels`: address -> contract name on top of the config addresses; `abis`: contract name -> ABI."""
+        self.labels: Dict[str, str] = {}
+        self.functions: Dict[str, Dict[int, str]] = {}
+        self.stats: Dict[Tuple[str, str, str], Dict[str, int]] = {}
+        self.slots: Dict[Tuple[str, str, str], Dict[str, int]] = {}
+        self.transactions: List[Dict] = []
+        self.step = 'tx'
+        self.enabled = False
+        self._config_loaded = False
+        self.label(labels or {}, abis or {})
+
+    def label(self, labels: Dict[str, str], abis: Optional[Dict[str, List[Dict]]] = None):
+        self.labels.update({address.lower(): name for address, name in labels.items()})
+        for name, contract_abi in (abis or {}).items():
+            self.functions[name] = selectors(contract_abi)
+
+    def _load_config(self, network: Optional[str] = None):
+        if self._config_loaded:
+            return
+        from utils.config import addresses
+
+        config = addresses(network)
+        for name, address_key in _known_contracts.items():
+            self.labels.setdefault(config[address_key].lower(), name)
+            self.functions.setdefault(name, selectors(abi(name)))
+        self._config_loaded = True
+
+    def _contract(self, address: str) -> str:
+        return self.labels.get(address.lower(), address[:10])
+
+    def _function(self, contract: str, selector: Optional[int]) -> str:
+        if selector is None:
+            return 'fallback'
+        return self.functions.get(contract, {}).get(selector, f'0x{selector:08x}')
+
+    def _stat(self, key: Tuple[str, str, str]) -> Dict[str, int]:
+        return self.stats.setdefault(key, dict.fromkeys(FIELDS, 0))
+
+    def _finish(self, frame: _Frame, parent: Optional[_Frame], warm: set):
+        stat = self._stat((self.step, frame.contract, frame.function or 'fallback'))
+        stat['calls'] += 1
+        stat['gas'] += frame.gas
+        stat['self_gas'] += frame.gas - frame.children
+        for name, count in frame.counts.items():
+            stat[name] += count
+
+        if frame.last_op not in SUCCESS_OPS:
+            # as in EIP-2929, a reverted frame leaves the accessed set as it found it
+            warm.difference_update(frame.journal)
+        elif parent is not None:
+            parent.journal.extend(frame.journal)
+        if parent is not None:
+            parent.children += frame.gas
+
+    def _storage_access(self, frame: _Frame, op: str, slot: int, warm: set):
+        key = (frame.storage, slot)
+        cold = key not in warm
+        if cold:
+            warm.add(key)
+            frame.journal.append(key)
+        kind = f'{op.lower()}_{"cold" if cold else "warm"}'
+        frame.counts[kind] += 1
+        slot_stat = self.slots.setdefault(
+            (self.step, self._contract(frame.storage), f'0x{slot:x}'), {'sload_cold': 0, 'sload_warm': 0, 'sstore_cold': 0, 'sstore_warm': 0}
+        )
+        slot_stat[kind] += 1
+
+    def add(self, tx_hash: str, step: Optional[str] = None, url: Optional[str] = None) -> int:
+        """Traces one transaction into the profile under `step`. Returns the gas attributed to its steps."""
+        self._load_config()
+        url = url or rpc.provider_url()
+        self.step = step or self.step
+        tx, receipt = rpc.batch(url, [('eth_getTransactionByHash', [tx_hash]), ('eth_getTransactionReceipt', [tx_hash])])
+
+        to = tx['to'] or receipt['contractAddress']
+        root_contract = self._contract(to)
+        data = tx['input']
+        root = _Frame(root_contract, to.lower(), self._function(root_contract, int(data[2:10], 16) if len(data) >= 10 else None))
+        frames = [root]
+        warm = set()
+
+        for log in struct_logs(url, tx_hash):
+            depth = log['depth']
+            op = log['op']
+            stack = log.get('stack') or []
+
+            while len(frames) > depth:
+                self._finish(frames.pop(), frames[-1], warm)
+            frame = frames[-1]
+
+            if len(frames) < depth:
+                # first step of a callee
+                _, contract, storage = frame.call
+                frame = _Frame(contract, storage, None)
+                frames.append(frame)
+            elif frame.call is not None:
+                # back in the caller: the call cost what the callee used plus its own charge
+                frame.gas += frame.call[0] - log['gas']
+                frame.call = None
+
+            if frame.await_selector:
+                frame.function = self._function(frame.contract, _word(stack[-1]) >> 224)
+                frame.await_selector = False
+
+            if op in CALL_OPS:
+                target = _address(_word(stack[-2]))
+                storage = frame.storage if op in ('DELEGATECALL', 'CALLCODE') else target
+                frame.call = (log['gas'], self._contract(storage), storage)
+            elif op in CREATE_OPS:
+                frame.call = (log['gas'], '<create>', '<create>')
+            else:
+                frame.gas += log['gasCost']
+                if op in ('SLOAD', 'SSTORE'):
+                    self._storage_access(frame, op, _word(stack[-1]), warm)
+                elif op == 'CALLDATALOAD' and frame.function is None and _word(stack[-1]) == 0:
+                    frame.await_selector = True
+            frame.last_op = op
+
+        while frames:
+            frame = frames.pop()
+            self._finish(frame, frames[-1] if frames else None, warm)
+
+        traced = root.gas
+        self.transactions.append({
+            'step': self.step, 'tx': tx_hash, 'gas_used': int(receipt['gasUsed'], 16), 'traced_gas': traced,
+        })
+        return traced
+
+    # scenario hook
+
+    def observe(self, step: str, receipt):
+        """Profiles a brownie receipt when enabled; call it before the chain is reverted past the transaction."""
+        if self.enabled and receipt is not None:
+            self.add(receipt.txid, step)
+
+    # output
+
+    def summary(self) -> List[Dict]:
+        rows = [
+            {'step': step, 'contract': contract, 'function': function, **stat}
+            for (step, contract, function), stat in self.stats.items()
+        ]
+        return sorted(rows, key=lambda row: row['self_gas'], reverse=True)
+
+    def to_json(self) -> Dict:
+        return {
+            'functions': self.summary(),
+            'slots': [
+                {'step': step, 'contract': contract, 'slot': slot, **counts}
+                for (step, contract, slot), counts in self.slots.items()
+            ],
+            'transactions': self.transactions,
+        }
+
+    def dump(self, path: str):
+        with open(path, 'w') as f:
+            json.dump(self.to_json(), f, indent=1)
+
+    def report(self, top: int = 25) -> str:
+        return format_report(self.to_json(), top)
+
+
+def load(path: str) -> Dict:
+    with open(path) as f:
+        return json.load(f)
+
+
+def _storage_columns(row: Dict) -> str:
+    return f'SLOAD {row["sload_cold"]:5}c {row["sload_warm"]:5}w  SSTORE {row["sstore_cold"]:4}c {row["sstore_warm"]:4}w'
+
+
+def format_report(profile: Dict, top: int = 25) -> str:
+    transactions = profile['transactions']
+    lines = [
+        f'{len(transactions)} transactions, {sum(tx["gas_used"] for tx in transactions)} gas used, '
+        f'{sum(tx["traced_gas"] for tx in transactions)} in traced steps (the rest is intrinsic gas and refunds)',
+        '', f'top {top} functions by self gas:',
+    ]
+    for row in profile['functions'][:top]:
+        lines.append(
+            f'{row["self_gas"]:10} self {row["gas"]:10} incl {row["calls"]:5} calls  {_storage_columns(row)}  '
+            f'{row["contract"]}.{row["function"]}  [{row["step"]}]'
+        )
+
+    cold = sorted(profile['slots'], key=lambda row: row['sload_cold'] + row['sstore_cold'], reverse=True)
+    lines += ['', f'top {top} cold storage slots:']
+    for row in cold[:top]:
+        lines.append(f'{_storage_columns(row)}  {row["contract"]} {row["slot"]}  [{row["step"]}]')
+    return '\n'.join(lines)
+
+
+def diff(before: Dict, after: Dict) -> List[Dict]:
+    """Per `(step, contract, function)` changes of every counter, largest self gas change first."""
+    def keyed(profile):
+        return {(row['step'], row['contract'], row['function']): row for row in profile['functions']}
+
+    old, new = keyed(before), keyed(after)
+    empty = dict.fromkeys(FIELDS, 0)
+    rows = []
+    for key in sorted(set(old) | set(new)):
+        a, b = old.get(key, empty), new.get(key, empty)
+        change = {name: b[name] - a[name] for name in FIELDS}
+        if any(change.values()):
+            rows.append({'step': key[0], 'contract': key[1], 'function': key[2], **change})
+    return sorted(rows, key=lambda row: abs(row['self_gas']), reverse=True)
+
+
+def format_diff(rows: List[Dict], top: int = 25) -> str:
+    lines = [f'{len(rows)} functions changed', '']
+    for row in rows[:top]:
+        lines.append(
+            f'{row["self_gas"]:+10} self {row["gas"]:+10} incl {row["calls"]:+5} calls  '
+            f'SLOAD {row["sload_cold"]:+5}c {row["sload_warm"]:+5}w  SSTORE {row["sstore_cold"]:+4}c {row["sstore_warm"]:+4}w  '
+            f'{row["contract"]}.{row["function"]}  [{row["step"]}]'
+        )
+    return '\n'.join(lines)
+
+
+profiler = TraceProfile()
+observe = profiler.observe
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    tx_parser = commands.add_parser('tx', help='profile one transaction')
+    tx_parser.add_argument('hash')
+    tx_parser.add_argument('--url', default='http://127.0.0.1:8545')
+    tx_parser.add_argument('--network', default='mainnet', help='address table of utils/config.py')
+    tx_parser.add_argument('--label', action='append', default=[], help='0xaddress=Name, repeatable')
+    tx_parser.add_argument('--out', default=None, help='write the profile as JSON here')
+
+    report_parser = commands.add_parser('report', help='print a saved profile')
+    report_parser.add_argument('profile')
+
+    diff_parser = commands.add_parser('diff', help='compare two saved profiles')
+    diff_parser.add_argument('before')
+    diff_parser.add_argument('after')
+
+    for sub in (tx_parser, report_parser, diff_parser):
+        sub.add_argument('--top', type=int, default=25)
+    args = parser.parse_args(argv)
+
+    if args.command == 'tx':
+        profile = TraceProfile(dict(label.split('=', 1) for label in args.label))
+        profile._load_config(args.network)
+        profile.add(args.hash, 'tx', args.url)
+        print(profile.report(args.top))
+        if args.out:
+            profile.dump(args.out)
+    elif args.command == 'report':
+        print(format_report(load(args.profile), args.top))
+    else:
+        print(format_diff(diff(load(args.before), load(args.after)), args.top))
+
+
+if __name__ == '__main__':
+    main()